@@ -0,0 +1,42 @@
+"""
+Analyzer benchmark
+
+Times analyze_frame on parsed synthetic line data, and analyze_data on
+the equivalent list-of-dicts input for comparison.
+
+Run from the backend directory:
+    python -m benchmarks.bench_analyzer
+"""
+
+import sys
+import time
+
+from benchmarks.synthetic import generate, joined
+from services.analyzer import analyze_data, analyze_frame
+from services.parser import parse_columns
+
+SIZES = [100_000, 1_000_000, 3_000_000]
+
+
+def main(sizes=SIZES):
+    print(f"{'rows':>10} {'analyze_frame':>14} {'analyze_data':>14}")
+    for rows in sizes:
+        lines = parse_columns(joined(*generate(rows)))
+
+        start = time.perf_counter()
+        analyze_frame(lines)
+        frame_elapsed = time.perf_counter() - start
+
+        parsed = {
+            'products': lines.drop(columns='transactionId').to_dict('records'),
+            'transactions': lines[['transactionId', 'productId']].to_dict('records'),
+        }
+        start = time.perf_counter()
+        analyze_data(parsed)
+        dict_elapsed = time.perf_counter() - start
+
+        print(f"{rows:>10} {frame_elapsed * 1000:>12.1f}ms {dict_elapsed * 1000:>12.1f}ms")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
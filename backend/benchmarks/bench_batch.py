@@ -0,0 +1,46 @@
+"""
+Batch upload benchmark
+
+Runs the per-file step of /api/upload/batch (ingest.analyze_store) over N
+synthetic store files in process pools of 1 up to cpu_count workers,
+plus the rollup merge, to show how batch time scales with cores.
+
+Run from the backend directory:
+    python -m benchmarks.bench_batch [files] [rows]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import generate, joined
+from services.ingest import analyze_store
+from services.analyzer import merge_analyses
+
+
+def analyze_upload(args):
+    return analyze_store(*args)
+
+
+def main(files: int = 8, rows: int = 200_000):
+    uploads = [(joined(*generate(rows, seed=i)).to_csv(index=False).encode(), f"store{i}.csv") for i in range(files)]
+    print(f"files={files} rows/file={rows}")
+    print(f"{'workers':>8} {'seconds':>10}")
+    workers = 1
+    while True:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Start the workers so process start-up is not measured
+            list(pool.map(abs, range(workers)))
+            start = time.perf_counter()
+            results = list(pool.map(analyze_upload, uploads))
+            merge_analyses([analysis for _, analysis, _ in results])
+            elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {elapsed:>10.2f}")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count() or 1)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,51 @@
+"""
+Compact lines benchmark
+
+Compares the memory held by parsed line data in three forms: the legacy
+list-of-dicts from parse_excel_file, the parse_columns DataFrame and
+CompactLines from parse_compact. Memory is what tracemalloc still sees
+allocated once the result is built (the input frame is excluded).
+
+Run from the backend directory:
+    python -m benchmarks.bench_compact
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from benchmarks.synthetic import generate, joined
+from services.parser import parse_columns, parse_compact, parse_excel_file
+
+SIZES = [17_000, 100_000, 1_000_000]
+
+
+def held_memory(build):
+    """Bytes still allocated after build() returns, and its run time"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return held, elapsed
+
+
+def main(sizes=SIZES):
+    print(f"{'rows':>10} {'form':>12} {'MB':>10} {'seconds':>10} {'vs dicts':>10}")
+    for rows in sizes:
+        df = joined(*generate(rows))
+        dicts = None
+        for name, build in [('dicts', lambda: parse_excel_file(df)),
+                            ('frame', lambda: parse_columns(df)),
+                            ('compact', lambda: parse_compact(df))]:
+            held, elapsed = held_memory(build)
+            dicts = dicts or held
+            print(f"{rows:>10} {name:>12} {held / 1e6:>10.1f} {elapsed:>10.3f} {dicts / held:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
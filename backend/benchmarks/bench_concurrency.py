@@ -0,0 +1,78 @@
+"""
+Concurrency benchmark
+
+Sends N parallel CSV uploads through the ASGI app in-process while
+polling /health, and reports p50/p99 latency for both. With the CPU pool
+the health checks stay fast; with CPU_EXECUTOR=thread (or the old inline
+handlers) they queue behind the uploads.
+
+Run from the backend directory:
+    python -m benchmarks.bench_concurrency [parallel] [rows]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+from benchmarks.synthetic import generate, joined
+from main import app
+from services.cache import result_cache
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    response = await coro
+    return response, (time.perf_counter() - start) * 1000
+
+
+async def run(parallel: int, rows: int):
+    # Distinct files per request so the result cache cannot short-circuit
+    payloads = [joined(*generate(rows, seed=i)).to_csv(index=False).encode() for i in range(parallel)]
+    result_cache.max_bytes = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm up the worker pool so process start-up is not measured
+        await client.post("/api/upload", files={"file": ("warm.csv", payloads[0])})
+
+        health_latencies = []
+        done = asyncio.Event()
+
+        async def poll_health():
+            while not done.is_set():
+                _, elapsed = await timed(client.get("/health"))
+                health_latencies.append(elapsed)
+                await asyncio.sleep(0.01)
+
+        poller = asyncio.create_task(poll_health())
+        results = await asyncio.gather(*[
+            timed(client.post("/api/upload", files={"file": (f"bench{i}.csv", payload)}))
+            for i, payload in enumerate(payloads)
+        ])
+        done.set()
+        await poller
+
+    upload_latencies = [elapsed for _, elapsed in results]
+    statuses = [response.status_code for response, _ in results]
+    print(f"parallel={parallel} rows={rows} statuses={dict((s, statuses.count(s)) for s in set(statuses))}")
+    print(f"upload  p50={percentile(upload_latencies, 50):8.1f}ms p99={percentile(upload_latencies, 99):8.1f}ms")
+    print(f"health  p50={percentile(health_latencies, 50):8.1f}ms p99={percentile(health_latencies, 99):8.1f}ms "
+          f"(n={len(health_latencies)}, mean={statistics.mean(health_latencies):.1f}ms)")
+
+
+def main():
+    parallel = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    asyncio.run(run(parallel, rows))
+
+
+if __name__ == "__main__":
+    main()
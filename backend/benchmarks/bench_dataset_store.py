@@ -0,0 +1,43 @@
+"""
+Dataset store benchmark
+
+Saves a parsed synthetic dataset and times cold reads through
+analyze_dataset (the /api/stats path), compared with re-parsing.
+
+Run from the backend directory:
+    python -m benchmarks.bench_dataset_store [rows]
+"""
+
+import os
+import sys
+import time
+
+from benchmarks.synthetic import generate, joined
+from services.analyzer import analyze_frame
+from services.dataset_store import DATASET_DIR, analyze_dataset, save_dataset
+from services.parser import parse_columns
+
+
+def main(rows: int = 1_000_000):
+    df = joined(*generate(rows))
+    dataset_id = 'b' * 32
+
+    start = time.perf_counter()
+    lines = parse_columns(df)
+    analyze_frame(lines)
+    reparse = time.perf_counter() - start
+
+    save_dataset(dataset_id, lines, 'bench.csv')
+    size = os.path.getsize(os.path.join(DATASET_DIR, f"{dataset_id}.arrow"))
+
+    start = time.perf_counter()
+    analyze_dataset(dataset_id)
+    cold = time.perf_counter() - start
+
+    print(f"rows={rows} file={size / 1e6:.1f}MB")
+    print(f"parse + analyze      {reparse * 1000:8.1f}ms")
+    print(f"stored dataset query {cold * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
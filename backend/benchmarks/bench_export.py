@@ -0,0 +1,77 @@
+"""
+PDF export benchmark
+
+Renders reports with growing category and high-risk tables and reports
+render time, page count and peak Python memory (tracemalloc) for each
+size (time and memory come from separate runs, since tracemalloc slows
+rendering down). The same report is also rendered as one Table per section, to show
+what cutting tables into TABLE_CHUNK_ROWS pieces saves.
+
+Run from the backend directory:
+    python -m benchmarks.bench_export [rows ...]
+"""
+
+import io
+import sys
+import time
+import tracemalloc
+
+import services.report as report
+
+
+def make_analysis(rows: int) -> dict:
+    categories = max(rows // 10, 1)
+    return {
+        'totalProducts': rows * 10,
+        'totalTransactions': rows * 5,
+        'overallAdoptionRate': 42.5,
+        'categoryBreakdown': [
+            {'category': f"Category {i}", 'count': 10, 'percentage': 0.1} for i in range(categories)
+        ],
+        'zeroWasteAdoption': [
+            {'category': f"Category {i}", 'zeroWasteCount': 4, 'totalCount': 10, 'adoptionRate': 40.0}
+            for i in range(categories)
+        ],
+        'highRiskProducts': [
+            {'productId': f"P{i:07d}", 'description': f"Product description number {i} with some extra words",
+             'category': f"Category {i % categories}", 'transactionCount': rows - i, 'hasZeroWaste': False}
+            for i in range(rows)
+        ],
+        'insights': {'summary': 'Summary.', 'consumer': 'Consumer.', 'business': 'Business.', 'policy': 'Policy.'},
+    }
+
+
+def render_time(data: dict):
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    report.build_pdf(data, buffer)
+    elapsed = time.perf_counter() - start
+    pages = buffer.getvalue().count(b'/Type /Page\n')
+    return elapsed, pages, len(buffer.getvalue())
+
+
+def peak_memory(data: dict) -> int:
+    tracemalloc.start()
+    report.build_pdf(data, io.BytesIO())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(sizes):
+    chunk_rows = report.TABLE_CHUNK_ROWS
+    print(f"{'rows':>8} {'pages':>6} {'bytes':>10} {'render':>9} {'peak MB':>8} {'unchunked':>10}")
+    for rows in sizes:
+        data = make_analysis(rows)
+        elapsed, pages, size = render_time(data)
+        peak = peak_memory(data)
+
+        report.TABLE_CHUNK_ROWS = max(rows, 1)
+        single, _, _ = render_time(data)
+        report.TABLE_CHUNK_ROWS = chunk_rows
+
+        print(f"{rows:>8} {pages:>6} {size:>10} {elapsed * 1000:>7.0f}ms {peak / 1e6:>8.1f} {single * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [100, 1_000, 5_000, 10_000])
@@ -0,0 +1,95 @@
+"""
+Upload format benchmark
+
+Writes the same synthetic data as XLSX (two sheets), CSV, Parquet,
+Arrow IPC, a JSON document like data/full-circle-foods-data.json and
+NDJSON, then times read_upload (format detection plus reading into the
+frame parse_columns takes) on each. Every read runs in a fresh process,
+and memory is how much its peak RSS (VmHWM, so Linux only) grew during
+the read, so Arrow's allocations (which tracemalloc can't see) are
+counted too.
+
+Run from the backend directory:
+    python -m benchmarks.bench_formats [lines...]
+"""
+
+import io
+import json
+import multiprocessing
+import sys
+import time
+
+import pyarrow as pa
+
+from benchmarks.synthetic import generate, joined, write_json, write_parquet, write_xlsx
+
+SIZES = [17_500, 200_000]
+
+
+def encode_all(lines: int) -> dict:
+    """The same data in every upload format, as bytes"""
+    line_sheet, transactions = generate(lines)
+    flat = joined(line_sheet, transactions)
+    files = {}
+
+    xlsx = io.BytesIO()
+    write_xlsx(xlsx, line_sheet, transactions)
+    files['xlsx'] = xlsx.getvalue()
+    files['csv'] = flat.to_csv(index=False).encode()
+
+    parquet = io.BytesIO()
+    write_parquet(parquet, flat)
+    files['parquet'] = parquet.getvalue()
+
+    table = pa.Table.from_pandas(flat, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    files['arrow'] = sink.getvalue().to_pybytes()
+
+    document = io.StringIO()
+    write_json(document, line_sheet, transactions)
+    files['json'] = document.getvalue().encode()
+    parsed = json.loads(files['json'])
+    files['ndjson'] = '\n'.join(
+        json.dumps(record) for record in parsed['transactions'] + parsed['lines']
+    ).encode()
+    return files
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process, in bytes"""
+    # ru_maxrss would include the parent's peak from before the spawn's exec
+    with open('/proc/self/status') as f:
+        line = next(line for line in f if line.startswith('VmHWM:'))
+    return int(line.split()[1]) * 1024
+
+
+def measure(contents: bytes) -> tuple:
+    """Seconds, peak RSS growth (bytes) and rows of one read_upload, in this process"""
+    from services.readers import read_upload
+
+    before = peak_rss()
+    start = time.perf_counter()
+    df = read_upload(contents)
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss() - before, len(df)
+
+
+def main(sizes=SIZES):
+    context = multiprocessing.get_context('spawn')
+    print(f"{'lines':>10} {'format':>8} {'file MB':>8} {'seconds':>10} {'peak MB':>8} {'vs xlsx':>8}")
+    for lines in sizes:
+        files = encode_all(lines)
+        xlsx_seconds = None
+        for name, contents in files.items():
+            with context.Pool(1) as pool:
+                elapsed, grown, rows = pool.apply(measure, (contents,))
+            xlsx_seconds = xlsx_seconds or elapsed
+            assert rows == lines, (name, rows)
+            print(f"{lines:>10} {name:>8} {len(contents) / 1e6:>8.1f} {elapsed:>10.3f} "
+                  f"{grown / 1e6:>8.1f} {xlsx_seconds / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
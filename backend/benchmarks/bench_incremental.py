@@ -0,0 +1,54 @@
+"""
+Incremental append benchmark
+
+Splits synthetic line data into daily files, uploads the first day and
+appends the rest (with one day re-sent to exercise deduplication). After
+each append the incremental analysis is checked against a full
+recompute of the stored dataset, and the two are timed.
+
+Run from the backend directory:
+    python -m benchmarks.bench_incremental [rows] [days]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import generate, joined
+from services.dataset_store import analyze_dataset, append_lines, save_dataset
+from services.parser import parse_columns
+
+
+def main(rows: int = 300_000, days: int = 10):
+    lines = parse_columns(joined(*generate(rows)))
+    bounds = np.linspace(0, len(lines), days + 1).astype(int)
+    daily = [lines.iloc[a:b].reset_index(drop=True) for a, b in zip(bounds[:-1], bounds[1:])]
+    dataset_id = 'c' * 32
+    save_dataset(dataset_id, daily[0], 'day0.csv')
+
+    # Day 3 is sent twice; the second copy must be dropped entirely
+    batches = list(enumerate(daily[1:], start=1))
+    batches.insert(3, (3, daily[3]))
+
+    print(f"{'day':>4} {'new rows':>9} {'dupes':>7} {'append':>10} {'recompute':>10}")
+    for day, batch in batches:
+        start = time.perf_counter()
+        # Each append makes a new dataset; the next one builds on it
+        dataset_id, incremental = append_lines(dataset_id, batch, f"day{day}")
+        append_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        full = analyze_dataset(dataset_id)
+        recompute_time = time.perf_counter() - start
+
+        appended = incremental.pop('appended')
+        assert incremental == full, f"incremental analysis differs from recompute on day {day}"
+        print(f"{day:>4} {appended['rows']:>9} {appended['duplicateRows']:>7} "
+              f"{append_time * 1000:>8.1f}ms {recompute_time * 1000:>8.1f}ms")
+    print("incremental results match full recompute")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
@@ -0,0 +1,65 @@
+"""
+Insight generation benchmark
+
+Fires N concurrent insight requests at a stub backend with a fixed delay
+and reports latency and backend calls for: distinct metrics (no sharing),
+identical metrics (coalesced into one call), a warm cache, and a backend
+slower than the latency budget (template returned at the budget).
+
+Run from the backend directory:
+    python -m benchmarks.bench_insights [requests] [backend_delay_s] [budget_s]
+"""
+
+import asyncio
+import sys
+import time
+
+from services.ai_service import InsightService, StubBackend
+
+
+def metrics(i: int) -> dict:
+    return {
+        'totalProducts': 1000 + i,
+        'overallAdoptionRate': 42.0,
+        'categoryBreakdown': [{'category': 'Pantry', 'count': 300}],
+        'highRiskProducts': [],
+    }
+
+
+async def timed_batch(service: InsightService, payloads) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*[service.get(p) for p in payloads])
+    return (time.perf_counter() - start) * 1000
+
+
+async def run(requests: int, delay: float, budget: float):
+    backend = StubBackend(delay)
+    service = InsightService(backend, latency_budget=None)
+    elapsed = await timed_batch(service, [metrics(i) for i in range(requests)])
+    print(f"distinct   {elapsed:8.1f}ms  backend calls={backend.calls}")
+
+    backend = StubBackend(delay)
+    service = InsightService(backend, latency_budget=None)
+    elapsed = await timed_batch(service, [metrics(0)] * requests)
+    print(f"identical  {elapsed:8.1f}ms  backend calls={backend.calls}")
+
+    elapsed = await timed_batch(service, [metrics(0)] * requests)
+    print(f"cached     {elapsed:8.1f}ms  backend calls={backend.calls}")
+
+    backend = StubBackend(delay)
+    service = InsightService(backend, latency_budget=budget)
+    elapsed = await timed_batch(service, [metrics(0)] * requests)
+    print(f"budget     {elapsed:8.1f}ms  backend calls={backend.calls} fallbacks={service.fallbacks}")
+    await asyncio.sleep(delay)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    budget = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    print(f"requests={requests} backend_delay={delay}s budget={budget}s")
+    asyncio.run(run(requests, delay, budget))
+
+
+if __name__ == "__main__":
+    main()
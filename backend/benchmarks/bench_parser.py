@@ -0,0 +1,32 @@
+"""
+Parser benchmark
+
+Measures parse_columns throughput (rows/sec) on synthetic line data
+from benchmarks.synthetic (Lines joined with Transactions, like a
+CSV export).
+
+Run from the backend directory:
+    python -m benchmarks.bench_parser
+"""
+
+import sys
+import time
+
+from benchmarks.synthetic import generate, joined
+from services.parser import parse_columns
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def main(sizes=SIZES):
+    print(f"{'rows':>10} {'seconds':>10} {'rows/sec':>14}")
+    for rows in sizes:
+        df = joined(*generate(rows))
+        start = time.perf_counter()
+        parse_columns(df)
+        elapsed = time.perf_counter() - start
+        print(f"{rows:>10} {elapsed:>10.3f} {rows / elapsed:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,71 @@
+"""
+Response serialization benchmark
+
+Builds analysis responses from synthetic data (the usual top-20 upload
+response, and a full one listing every high-risk product, the size a
+batch store or a dataset export sees) and times turning each into bytes
+the old way (jsonable_encoder plus JSONResponse's json.dumps) and with
+encode_json. Then reports the bytes on the wire and the time taken for
+each response encoding.
+
+Run from the backend directory:
+    python -m benchmarks.bench_responses [lines] [products]
+"""
+
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.synthetic import generate, joined
+from services.analyzer import analyze_frame
+from services.parser import parse_columns
+from services.responses import ENCODINGS, compress, encode_json
+
+REPEAT = 5
+
+
+def best_of(fn, repeat: int = REPEAT):
+    """(result, fastest seconds) of repeat calls"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def stdlib_json(payload: dict) -> bytes:
+    return JSONResponse(content=None).render(jsonable_encoder(payload))
+
+
+def main(rows: int = 1_000_000, products: int = 200_000):
+    lines = parse_columns(joined(*generate(rows, products=products)))
+    insights = {'summary': 'Summary.', 'consumer': 'Consumer.', 'business': 'Business.', 'policy': 'Policy.'}
+    payloads = {
+        'top 20': {**analyze_frame(lines), 'insights': insights, 'datasetId': '0' * 32},
+        'full': {**analyze_frame(lines, high_risk_limit=None), 'insights': insights, 'datasetId': '0' * 32},
+    }
+    print(f"lines={rows} products={products}")
+    print(f"{'payload':>8} {'encoder':>9} {'ms':>9} {'speedup':>8}")
+    for name, payload in payloads.items():
+        old, old_seconds = best_of(lambda: stdlib_json(payload))
+        new, new_seconds = best_of(lambda: encode_json(payload))
+        assert len(new) <= len(old)
+        print(f"{name:>8} {'stdlib':>9} {old_seconds * 1000:>9.2f}")
+        print(f"{name:>8} {'orjson':>9} {new_seconds * 1000:>9.2f} {old_seconds / new_seconds:>7.1f}x")
+
+    print()
+    print(f"{'payload':>8} {'encoding':>9} {'bytes':>12} {'ratio':>8} {'ms':>9}")
+    for name, payload in payloads.items():
+        body = encode_json(payload)
+        print(f"{name:>8} {'identity':>9} {len(body):>12,} {1:>8.1f}")
+        for encoding in ENCODINGS:
+            encoded, seconds = best_of(lambda: compress(body, encoding))
+            print(f"{name:>8} {encoding:>9} {len(encoded):>12,} {len(body) / len(encoded):>8.1f} "
+                  f"{seconds * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,66 @@
+"""
+Approximate analysis benchmark
+
+Streams synthetic lines with many distinct products and transactions in
+chunks through the exact RunningAnalysis and the sketch-based
+SketchAnalysis, and reports the memory each keeps between chunks
+(tracemalloc, after the last chunk), the run time, how many of the
+exact top 20 high-risk products the sketch found, its largest count
+error and its distinct-count errors.
+
+Run from the backend directory:
+    python -m benchmarks.bench_sketches [lines] [products]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from benchmarks.synthetic import generate, joined
+from services.analyzer import RunningAnalysis, SketchAnalysis
+from services.parser import parse_columns
+
+CHUNK_ROWS = 100_000
+
+
+def run(aggregate, lines):
+    """Fold lines into aggregate chunk by chunk; returns (result, held bytes, seconds)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for offset in range(0, len(lines), CHUNK_ROWS):
+        aggregate.add(lines.iloc[offset:offset + CHUNK_ROWS])
+    result = aggregate.result()
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, held, elapsed
+
+
+def main(rows: int = 2_000_000, products: int = 500_000):
+    lines = parse_columns(joined(*generate(rows, products=products, customers=rows // 20)))
+    print(f"lines={rows} products={products} (distinct in data: {lines['productId'].nunique()})")
+
+    exact, exact_held, exact_seconds = run(RunningAnalysis(), lines)
+    approx, approx_held, approx_seconds = run(SketchAnalysis(), lines)
+    print(f"{'':>8} {'MB held':>10} {'seconds':>10}")
+    print(f"{'exact':>8} {exact_held / 1e6:>10.1f} {exact_seconds:>10.2f}")
+    print(f"{'sketch':>8} {approx_held / 1e6:>10.1f} {approx_seconds:>10.2f}")
+
+    true_counts = {p['productId']: p['transactionCount'] for p in exact['highRiskProducts']}
+    found = [p for p in approx['highRiskProducts'] if p['productId'] in true_counts]
+    worst = max((true_counts[p['productId']] - p['transactionCount'] for p in found), default=0)
+    bounds = approx['approximate']
+    print(f"top {len(true_counts)} found: {len(found)}, "
+          f"largest count error: {worst} (bound {bounds['highRiskProducts']['maxCountError']})")
+    for name, column in [('distinctProducts', 'productId'), ('distinctTransactions', 'transactionId'),
+                         ('distinctCustomers', 'customer')]:
+        true = lines[column].nunique()
+        estimate = bounds[name]['estimate']
+        print(f"{name:>22} {estimate:>10} true {true:>10} error {estimate / true - 1:>+8.2%} "
+              f"(standard error {bounds[name]['relativeError']:.2%})")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
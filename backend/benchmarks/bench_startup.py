@@ -0,0 +1,124 @@
+"""
+Cold start benchmark
+
+Measures, each in a fresh interpreter:
+  - import time of the app (import main), and which of the lazily loaded
+    modules (LAZY_MODULES) it pulled in anyway
+  - time from launching uvicorn to the first healthy /health answer,
+    and to the background warm-up finishing (warm: done)
+
+and checks them against IMPORT_BUDGET_SECONDS and HEALTHY_BUDGET_SECONDS.
+Exits with status 1 when a median is over its budget or a lazy module was
+imported eagerly, so it can gate a CI job.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup [runs]
+"""
+
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Budgets for the median of the runs
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", 1.2))
+HEALTHY_BUDGET_SECONDS = float(os.getenv("HEALTHY_BUDGET_SECONDS", 2.0))
+
+# Modules that must load on first use, not when the app is imported
+LAZY_MODULES = ['anthropic', 'reportlab', 'openpyxl', 'pandas', 'numpy', 'pyarrow']
+
+# Seconds to wait for the server before giving up
+SERVER_TIMEOUT = 60
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'eager': [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_import() -> dict:
+    out = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_health(port: int):
+    """/health as a dict, or None while the server is not answering"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+            return json.loads(response.read())
+    except OSError:
+        return None
+
+
+def measure_server() -> dict:
+    """Seconds from launch to the first healthy /health, and to warm: done"""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    healthy = warm = None
+    try:
+        while time.perf_counter() - start < SERVER_TIMEOUT:
+            health = get_health(port)
+            if health is not None and healthy is None:
+                healthy = time.perf_counter() - start
+            if health is not None and health.get('warm') in ('done', 'failed', 'off'):
+                warm = time.perf_counter() - start
+                break
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    if healthy is None:
+        raise RuntimeError(f"server did not answer /health within {SERVER_TIMEOUT}s")
+    return {'healthy': healthy, 'warm': warm}
+
+
+def main(runs: int = 5) -> int:
+    imports = [measure_import() for _ in range(runs)]
+    servers = [measure_server() for _ in range(runs)]
+
+    import_median = statistics.median(run['seconds'] for run in imports)
+    healthy_median = statistics.median(run['healthy'] for run in servers)
+    warm_times = [run['warm'] for run in servers if run['warm'] is not None]
+    eager = sorted({module for run in imports for module in run['eager']})
+
+    failures = []
+    print(f"{'measure':>16} {'median s':>10} {'max s':>8} {'budget s':>9}")
+    print(f"{'import main':>16} {import_median:>10.3f} {max(r['seconds'] for r in imports):>8.3f} "
+          f"{IMPORT_BUDGET_SECONDS:>9.2f}")
+    print(f"{'first /health':>16} {healthy_median:>10.3f} {max(r['healthy'] for r in servers):>8.3f} "
+          f"{HEALTHY_BUDGET_SECONDS:>9.2f}")
+    if warm_times:
+        print(f"{'warm-up done':>16} {statistics.median(warm_times):>10.3f} {max(warm_times):>8.3f}")
+    print(f"lazy modules imported eagerly: {', '.join(eager) or 'none'}")
+
+    if import_median > IMPORT_BUDGET_SECONDS:
+        failures.append('import')
+    if healthy_median > HEALTHY_BUDGET_SECONDS:
+        failures.append('first /health')
+    if eager:
+        failures.append('lazy imports')
+    if failures:
+        print(f"over budget: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:2]]))
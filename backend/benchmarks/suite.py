@@ -0,0 +1,241 @@
+"""
+Benchmark suite for the ingest pipeline
+
+Generates synthetic data (benchmarks.synthetic) once and times each
+stage on it: CSV, XLSX, Parquet and JSON reads, parsing (parse_excel_file,
+parse_columns, parse_compact), analysis (analyze_data, analyze_frame,
+analyze_compact), insights from a stub AI backend, PDF export, and
+end-to-end POST /api/upload through an in-process ASGI client.
+
+Results are written as JSON (per-scenario min/median/mean seconds and
+rows/sec, plus the machine, package versions, git commit and data
+scale). Given a baseline file from an earlier run, scenarios whose median
+got slower by more than the threshold are flagged and the exit status
+is 1.
+
+Run from the backend directory:
+    python -m benchmarks.suite --lines 200000 --output after.json --compare before.json
+"""
+
+import os
+import tempfile
+
+# Set before the app is imported: no real AI calls, and datasets go to a
+# scratch directory instead of the server's
+os.environ.setdefault("INSIGHTS_BACKEND", "stub")
+os.environ.setdefault("DATASET_DIR", tempfile.mkdtemp(prefix="bench-datasets-"))
+
+import argparse
+import asyncio
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from benchmarks.synthetic import generate, joined, write_json, write_parquet, write_xlsx
+from main import app
+from services.ai_service import InsightService, StubBackend
+from services.analyzer import analyze_compact, analyze_data, analyze_frame
+from services.cache import result_cache
+from services.executor import shutdown_pools
+from services.loader import load_excel
+from services.parser import parse_columns, parse_compact, parse_excel_file
+from services.readers import read_upload
+from services.report import build_pdf
+
+# Slowdown (as a fraction of the baseline median) flagged as a regression
+DEFAULT_THRESHOLD = 0.10
+
+
+def measure(fn: Callable[[], Any], repeat: int, rows: Optional[int] = None) -> Dict[str, Any]:
+    """Run fn repeat times and summarize the timings"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, rows)
+
+
+def summarize(timings: List[float], rows: Optional[int] = None) -> Dict[str, Any]:
+    """min/median/mean seconds, plus rows/sec at the median when rows is given"""
+    result = {
+        'repeat': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
+    if rows is not None:
+        result['rows'] = rows
+        result['rowsPerSec'] = rows / result['median']
+    return result
+
+
+def run_scenarios(lines: int, products: int, repeat: int, only: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Time every scenario (or those named in only) on one synthetic dataset"""
+    line_sheet, transactions = generate(lines, products=products)
+    csv_bytes = joined(line_sheet, transactions).to_csv(index=False).encode()
+    xlsx = io.BytesIO()
+    write_xlsx(xlsx, line_sheet, transactions)
+    xlsx_bytes = xlsx.getvalue()
+    parquet = io.BytesIO()
+    write_parquet(parquet, joined(line_sheet, transactions))
+    parquet_bytes = parquet.getvalue()
+    document = io.StringIO()
+    write_json(document, line_sheet, transactions)
+    json_bytes = document.getvalue().encode()
+
+    frame = pd.read_csv(io.BytesIO(csv_bytes))
+    parsed_lines = parse_columns(frame)
+    compact = parse_compact(frame)
+    legacy = parse_excel_file(frame)
+    analysis = analyze_frame(parsed_lines)
+    report_data = {**analysis, 'insights': asyncio.run(InsightService(StubBackend()).get(analysis))}
+
+    scenarios: Dict[str, Callable[[], Dict[str, Any]]] = {
+        'csv_read': lambda: measure(lambda: pd.read_csv(io.BytesIO(csv_bytes)), repeat, lines),
+        'xlsx_read': lambda: measure(lambda: load_excel(io.BytesIO(xlsx_bytes), join_transactions=True), repeat, lines),
+        'parquet_read': lambda: measure(lambda: read_upload(parquet_bytes), repeat, lines),
+        'json_read': lambda: measure(lambda: read_upload(json_bytes), repeat, lines),
+        'parse_excel_file': lambda: measure(lambda: parse_excel_file(frame), repeat, lines),
+        'parse_columns': lambda: measure(lambda: parse_columns(frame), repeat, lines),
+        'parse_compact': lambda: measure(lambda: parse_compact(frame), repeat, lines),
+        'analyze_data': lambda: measure(lambda: analyze_data(legacy), repeat, lines),
+        'analyze_frame': lambda: measure(lambda: analyze_frame(parsed_lines), repeat, lines),
+        'analyze_compact': lambda: measure(lambda: analyze_compact(compact), repeat, lines),
+        # A new service per run, so every call misses the insight cache
+        'insights_stub': lambda: measure(lambda: asyncio.run(InsightService(StubBackend()).get(analysis)), repeat),
+        'export_pdf': lambda: measure(lambda: build_pdf(report_data, io.BytesIO()), repeat),
+        'upload_csv': lambda: measure_upload('data.csv', csv_bytes, repeat, lines),
+        'upload_xlsx': lambda: measure_upload('data.xlsx', xlsx_bytes, repeat, lines),
+    }
+    unknown = set(only or []) - set(scenarios)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}. Available: {', '.join(scenarios)}")
+
+    results = {}
+    for name, run in scenarios.items():
+        if only and name not in only:
+            continue
+        results[name] = run()
+        print(f"  {name:<18} {results[name]['median'] * 1000:>10.1f}ms", file=sys.stderr)
+    return results
+
+
+def measure_upload(filename: str, contents: bytes, repeat: int, rows: int) -> Dict[str, Any]:
+    """POST /api/upload through the ASGI app, with the result cache off"""
+    result_cache.max_bytes = 0
+
+    async def run() -> List[float]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def upload():
+                response = await client.post("/api/upload", files={"file": (filename, contents)})
+                response.raise_for_status()
+
+            # Warm up the worker pool so process start-up is not measured
+            await upload()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await upload()
+                timings.append(time.perf_counter() - start)
+        return timings
+
+    return summarize(asyncio.run(run()), rows)
+
+
+def environment() -> Dict[str, Any]:
+    """Where and on what the suite ran, so results are comparable"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'packages': {'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': pa.__version__},
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Per-scenario change against a baseline run; regressions are flagged"""
+    changes = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median']
+        changes.append({
+            'scenario': name,
+            'baselineMedian': before['median'],
+            'median': result['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+        })
+    return changes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ingest pipeline on synthetic data")
+    parser.add_argument('--lines', type=int, default=100_000, help="synthetic lines (default 100000)")
+    parser.add_argument('--products', type=int, default=5_000, help="distinct products (default 5000)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario (default 3)")
+    parser.add_argument('--only', nargs='+', metavar='SCENARIO', help="run only these scenarios")
+    parser.add_argument('--output', help="write results JSON to this file (default stdout)")
+    parser.add_argument('--compare', metavar='BASELINE', help="results JSON of an earlier run")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"slowdown flagged as a regression (default {DEFAULT_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    print(f"lines={args.lines} products={args.products} repeat={args.repeat}", file=sys.stderr)
+    try:
+        scenarios = run_scenarios(args.lines, args.products, args.repeat, args.only)
+    finally:
+        shutdown_pools()
+        if os.environ["DATASET_DIR"].startswith(os.path.join(tempfile.gettempdir(), "bench-datasets-")):
+            shutil.rmtree(os.environ["DATASET_DIR"], ignore_errors=True)
+
+    results = {
+        'environment': environment(),
+        'config': {'lines': args.lines, 'products': args.products, 'repeat': args.repeat},
+        'scenarios': scenarios,
+    }
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != results['config']:
+            print(f"warning: baseline config {baseline.get('config')} differs from {results['config']}", file=sys.stderr)
+        results['comparison'] = {'baseline': args.compare, 'threshold': args.threshold,
+                                 'changes': compare(results, baseline, args.threshold)}
+        for change in results['comparison']['changes']:
+            flag = '  REGRESSION' if change['regression'] else ''
+            print(f"  {change['scenario']:<18} {change['ratio']:>6.2f}x baseline{flag}", file=sys.stderr)
+        regressions = [c['scenario'] for c in results['comparison']['changes'] if c['regression']]
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Synthetic Full Circle Foods data
+
+Generates a Lines sheet and a Transactions sheet with the same columns
+as data/full-circle-foods-data.xlsx, at any scale. Product popularity is
+skewed (a few products appear on many lines, like the real export),
+about half the lines are zero-waste and most sales are in-store.
+
+    lines, transactions = generate(1_000_000, products=20_000)
+    write_xlsx('big.xlsx', lines, transactions)   # two sheets, like the real file
+    write_csv('big.csv', joined(lines, transactions))
+    write_json('big.json', lines, transactions)   # like data/full-circle-foods-data.json
+    write_parquet('big.parquet', joined(lines, transactions))
+
+Or from the backend directory:
+    python -m benchmarks.synthetic out.xlsx|out.csv|out.json|out.parquet [lines] [products]
+"""
+
+import json
+import sys
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# Categories and their subcategories, from the real export
+CATALOG = {
+    'Bulk': ['Oats', 'Nuts', 'Seeds', 'Sugar & Sweeteners', 'Dried Fruit', 'Flour', 'Spices', 'Beans & Legumes'],
+    'Grocery': ['Bread & Wraps', 'Tea', 'Canned & Preserved', 'Condiments', 'Snacks & Candy', 'Soup'],
+    'Produce': ['Fruit', 'Vegetables', 'Fresh Herbs'],
+    'Cooler': ['Hummus', 'Vegan Dairy', 'Vegan Milk', 'Eggs', 'Drinks'],
+    'Dairy': ['Yogurt & Kefir', 'Cheese', 'Milk & Cream', 'Butter'],
+    'Beauty': ['Skin Care', 'Bulk Beauty', 'Menstruation', 'Teeth'],
+    'Freezer': ['Frozen Dinners', 'Frozen Vegetables', 'Ice Cream'],
+    'Household': ['Bulk Household', 'Cleaning', 'Candles & Incense'],
+    'Meat & Seafood': ['Seafood', 'Poultry', 'Pork', 'Beef'],
+    'Supplements': ['Sleep Support', 'Vitamins & Minerals'],
+}
+
+# Share of lines per category in the real export (same order as CATALOG)
+CATEGORY_WEIGHTS = [0.32, 0.19, 0.17, 0.12, 0.08, 0.04, 0.03, 0.03, 0.014, 0.006]
+
+# Sales channels; the real export is about 96% in-store
+LOCATIONS = ['in-store', 'delivery', 'pickup', 'market stall']
+
+_ALPHABET = np.array(list('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+_HEX = np.array(list('0123456789abcdef'))
+_NOUNS = ['Oats', 'Hummus', 'Soap', 'Tempeh', 'Milk', 'Granola', 'Lentils', 'Shampoo', 'Kombucha', 'Honey']
+_ADJECTIVES = ['Organic', 'Classic', 'Rolled', 'Marinated', 'Dark', 'Whole', 'Spiced', 'Raw', 'Local', 'Wild']
+
+
+def generate(lines: int, products: int = 1300, categories: int = len(CATALOG),
+             locations: int = 2, lines_per_transaction: float = 3.8, customers: int = 400,
+             days: int = 61, start: str = '2025-09-01', zero_waste_share: float = 0.5,
+             seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    A Lines sheet and its Transactions sheet
+
+    The defaults match the cardinality of the real export (about 1,300
+    products, 10 categories and 4,600 transactions over two months for
+    17,500 lines). products, categories (up to len(CATALOG)) and
+    locations (up to len(LOCATIONS)) set how many distinct values each
+    column has.
+    """
+    rng = np.random.default_rng(seed)
+    category_names = list(CATALOG)[:max(categories, 1)]
+    weights = np.array(CATEGORY_WEIGHTS[:len(category_names)])
+
+    # Products: ID, category, subcategory, description and zero-waste flag
+    product_ids = _random_ids(rng, products, 5)
+    product_cats = rng.choice(len(category_names), products, p=weights / weights.sum())
+    product_subcats = np.array([
+        rng.choice(CATALOG[category_names[c]]) for c in product_cats
+    ], dtype=object)
+    product_zero_waste = rng.random(products) < zero_waste_share
+    descriptions = np.char.add(
+        np.char.add(np.array(_ADJECTIVES)[rng.integers(0, len(_ADJECTIVES), products)], ' '),
+        np.array(_NOUNS)[rng.integers(0, len(_NOUNS), products)],
+    ).astype(object)
+    descriptions[product_zero_waste] = descriptions[product_zero_waste] + ', Waste Free'
+
+    # Zipf-like popularity: product k is picked with weight 1 / (k + 1)
+    popularity = 1.0 / np.arange(1, products + 1)
+    line_products = rng.choice(products, lines, p=popularity / popularity.sum())
+
+    n_transactions = max(int(lines / lines_per_transaction), 1)
+    line_transactions = np.sort(rng.integers(0, n_transactions, lines))
+    transaction_ids = _random_ids(rng, n_transactions, 5, alphabet=_HEX)
+
+    lines_df = pd.DataFrame({
+        'Product ID': product_ids[line_products],
+        'Product Description': descriptions[line_products],
+        'Category': np.array(category_names, dtype=object)[product_cats[line_products]],
+        'Subcategory': product_subcats[line_products],
+        'Zero-waste?': np.where(product_zero_waste[line_products], 'zero-waste', None).astype(object),
+        'Transaction ID': transaction_ids[line_transactions],
+    })
+
+    used = np.unique(line_transactions)
+    location_names = np.array(LOCATIONS[:max(locations, 1)], dtype=object)
+    location_weights = np.array([0.96] + [0.04 / max(len(location_names) - 1, 1)] * (len(location_names) - 1))
+    has_customer = rng.random(len(used)) < 0.22
+    customer_ids = _random_ids(rng, max(customers, 1), 6)[rng.integers(0, max(customers, 1), len(used))]
+    transactions_df = pd.DataFrame({
+        'Transaction ID': transaction_ids[used],
+        'Date': pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, days, len(used))), unit='D'),
+        'Customer': np.where(has_customer, customer_ids, None).astype(object),
+        'Location': location_names[rng.choice(len(location_names), len(used), p=location_weights / location_weights.sum())],
+        'Amount': np.round(rng.lognormal(2.8, 1.0, len(used)), 2),
+    })
+    return lines_df, transactions_df
+
+
+def joined(lines: pd.DataFrame, transactions: pd.DataFrame) -> pd.DataFrame:
+    """Lines with their transaction's date, customer, location and amount (one flat CSV)"""
+    return lines.merge(transactions, on='Transaction ID', how='left')
+
+
+def write_xlsx(path, lines: pd.DataFrame, transactions: pd.DataFrame) -> None:
+    """Write both sheets like the real export (Transactions first, then Lines)"""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        transactions.to_excel(writer, sheet_name='Transactions', index=False)
+        lines.to_excel(writer, sheet_name='Lines', index=False)
+
+
+def write_csv(path, frame: pd.DataFrame) -> None:
+    frame.to_csv(path, index=False)
+
+
+def write_parquet(path, frame: pd.DataFrame) -> None:
+    frame.to_parquet(path, index=False)
+
+
+def write_json(path, lines: pd.DataFrame, transactions: pd.DataFrame) -> None:
+    """
+    Write the {"transactions": [...], "lines": [...]} document of the real
+    JSON export (its field names, ISO dates and "" for no customer)
+    """
+    document = {
+        'transactions': pd.DataFrame({
+            'id': transactions['Transaction ID'],
+            'date': transactions['Date'].dt.strftime('%Y-%m-%d'),
+            'customer': transactions['Customer'].fillna(''),
+            'location': transactions['Location'],
+            'amount': transactions['Amount'],
+        }).to_dict('records'),
+        'lines': pd.DataFrame({
+            'product_id': lines['Product ID'],
+            'description': lines['Product Description'],
+            'category': lines['Category'],
+            'subcategory': lines['Subcategory'],
+            'zerowaste': lines['Zero-waste?'].notna(),
+            'transaction': lines['Transaction ID'],
+        }).to_dict('records'),
+    }
+    if hasattr(path, 'write'):
+        json.dump(document, path, separators=(',', ':'))
+        return
+    with open(path, 'w') as f:
+        json.dump(document, f, separators=(',', ':'))
+
+
+def _random_ids(rng: np.random.Generator, count: int, length: int, alphabet=_ALPHABET) -> np.ndarray:
+    """
+    count distinct random IDs as an object array
+
+    IDs are length characters long, or longer when the alphabet is too
+    small for count IDs of that length.
+    """
+    alphabet = np.asarray(alphabet)
+    base = len(alphabet)
+    while base ** length < count * 4:
+        length += 1
+    numbers = np.unique(rng.integers(0, base ** length, count * 2, dtype=np.int64))
+    while len(numbers) < count:
+        numbers = np.unique(np.concatenate([numbers, rng.integers(0, base ** length, count, dtype=np.int64)]))
+    numbers = rng.permutation(numbers)[:count]
+    ids = np.full(count, '', dtype=f'<U{length}')
+    for _ in range(length):
+        ids = np.char.add(alphabet[numbers % base], ids)
+        numbers //= base
+    return ids.astype(object)
+
+
+def main():
+    if len(sys.argv) < 2 or not sys.argv[1].endswith(('.csv', '.xlsx', '.json', '.parquet')):
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[1]
+    lines, transactions = generate(
+        int(sys.argv[2]) if len(sys.argv) > 2 else 17_500,
+        **({'products': int(sys.argv[3])} if len(sys.argv) > 3 else {}),
+    )
+    if path.endswith('.csv'):
+        write_csv(path, joined(lines, transactions))
+    elif path.endswith('.json'):
+        write_json(path, lines, transactions)
+    elif path.endswith('.parquet'):
+        write_parquet(path, joined(lines, transactions))
+    else:
+        write_xlsx(path, lines, transactions)
+    print(f"{path}: {len(lines)} lines, {len(transactions)} transactions")
+
+
+if __name__ == "__main__":
+    main()
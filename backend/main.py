@@ -7,18 +7,36 @@ generating insights, and exporting reports.
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import uvicorn
 
 # Import routers
-from routers import upload, analysis, insights, export
+from routers import upload, analysis, insights, export, jobs
+from services.executor import shutdown_pools
+from services.log import configure_logging
+from services.metrics import instrument_request, registry
+from services.responses import CompressionMiddleware, FastJSONResponse
+from services.warmup import start_warm_up, warm_status
+
+# Leveled logging through a background writer (LOG_LEVEL, LOG_FORMAT)
+configure_logging()
 
 # Initialize FastAPI application
 app = FastAPI(
     title="Zero-Waste Intelligence Engine API",
     description="Backend API for sustainability data analysis",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson serialization, timed as a pipeline stage
+    default_response_class=FastJSONResponse,
 )
 
+# gzip/brotli bodies both ways and ETags with 304s for repeat GETs
+# (innermost, so its work shows up in the request's Server-Timing)
+app.add_middleware(CompressionMiddleware)
+
+# Request metrics, Server-Timing headers and opt-in profiling
+app.middleware("http")(instrument_request)
+
 # Configure CORS middleware
 # Allows frontend (Next.js) to make requests to this API
 app.add_middleware(
@@ -27,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Register API routes
@@ -34,6 +53,20 @@ app.include_router(upload.router, prefix="/api", tags=["upload"])
 app.include_router(analysis.router, prefix="/api", tags=["analysis"])
 app.include_router(insights.router, prefix="/api", tags=["insights"])
 app.include_router(export.router, prefix="/api", tags=["export"])
+app.include_router(jobs.router, prefix="/api", tags=["jobs"])
+
+
+# Load what the first requests would otherwise wait for, in the background
+# (WARM_START=0 to turn off)
+@app.on_event("startup")
+async def startup():
+    start_warm_up()
+
+
+# Stop worker pools when the server shuts down
+@app.on_event("shutdown")
+async def shutdown():
+    shutdown_pools()
 
 
 # Root endpoint
@@ -50,8 +83,22 @@ async def root():
 # Health check endpoint
 @app.get("/health")
 async def health():
-    """Health check endpoint for monitoring"""
-    return {"status": "healthy"}
+    """
+    Health check endpoint for monitoring
+    Healthy as soon as the app is up; warm says whether the background
+    warm-up has finished (pending, running, done, failed or off)
+    """
+    return {"status": "healthy", "warm": warm_status()}
+
+
+# Metrics endpoint for Prometheus
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Request and pipeline stage metrics in the Prometheus text format
+    Counts are per server process
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 # Run the application
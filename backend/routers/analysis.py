@@ -1,11 +1,65 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
+from datetime import date
+from services.executor import run_cpu, run_io
+from services.responses import FastJSONResponse, etag_matches
 
 router = APIRouter()
 
 @router.get("/stats")
-async def get_stats():
-    """Get general statistics"""
-    return {"message": "Stats endpoint - implement as needed"}
+async def get_stats(dataset_id: str, request: Request):
+    """
+    Get the analysis of a saved dataset
+    Recomputed from the stored columns, so nothing has to be re-uploaded
 
+    The response has an ETag that changes with the dataset; sending it
+    back in If-None-Match gets a 304 without recomputing anything.
+    """
+    # The dataset layer loads pandas and pyarrow, so it is imported on the
+    # first request (or by the startup warm-up) rather than with the app
+    from services.dataset_store import analyze_dataset, dataset_etag, load_metadata, DatasetNotFound
+    
+    try:
+        etag = await run_io(dataset_etag, dataset_id)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        analysis = await run_cpu(analyze_dataset, dataset_id)
+        metadata = await run_io(load_metadata, dataset_id)
+    except (DatasetNotFound, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    
+    return FastJSONResponse({
+        **analysis,
+        "insights": metadata.get("insights"),
+        "datasetId": dataset_id
+    }, headers={"ETag": etag})
+
+@router.get("/analytics")
+async def get_analytics(
+    dataset_id: str,
+    granularity: str = "day",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    location: Optional[str] = None,
+):
+    """
+    Adoption rate, revenue and high-risk products of a saved dataset
+    per day/week/month and per location, optionally limited to a date
+    range and a single location
+
+    Lines without a date are not in any period, location or total;
+    undatedLines says how many were left out.
+    """
+    from services.dataset_store import DatasetNotFound
+    from services.timeseries import query_dataset, GRANULARITIES
+    
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported granularity: {granularity}. Supported: {', '.join(GRANULARITIES)}"
+        )
+    try:
+        return await run_cpu(query_dataset, dataset_id, granularity, start, end, location)
+    except (DatasetNotFound, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
@@ -1,68 +1,55 @@
-from fastapi import APIRouter
-from fastapi.responses import Response
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from io import BytesIO
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from services.executor import run_cpu, run_io
+from typing import Optional
+import os
 
 router = APIRouter()
 
 @router.post("/export")
-async def export_report(data: dict):
-    """Export analysis as PDF report"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#16a34a'),
-        spaceAfter=30,
-    )
-    story.append(Paragraph("Zero-Waste Intelligence Report", title_style))
-    story.append(Spacer(1, 0.2*inch))
-    
-    # Summary
-    story.append(Paragraph("Executive Summary", styles['Heading2']))
-    summary_text = f"""
-    Total Products Analyzed: {data.get('totalProducts', 0)}<br/>
-    Overall Zero-Waste Adoption: {data.get('overallAdoptionRate', 0)}%<br/>
-    Total Transactions: {data.get('totalTransactions', 0)}
+async def export_report(data: Optional[dict] = None, dataset_id: Optional[str] = None):
     """
-    story.append(Paragraph(summary_text, styles['Normal']))
-    story.append(Spacer(1, 0.3*inch))
-    
-    # AI Insights
-    insights = data.get('insights', {})
-    story.append(Paragraph("Key Insights", styles['Heading2']))
-    story.append(Paragraph(insights.get('summary', 'No insights available'), styles['Normal']))
-    story.append(Spacer(1, 0.2*inch))
-    
-    story.append(Paragraph("Recommendations", styles['Heading2']))
-    story.append(Paragraph("<b>For Consumers:</b>", styles['Normal']))
-    story.append(Paragraph(insights.get('consumer', ''), styles['Normal']))
-    story.append(Spacer(1, 0.1*inch))
-    
-    story.append(Paragraph("<b>For Businesses:</b>", styles['Normal']))
-    story.append(Paragraph(insights.get('business', ''), styles['Normal']))
-    story.append(Spacer(1, 0.1*inch))
-    
-    story.append(Paragraph("<b>For Policymakers:</b>", styles['Normal']))
-    story.append(Paragraph(insights.get('policy', ''), styles['Normal']))
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    
-    return Response(
-        content=buffer.read(),
+    Export analysis as PDF report
+    Pass dataset_id instead of a body to export a saved dataset
+
+    Reports include the full category, adoption and high-risk tables
+    (every high-risk product for a saved dataset). Rendered reports are
+    cached on disk by content, so repeated exports are streamed straight
+    from the file.
+    """
+    # reportlab (and with it the dataset layer's pandas and pyarrow) is
+    # loaded on the first export (or by the startup warm-up) rather than
+    # when the app starts
+    from services.dataset_store import DatasetNotFound
+    from services.report import report_key, dataset_report_key, open_report, iter_report, render_report, render_dataset_report
+    
+    if dataset_id:
+        try:
+            key = await run_io(dataset_report_key, dataset_id)
+            report = await run_io(open_report, key)
+            if report is None:
+                # reportlab rendering is CPU-bound, so it runs in the CPU pool
+                await run_cpu(render_dataset_report, dataset_id, key)
+        except DatasetNotFound:
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    elif data is not None:
+        key = report_key(data)
+        report = await run_io(open_report, key)
+        if report is None:
+            await run_cpu(render_report, data, key)
+    else:
+        raise HTTPException(status_code=400, detail="Provide analysis data or a dataset_id")
+    
+    # Opened before sending: a prune by another request can't cut it short
+    report = report or await run_io(open_report, key)
+    if report is None:
+        raise HTTPException(status_code=503, detail="Report was removed from the cache before it could be sent. Please retry.")
+
+    return StreamingResponse(
+        iter_report(report),
         media_type="application/pdf",
-        headers={"Content-Disposition": "attachment; filename=zero-waste-report.pdf"}
+        headers={
+            "Content-Disposition": 'attachment; filename="zero-waste-report.pdf"',
+            "Content-Length": str(os.fstat(report.fileno()).st_size),
+        },
     )
-
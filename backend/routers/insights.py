@@ -1,15 +1,38 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from services.ai_service import generate_insights
+from services.ai_service import generate_insights_async, insight_service
+from services.executor import run_cpu
+from typing import Optional
 
 router = APIRouter()
 
 @router.post("/insights")
-async def get_insights(data: dict):
-    """Generate AI insights from analysis data"""
+async def get_insights(data: Optional[dict] = None, dataset_id: Optional[str] = None):
+    """
+    Generate AI insights from analysis data
+    Pass dataset_id instead of a body to use a saved dataset
+    """
+    # Loads pandas and pyarrow, so it waits for the first request
+    from services.dataset_store import analyze_dataset, DatasetNotFound
+    
     try:
-        insights = generate_insights(data)
+        if dataset_id:
+            data = await run_cpu(analyze_dataset, dataset_id)
+        elif data is None:
+            raise HTTPException(status_code=400, detail="Provide analysis data or a dataset_id")
+        
+        # Cached and coalesced; the template answers if the AI misses its budget
+        insights = await generate_insights_async(data)
         return insights
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
+
+@router.get("/insights/stats")
+async def insight_stats():
+    """Cache, coalescing and fallback counters for insight generation"""
+    return insight_service.stats()
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException
+from services.jobs import job_manager
+
+router = APIRouter()
+
+@router.get("/jobs")
+async def job_stats():
+    """Number of jobs in each state, plus the queue limits"""
+    return job_manager.stats()
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a background job
+    Includes stage, progress (0-1) and, once done, the result
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
@@ -1,120 +1,470 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from services.parser import parse_excel_file
-from services.analyzer import analyze_data
-from services.ai_service import generate_insights
-import pandas as pd
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from services.ai_service import generate_insights_async, insight_service, _generate_template_insights
+from services.cache import hash_upload, result_cache
+from services.executor import CPU_WORKERS, ExecutorBusy, run_cpu, run_cpu_reporting, run_io
+from services.jobs import Job, job_manager
+from services.metrics import span
+from services.responses import FastJSONResponse, RawJSONResponse
+from typing import List, Optional
 import io
-import traceback
+import json
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive events while a progress upload is busy
+HEARTBEAT_SECONDS = 10
+
+# Pipelines still finishing after their job returned (waiting on AI text)
+_background = set()
+
+# Files accepted in one batch upload (after expanding zips)
+BATCH_MAX_FILES = 50
+
+# Content types of the progress stream formats
+EVENT_FORMATS = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), stream: bool = False, append_to: Optional[str] = None,
+                      run_async: bool = Query(False, alias="async"), approximate: bool = False):
     """
     Upload and analyze Excel/CSV file
     Returns complete analysis with visualizations data and AI insights
+
+    Parquet, Arrow IPC/Feather and JSON exports (a transactions + lines
+    document, or NDJSON) are accepted too. The format is detected from
+    the file's content, not its name.
+
+    With stream=true, CSV files are read and analyzed in chunks so memory
+    depends on the number of distinct products, not the file size.
+    Results are cached by file content, so re-uploading the same file
+    returns the stored result. The parsed lines are saved as a dataset
+    whose datasetId can be passed to /api/stats, /api/insights and
+    /api/export instead of posting the analysis back.
+
+    With append_to=<datasetId>, the file is merged with that dataset
+    instead: lines from transactions already in it are skipped, and the
+    response is the analysis of the combined data under a new datasetId
+    (the original dataset is left as it was).
+
+    With async=true, the file is queued as a background job and the
+    response (202) is the job; poll /api/jobs/{jobId} for its status,
+    progress and result.
+
+    With approximate=true, the high-risk ranking and distinct counts come
+    from fixed-memory sketches (see SketchAnalysis); the response gains
+    an 'approximate' section with the estimates and their error bounds.
     """
+    # pandas and pyarrow are loaded by the first upload (or the startup
+    # warm-up) rather than when the app starts
+    from services import ingest
+    from services.dataset_store import dataset_id_for, update_metadata
+    from services.readers import sniff_upload
+    
     try:
         # Validate file type
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file provided")
         
-        # Read file content into memory
-        contents = await file.read()
-        
-        # Reset file pointer for pandas
-        file_obj = io.BytesIO(contents)
-        
-        # Read file into pandas based on extension
-        try:
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file_obj)
-            elif file.filename.endswith(('.xlsx', '.xls')):
-                # Check if Excel has multiple sheets
-                # Reset file pointer for ExcelFile
-                file_obj.seek(0)
-                excel_file = pd.ExcelFile(file_obj, engine='openpyxl')
-                sheet_names = excel_file.sheet_names
-                print(f"DEBUG: Excel sheets found: {sheet_names}")
-                
-                # Look for sheet with product data (has Product ID or Product Description)
-                df = None
-                for sheet_name in sheet_names:
-                    file_obj.seek(0)  # Reset for each read
-                    temp_df = pd.read_excel(file_obj, sheet_name=sheet_name, engine='openpyxl')
-                    columns_lower = [col.lower() for col in temp_df.columns]
-                    print(f"DEBUG: Sheet '{sheet_name}' columns: {list(temp_df.columns)}")
-                    # Check if this sheet has product-related columns
-                    has_product_id = any('product' in col and 'id' in col for col in columns_lower)
-                    has_category = any('category' in col and 'transaction' not in col for col in columns_lower)
-                    has_product_desc = any('product' in col and 'description' in col for col in columns_lower)
-                    
-                    if has_product_id or (has_category and has_product_desc):
-                        df = temp_df
-                        print(f"DEBUG: Using sheet '{sheet_name}' with product data")
-                        break
-                
-                # If no product sheet found, use first sheet
-                if df is None:
-                    file_obj.seek(0)
-                    df = pd.read_excel(file_obj, sheet_name=sheet_names[0], engine='openpyxl')
-                    print(f"DEBUG: No product sheet found, using first sheet: '{sheet_names[0]}'")
-                    print(f"WARNING: First sheet may not contain product data. Columns: {list(df.columns)}")
-            else:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Unsupported file type: {file.filename}. Supported: .csv, .xlsx, .xls"
-                )
-        except Exception as e:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Error reading file: {str(e)}. Please check file format."
-            )
+        if approximate and (append_to or run_async):
+            raise HTTPException(status_code=400, detail="approximate is not supported with append_to or async")
         
-        # Check if dataframe is empty
-        if df.empty:
-            raise HTTPException(status_code=400, detail="File is empty or contains no data")
+        if append_to:
+            if run_async:
+                raise HTTPException(status_code=400, detail="async is not supported with append_to")
+            return await _append_upload(file, append_to)
         
-        # Parse and validate data
-        try:
-            parsed_data = parse_excel_file(df)
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=f"Data validation error: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error parsing data: {str(e)}")
+        if run_async:
+            return await _submit_upload_job(file)
         
-        # Perform analysis
-        try:
-            analysis = analyze_data(parsed_data)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error analyzing data: {str(e)}")
+        # Same bytes + same pipeline version -> same result
+        cache_key = await run_io(hash_upload, file.file)
+        dataset_id = dataset_id_for(cache_key)
+        if approximate:
+            cache_key += ':approx'
+        cached = result_cache.get_json(cache_key)
+        if cached is not None:
+            # Sent as stored, without decoding and re-encoding it
+            return RawJSONResponse(cached)
         
-        # Generate AI insights (this will fallback to template if API fails)
-        try:
-            insights = generate_insights(analysis)
-        except Exception as e:
-            # Use template insights if AI fails
-            print(f"Warning: AI insights failed, using template: {e}")
-            from services.ai_service import _generate_template_insights
-            insights = _generate_template_insights(analysis)
+        # Parsing and analysis run in the CPU pool so the event loop stays free
+        if stream and sniff_upload(file.file, file.filename) == 'csv':
+            path = await run_io(_spool_to_disk, file.file)
+            try:
+                analysis = await run_cpu(ingest.analyze_csv_path, path, dataset_id, file.filename, approximate)
+            finally:
+                os.unlink(path)
+        else:
+            contents = await file.read()
+            analysis = await run_cpu(ingest.analyze_batch, contents, file.filename, dataset_id, approximate)
         
-        # Combine results
         result = {
             **analysis,
-            "insights": insights
+            "datasetId": dataset_id
         }
         
-        return result
+        async def store(insights: dict) -> None:
+            await run_io(update_metadata, dataset_id, insights=insights)
+            result_cache.put(cache_key, {**result, "insights": insights})
+        
+        insights = await _generate_insights(analysis, store)
+        
+        # Combine results
+        return FastJSONResponse({**result, "insights": insights})
         
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
         # Log full error for debugging
-        error_trace = traceback.format_exc()
-        print(f"Unexpected error: {error_trace}")
+        logger.exception("upload failed", extra={'upload': file.filename})
         raise HTTPException(
             status_code=500, 
             detail=f"Error processing file: {str(e)}. Check server logs for details."
         )
 
+async def _generate_insights(analysis: dict, store) -> dict:
+    """
+    Generate AI insights (this will fallback to template if API fails)
+    and save them with store(insights)
+
+    If the AI call misses the latency budget the template is returned and
+    saved first; store is called again with the AI text once it arrives.
+    """
+    lock = asyncio.Lock()
+    late = False
+    
+    async def store_late(insights: dict) -> None:
+        nonlocal late
+        async with lock:
+            late = True
+            await store(insights)
+    
+    try:
+        with span('insights'):
+            insights = await generate_insights_async(analysis, store_late)
+    except Exception as e:
+        # Use template insights if AI fails
+        logger.warning("AI insights failed, using template: %s", e)
+        insights = _generate_template_insights(analysis)
+    
+    async with lock:
+        # Don't overwrite AI text that already arrived
+        if not late:
+            await store(insights)
+    return insights
+
+async def _append_upload(file: UploadFile, dataset_id: str) -> dict:
+    """Merge an upload with an existing dataset into a new one (results are not cached)"""
+    from services import ingest
+    from services.dataset_store import DatasetNotFound, update_metadata
+    
+    contents = await file.read()
+    try:
+        combined_id, analysis = await run_cpu(ingest.append_batch, contents, file.filename, dataset_id)
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    
+    async def store(insights: dict) -> None:
+        await run_io(update_metadata, combined_id, insights=insights)
+    
+    insights = await _generate_insights(analysis, store)
+    return {
+        **analysis,
+        "insights": insights,
+        "datasetId": combined_id
+    }
+
+@router.post("/upload/events")
+async def upload_events(file: UploadFile = File(...), format: str = 'ndjson'):
+    """
+    Upload and analyze a file, streaming progress as it goes
+
+    Responds at once with a stream of events, as NDJSON (one
+    {"event", "data"} object per line) or as server-sent events
+    (format=sse):
+      started   - filename and size
+      schema    - detected columns (CSV after the first chunk, Excel once
+                  the header is read, other formats once the file is read)
+      progress  - rows and bytes read, plus the analysis so far (CSV, per chunk)
+      analysis  - the final analysis and its datasetId
+      insights  - template or AI insights; sent again with final=true if
+                  the AI text arrives after the latency budget
+      error     - status and detail, if the upload fails
+      done      - end of stream
+    A ping event is sent while a step runs longer than HEARTBEAT_SECONDS,
+    so proxies keep the connection open. Results are stored and cached
+    like /api/upload.
+    """
+    if format not in EVENT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}. Supported: ndjson, sse")
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No file provided")
+    
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    def emit(event: str, data: dict) -> None:
+        queue.put_nowait((event, data))
+    
+    async def produce() -> None:
+        try:
+            await _upload_with_events(file, emit)
+        except HTTPException as e:
+            emit('error', {'status': e.status_code, 'detail': e.detail})
+        except Exception as e:
+            logger.exception("upload failed", extra={'upload': file.filename})
+            emit('error', {'status': 500, 'detail': f"Error processing file: {str(e)}. Check server logs for details."})
+        emit('done', {})
+    
+    async def events():
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    event, data = 'ping', {}
+                yield _format_event(format, event, data)
+                if event == 'done':
+                    break
+        finally:
+            producer.cancel()
+    
+    return StreamingResponse(events(), media_type=EVENT_FORMATS[format])
+
+async def _submit_upload_job(file: UploadFile) -> JSONResponse:
+    """Spool an upload to disk and queue it as a background job"""
+    path = await run_io(_spool_to_disk, file.file)
+    filename = file.filename
+    
+    async def work(job: Job) -> dict:
+        analysis = {}
+        ready = asyncio.Event()
+        
+        def track(event: str, data: dict) -> None:
+            # Job fields follow the pipeline's progress events
+            if event == 'started':
+                job.stage = 'hashing'
+            elif event == 'schema':
+                job.stage = 'analyzing'
+            elif event == 'progress':
+                job.progress = round(data['bytesRead'] / data['totalBytes'], 4) if data['totalBytes'] else None
+            elif event == 'analysis':
+                job.stage = 'insights'
+                job.progress = 1.0
+                analysis.update(data)
+            elif event == 'insights':
+                job.result = {**analysis, 'insights': {k: v for k, v in data.items() if k != 'final'}}
+                ready.set()
+        
+        job.stage = 'reading'
+        with open(path, 'rb') as f:
+            pipeline = asyncio.ensure_future(
+                _upload_with_events(UploadFile(file=f, filename=filename), track, spooled=path)
+            )
+            waiter = asyncio.ensure_future(ready.wait())
+            try:
+                # The job is done once the first insights are in; AI text
+                # that arrives later still updates job.result
+                await asyncio.wait({pipeline, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                if not ready.is_set():
+                    pipeline.result()
+            except asyncio.CancelledError:
+                # Let the pipeline stop (a CSV worker does at its next
+                # chunk) before the file is closed and removed
+                pipeline.cancel()
+                await asyncio.wait({pipeline})
+                raise
+            finally:
+                waiter.cancel()
+        if not pipeline.done():
+            _background.add(pipeline)
+            pipeline.add_done_callback(_background.discard)
+        job.stage = None
+        return job.result
+    
+    job = job_manager.submit('upload', work, cleanup=lambda: os.unlink(path))
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+async def _upload_with_events(file: UploadFile, emit, spooled: Optional[str] = None) -> None:
+    """
+    The /api/upload pipeline, reporting each step through emit
+
+    spooled is the path of a copy of the upload already on disk (a job's);
+    a CSV is then streamed from it instead of being copied again, and the
+    caller removes it.
+    """
+    from services import ingest
+    from services.dataset_store import dataset_id_for, update_metadata
+    from services.readers import sniff_upload
+    
+    file.file.seek(0, os.SEEK_END)
+    total_bytes = file.file.tell()
+    emit('started', {'filename': file.filename, 'totalBytes': total_bytes})
+    
+    cache_key = await run_io(hash_upload, file.file)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        insights = cached['insights']
+        emit('analysis', {key: value for key, value in cached.items() if key != 'insights'})
+        emit('insights', {**insights, 'final': True})
+        return
+    dataset_id = dataset_id_for(cache_key)
+    
+    def on_report(event: str, data: dict) -> None:
+        # Workers report what they know; the request adds the rest
+        if event == 'schema':
+            data = {**data, 'datasetId': dataset_id}
+        elif event == 'progress':
+            data = {**data, 'totalBytes': total_bytes}
+        emit(event, data)
+
+    # Both paths run in the CPU pool and report back through a queue
+    if sniff_upload(file.file, file.filename) == 'csv':
+        path = spooled or await run_io(_spool_to_disk, file.file)
+        try:
+            analysis = await run_cpu_reporting(ingest.analyze_csv_path, on_report, path, dataset_id, file.filename)
+        finally:
+            if path != spooled:
+                os.unlink(path)
+    else:
+        contents = await file.read()
+        analysis = await run_cpu_reporting(ingest.analyze_batch, on_report, contents, file.filename, dataset_id)
+    
+    result = {
+        **analysis,
+        "datasetId": dataset_id
+    }
+    emit('analysis', result)
+    
+    async def store(insights: dict) -> None:
+        await run_io(update_metadata, dataset_id, insights=insights)
+        result_cache.put(cache_key, {**result, "insights": insights})
+    
+    with span('insights'):
+        insights, late = await insight_service.get_with_late(analysis)
+    await store(insights)
+    emit('insights', {**insights, 'final': late is None})
+    if late is not None:
+        # Shielded: the AI call may be shared with other requests
+        insights = await asyncio.shield(late)
+        await store(insights)
+        emit('insights', {**insights, 'final': True})
+
+def _format_event(format: str, event: str, data: dict) -> bytes:
+    """One event in NDJSON or server-sent event framing"""
+    if format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+    return (json.dumps({'event': event, 'data': data}, default=str) + '\n').encode()
+
+@router.post("/upload/batch")
+async def upload_batch(files: List[UploadFile] = File(...), approximate: bool = False):
+    """
+    Upload and analyze several files at once, e.g. one per store
+
+    .zip uploads are expanded into the data files they contain. Each
+    file is parsed, stored as its own dataset and analyzed in the CPU
+    pool, CPU_WORKERS files at a time. Returns one analysis per store
+    (named after its file, with an error instead if that file could not be
+    read) and a rollup across the stores: combined adoption by category
+    and a global high-risk ranking. Each store's ranking lists every
+    high-risk product before it is cut to the usual top 20 (the list grows
+    with distinct products, not lines), so the merged ranking is exact.
+    No insights are generated; post the rollup to /api/insights for them.
+
+    With approximate=true, each store is summarized by a SketchAnalysis
+    instead and the rollup merges the sketches, so its size no longer
+    grows with the number of distinct products across the chain.
+    """
+    from services import ingest
+    from services.analyzer import HIGH_RISK_LIMIT, merge_analyses, SketchAnalysis
+    
+    uploads = []
+    for file in files:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="No file provided")
+        contents = await file.read()
+        if file.filename.endswith('.zip'):
+            uploads.extend(await run_io(_expand_zip, contents, file.filename))
+        else:
+            uploads.append((file.filename, contents))
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No data files in the upload")
+    if len(uploads) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files: {len(uploads)}. Maximum: {BATCH_MAX_FILES}")
+    
+    # Never more files in flight than workers, so a big batch doesn't fill
+    # the CPU pool's queue
+    slots = asyncio.Semaphore(CPU_WORKERS)
+    
+    async def analyze(filename: str, contents: bytes) -> dict:
+        store = {'store': os.path.splitext(os.path.basename(filename))[0], 'filename': filename}
+        async with slots:
+            try:
+                dataset_id, analysis, sketch = await run_cpu(ingest.analyze_store, contents, filename, approximate)
+            except ExecutorBusy:
+                # The server is saturated, not this file's fault
+                raise
+            except HTTPException as e:
+                return {**store, 'error': {'status': e.status_code, 'detail': e.detail}}
+        if sketch is not None:
+            sketches.append(sketch)
+        return {**store, 'datasetId': dataset_id, 'analysis': analysis}
+    
+    sketches = []
+    stores = await asyncio.gather(*(analyze(filename, contents) for filename, contents in uploads))
+    
+    analyses = [store['analysis'] for store in stores if 'analysis' in store]
+    if approximate:
+        combined = SketchAnalysis()
+        for sketch in sketches:
+            combined.merge(sketch)
+        rollup = combined.result()
+    else:
+        rollup = merge_analyses(analyses)
+        for store in analyses:
+            store['highRiskProducts'] = store['highRiskProducts'][:HIGH_RISK_LIMIT]
+    
+    return FastJSONResponse({
+        'stores': stores,
+        'rollup': {**rollup, 'storeCount': len(analyses)},
+    })
+
+def _expand_zip(contents: bytes, filename: str) -> list:
+    """(name, bytes) of each data file (by extension) in a zip archive"""
+    from services.readers import supported_extensions
+    
+    # Any registered reader's file types are taken from the zip
+    file_types = tuple(supported_extensions())
+    try:
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            return [
+                (info.filename, archive.read(info))
+                for info in archive.infolist()
+                if not info.is_dir()
+                and not info.filename.startswith('__MACOSX/')
+                and info.filename.endswith(file_types)
+            ]
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Error reading file: {filename}: {str(e)}")
+
+@router.get("/upload/cache")
+async def cache_stats():
+    """Hit, miss and eviction counters for the upload result cache"""
+    return result_cache.stats()
+
+def _spool_to_disk(file_obj) -> str:
+    """Copy an upload to a named temp file that a worker process can open"""
+    file_obj.seek(0)
+    with span('spool') as current, tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as tmp:
+        shutil.copyfileobj(file_obj, tmp)
+        current.bytes = tmp.tell()
+    return tmp.name
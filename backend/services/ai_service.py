@@ -1,45 +1,286 @@
 import os
-from anthropic import Anthropic
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
+from services.metrics import span
+
 load_dotenv()
 
-# Initialize Claude client (only if API key exists)
-api_key = os.getenv("ANTHROPIC_API_KEY")
-client = None
-if api_key:
-    try:
-        client = Anthropic(api_key=api_key)
-    except Exception as e:
-        print(f"Warning: Could not initialize Claude client: {e}")
+logger = logging.getLogger(__name__)
+
+# Insight generation settings
+INSIGHTS_BACKEND = os.getenv("INSIGHTS_BACKEND", "")           # anthropic | stub | template
+INSIGHTS_CACHE_TTL = float(os.getenv("INSIGHTS_CACHE_TTL", 3600))
+INSIGHTS_CACHE_SIZE = int(os.getenv("INSIGHTS_CACHE_SIZE", 256))   # entries kept, least recently used go first
+INSIGHTS_LATENCY_BUDGET = float(os.getenv("INSIGHTS_LATENCY_BUDGET", 3))
+INSIGHTS_TIMEOUT = float(os.getenv("INSIGHTS_TIMEOUT", 30))
+INSIGHTS_MAX_RETRIES = int(os.getenv("INSIGHTS_MAX_RETRIES", 2))
+INSIGHTS_MODEL = os.getenv("INSIGHTS_MODEL", "claude-3-sonnet-20240229")
+
+
+class AnthropicBackend:
+    """
+    Claude via the async client, with a request timeout and retries
+
+    The SDK is the slowest import in the app, so it is loaded and the
+    client built on first use (or by the startup warm-up), not at import.
+    """
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from anthropic import AsyncAnthropic
+            self._client = AsyncAnthropic(api_key=self.api_key, timeout=INSIGHTS_TIMEOUT,
+                                          max_retries=INSIGHTS_MAX_RETRIES)
+        return self._client
+
+    async def complete(self, prompt: str) -> str:
+        message = await self.client.messages.create(
+            model=INSIGHTS_MODEL,
+            max_tokens=1000,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }]
+        )
+        return message.content[0].text
+
+
+class StubBackend:
+    """
+    Local stand-in for the AI API, for tests and benchmarks
+
+    Waits `delay` seconds and returns fixed four-paragraph text.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def complete(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return "\n\n".join([
+            "Stub summary of the zero-waste metrics.",
+            "Consumers: choose package-free options.",
+            "Businesses: stock more zero-waste lines.",
+            "Policymakers: reward package-free retail.",
+        ])
+
+
+def _default_backend() -> Optional[Any]:
+    """Backend picked from INSIGHTS_BACKEND, or Claude when a key is set"""
+    if INSIGHTS_BACKEND == "stub":
+        return StubBackend()
+    if INSIGHTS_BACKEND == "template":
+        return None
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        return None
+    # Client errors (e.g. a bad key format) surface on the first call,
+    # which falls back to the template like any other API error
+    return AnthropicBackend(api_key)
+
+
+class InsightService:
+    """
+    Cached, coalescing front end for insight generation
+
+    Results are cached for `ttl` seconds under the metrics that go into
+    the prompt, so analyses that would produce the same prompt share one
+    answer. At most `max_entries` are kept; past that the least
+    recently used go, and expired ones are dropped when the cache is
+    written to or they are looked up.
+
+    Identical requests that arrive while a call is in flight wait on that
+    call instead of starting another. If the backend takes longer than the
+    latency budget, template insights are returned right away; the call
+    keeps running, fills the cache and is handed to the caller's
+    on_complete callback.
+    """
+
+    def __init__(self, backend: Optional[Any], ttl: float = INSIGHTS_CACHE_TTL,
+                 latency_budget: Optional[float] = INSIGHTS_LATENCY_BUDGET,
+                 max_entries: int = INSIGHTS_CACHE_SIZE):
+        self.backend = backend
+        self.ttl = ttl
+        self.latency_budget = latency_budget
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple, Tuple[float, dict]]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self.evictions = 0
+
+    async def get(self, analysis_data: dict,
+                  on_complete: Optional[Callable[[dict], Awaitable[None]]] = None,
+                  latency_budget: Any = ...) -> dict:
+        """Insights for an analysis (see class docstring)"""
+        insights, late = await self.get_with_late(analysis_data, latency_budget)
+        if late is not None and on_complete is not None:
+            late.add_done_callback(lambda t: _run_callback(t, on_complete))
+        return insights
+
+    async def get_with_late(self, analysis_data: dict,
+                            latency_budget: Any = ...) -> Tuple[dict, Optional[asyncio.Future]]:
+        """
+        Insights plus, when the budget ran out, the still-running AI call
+
+        The second item is None if the returned insights are final;
+        otherwise it is a future that resolves to the AI insights.
+        """
+        if self.backend is None:
+            return _generate_template_insights(analysis_data), None
+        if latency_budget is ...:
+            latency_budget = self.latency_budget
+
+        key = _prompt_key(analysis_data)
+        cached = self._cache.get(key)
+        if cached is not None:
+            if time.monotonic() - cached[0] < self.ttl:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[1], None
+            del self._cache[key]
+            self.evictions += 1
+        self.misses += 1
+
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._generate(key, analysis_data))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), latency_budget), None
+        except asyncio.TimeoutError:
+            self.fallbacks += 1
+            return _generate_template_insights(analysis_data), task
+
+    async def _generate(self, key: Tuple, analysis_data: dict) -> dict:
+        """One backend call; errors fall back to the template (not cached)"""
+        try:
+            with span('ai_call'):
+                response_text = await self.backend.complete(_build_prompt(analysis_data))
+        except Exception as e:
+            # Fallback to template-based insights
+            logger.warning("AI API error, using template insights: %s", e)
+            return _generate_template_insights(analysis_data)
+        insights = _parse_response(response_text)
+        self._store(key, insights)
+        return insights
+
+    def _store(self, key: Tuple, insights: dict) -> None:
+        """Cache insights, dropping expired entries and then LRU ones past max_entries"""
+        now = time.monotonic()
+        expired = [k for k, (created, _) in self._cache.items() if now - created >= self.ttl]
+        for k in expired:
+            del self._cache[k]
+        self._cache[key] = (now, insights)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        self.evictions += len(expired)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'fallbacks': self.fallbacks,
+            'evictions': self.evictions,
+            'cached': len(self._cache),
+            'inflight': len(self._inflight),
+        }
+
+
+# Late on_complete calls still running (held so they aren't garbage collected)
+_callbacks = set()
+
+
+def _run_callback(task: asyncio.Task, on_complete: Callable[[dict], Awaitable[None]]) -> None:
+    """Hand a late backend result to on_complete"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    callback = asyncio.ensure_future(on_complete(task.result()))
+    _callbacks.add(callback)
+    callback.add_done_callback(_callbacks.discard)
+
+
+# Shared service used by the API routes
+insight_service = InsightService(_default_backend())
+
+
+async def generate_insights_async(analysis_data: dict,
+                                  on_complete: Optional[Callable[[dict], Awaitable[None]]] = None) -> dict:
+    """
+    Generate AI-powered insights using Claude
+    Falls back to template if the API fails or exceeds the latency budget
+    """
+    return await insight_service.get(analysis_data, on_complete)
+
 
 def generate_insights(analysis_data: dict) -> dict:
     """
     Generate AI-powered insights using Claude
     Falls back to template if API fails
+
+    Blocking version for code outside the event loop; waits for the
+    backend without a latency budget.
     """
     # If no API key or client not initialized, use template
-    if not client:
-        print("No API key found, using template insights")
+    if insight_service.backend is None:
+        logger.debug("no AI backend configured, using template insights")
         return _generate_template_insights(analysis_data)
-    
-    try:
-        # Extract key metrics
-        total_products = analysis_data.get('totalProducts', 0)
-        adoption_rate = analysis_data.get('overallAdoptionRate', 0)
-        category_breakdown = analysis_data.get('categoryBreakdown', [])
-        high_risk_count = len(analysis_data.get('highRiskProducts', []))
-        
-        # Find top category
-        top_category = max(category_breakdown, key=lambda x: x['count']) if category_breakdown else None
-        
-        # Build prompt
-        prompt = f"""Analyze this zero-waste sustainability data and provide actionable insights:
+    return asyncio.run(insight_service.get(analysis_data, latency_budget=None))
+
+
+def _prompt_key(analysis_data: dict) -> Tuple:
+    """
+    Cache key: the metrics the prompt renders, as it renders them
+
+    _build_prompt reads its values from here, so two analyses share a key
+    only if their prompts (and template insights) are the same.
+    """
+    top_category = _top_category(analysis_data)
+    return (
+        analysis_data.get('totalProducts', 0),
+        analysis_data.get('overallAdoptionRate', 0),
+        top_category['category'] if top_category else 'N/A',
+        top_category['count'] if top_category else 0,
+        len(analysis_data.get('highRiskProducts', [])),
+    )
+
+
+def _top_category(analysis_data: dict) -> Optional[dict]:
+    category_breakdown = analysis_data.get('categoryBreakdown', [])
+    return max(category_breakdown, key=lambda x: x['count']) if category_breakdown else None
+
+
+def _build_prompt(analysis_data: dict) -> str:
+    """Prompt for the AI backend"""
+    # Key metrics, the same values the cache is keyed on
+    total_products, adoption_rate, top_category, top_count, high_risk_count = _prompt_key(analysis_data)
+
+    return f"""Analyze this zero-waste sustainability data and provide actionable insights:
 
 Key Metrics:
 - Total Products: {total_products}
 - Overall Zero-Waste Adoption Rate: {adoption_rate}%
-- Top Category: {top_category['category'] if top_category else 'N/A'} ({top_category['count'] if top_category else 0} products)
+- Top Category: {top_category} ({top_count} products)
 - High-Risk Products (popular but no zero-waste option): {high_risk_count}
 
 Provide insights in the following format:
@@ -50,42 +291,28 @@ Provide insights in the following format:
 
 Be specific, actionable, and sustainability-focused."""
 
-        # Call Claude API
-        message = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }]
-        )
-        
-        # Parse response
-        response_text = message.content[0].text
-        
-        # Simple parsing (you can improve this)
-        sections = response_text.split('\n\n')
-        summary = sections[0] if sections else "Analysis complete."
-        consumer = sections[1] if len(sections) > 1 else "Consider choosing zero-waste options when available."
-        business = sections[2] if len(sections) > 2 else "Explore expanding zero-waste product offerings."
-        policy = sections[3] if len(sections) > 3 else "Consider incentives for zero-waste product adoption."
-        
-        return {
-            'summary': summary,
-            'consumer': consumer,
-            'business': business,
-            'policy': policy
-        }
-        
-    except Exception as e:
-        # Fallback to template-based insights
-        print(f"AI API error: {e}")
-        return _generate_template_insights(analysis_data)
+
+def _parse_response(response_text: str) -> dict:
+    """Split the model's answer into the four insight sections"""
+    # Simple parsing (you can improve this)
+    sections = response_text.split('\n\n')
+    summary = sections[0] if sections else "Analysis complete."
+    consumer = sections[1] if len(sections) > 1 else "Consider choosing zero-waste options when available."
+    business = sections[2] if len(sections) > 2 else "Explore expanding zero-waste product offerings."
+    policy = sections[3] if len(sections) > 3 else "Consider incentives for zero-waste product adoption."
+
+    return {
+        'summary': summary,
+        'consumer': consumer,
+        'business': business,
+        'policy': policy
+    }
+
 
 def _generate_template_insights(analysis_data: dict) -> dict:
     """Fallback template-based insights"""
     adoption_rate = analysis_data.get('overallAdoptionRate', 0)
-    
+
     if adoption_rate < 20:
         status = "low"
         recommendation = "significant opportunity for improvement"
@@ -95,11 +322,10 @@ def _generate_template_insights(analysis_data: dict) -> dict:
     else:
         status = "strong"
         recommendation = "excellent adoption rate"
-    
+
     return {
         'summary': f"Zero-waste adoption is currently at {adoption_rate}%, indicating {recommendation}.",
         'consumer': f"Look for zero-waste options in your shopping. Currently, {adoption_rate}% of products offer package-free alternatives.",
         'business': f"Consider expanding zero-waste product lines. With {adoption_rate}% adoption, there's opportunity to meet growing consumer demand.",
         'policy': f"Policymakers could incentivize zero-waste adoption through tax benefits or regulations. Current adoption rate: {adoption_rate}%."
     }
-
@@ -1,75 +1,438 @@
-from typing import Dict, List, Any
-from collections import Counter, defaultdict
+import os
+from typing import Dict, List, Any, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
 
-def analyze_data(parsed_data: Dict[str, Any]) -> Dict[str, Any]:
+from services.compact import CompactLines
+from services.sketches import FrequentItems, HyperLogLog
+
+# Bump when the analysis response changes, so cached results are not reused
+ANALYZER_VERSION = 1
+
+# Number of products reported in highRiskProducts
+HIGH_RISK_LIMIT = 20
+
+# Error bounds of the approximate (sketch) analysis: high-risk counts may be
+# low by up to this share of all transaction lines, and distinct counts
+# have about this relative standard error
+SKETCH_TOP_K_ERROR = float(os.getenv("SKETCH_TOP_K_ERROR", 0.0005))
+SKETCH_DISTINCT_ERROR = float(os.getenv("SKETCH_DISTINCT_ERROR", 0.01))
+
+def analyze_data(parsed_data: Union[Dict[str, Any], CompactLines]) -> Dict[str, Any]:
     """
     Analyze parsed data and generate metrics for visualization
+
+    Accepts the list-of-dicts output of parse_excel_file, or CompactLines
+    from parse_compact. Columnar callers should use analyze_frame directly.
+    """
+    if isinstance(parsed_data, CompactLines):
+        return analyze_compact(parsed_data)
+    products = pd.DataFrame(parsed_data['products'], columns=['productId', 'description', 'category', 'hasZeroWaste'])
+    tx_product_ids = [t['productId'] for t in parsed_data['transactions']]
+
+    # Factorize product and transaction IDs together so they share codes
+    codes, _ = pd.factorize(np.concatenate([
+        products['productId'].to_numpy(dtype=object),
+        np.array(tx_product_ids, dtype=object),
+    ]))
+    return _analyze(products, codes[:len(products)], codes[len(products):])
+
+def analyze_frame(lines: pd.DataFrame, high_risk_limit: Optional[int] = HIGH_RISK_LIMIT) -> Dict[str, Any]:
+    """
+    Analyze the columnar output of parse_columns
+
+    Produces the same response as analyze_data without materializing
+    per-row Python objects. high_risk_limit=None ranks every eligible
+    product instead of the top HIGH_RISK_LIMIT (used by full reports).
+    """
+    product_codes, _ = pd.factorize(lines['productId'])
+    if 'transactionId' in lines.columns:
+        tx_codes = product_codes[lines['transactionId'].notna().to_numpy()]
+    else:
+        tx_codes = product_codes[:0]
+    return _analyze(lines, product_codes, tx_codes, high_risk_limit)
+
+def analyze_compact(lines: CompactLines, high_risk_limit: Optional[int] = HIGH_RISK_LIMIT) -> Dict[str, Any]:
+    """
+    Analyze CompactLines
+
+    Works on the integer codes and only decodes the strings that end up
+    in the response. Gives the same response as analyze_frame on
+    lines.to_frame().
+    """
+    has_zero_waste = lines.has_zero_waste
+    product_codes = lines.product_codes
+    tx_codes = product_codes[lines.has_transaction]
+
+    # Refactorizing the codes gives categories in first-seen order
+    cat_codes, cat_uniques = pd.factorize(lines.category.codes)
+    categories = lines.category.values[cat_uniques]
+    cat_totals = np.bincount(cat_codes, minlength=len(categories)).tolist()
+    cat_zero_waste = np.bincount(cat_codes, weights=has_zero_waste, minlength=len(categories)).astype(int).tolist()
+
+    rows, tx_counts = _high_risk_rows(product_codes, tx_codes, has_zero_waste, high_risk_limit)
+    high_risk_products = [
+        _high_risk_entry(product_id, description, category, tx_count)
+        for product_id, description, category, tx_count in zip(
+            lines.product.take(rows).tolist(), lines.description.take(rows).tolist(),
+            lines.category.take(rows).tolist(), tx_counts.tolist()
+        )
+    ]
+
+    return _build_response(categories.tolist(), cat_totals, cat_zero_waste,
+                           high_risk_products, len(lines), len(tx_codes))
+
+def _analyze(products: pd.DataFrame, product_codes: np.ndarray, tx_codes: np.ndarray,
+             high_risk_limit: Optional[int] = HIGH_RISK_LIMIT) -> Dict[str, Any]:
+    """
+    Shared implementation behind analyze_data and analyze_frame
+
+    product_codes holds one integer product code per line and tx_codes one
+    per transaction, both from the same factorization.
     """
-    products = parsed_data['products']
-    transactions = parsed_data['transactions']
-    
-    # Category breakdown
-    category_counts = Counter(p['category'] for p in products)
     total_products = len(products)
-    category_breakdown = [
-        {
+    has_zero_waste = products['hasZeroWaste'].to_numpy(dtype=bool)
+
+    # Category breakdown and zero-waste adoption come from one grouped pass.
+    # factorize keeps categories in first-seen order, like the old Counter.
+    cat_codes, categories = pd.factorize(products['category'], use_na_sentinel=False)
+    cat_totals = np.bincount(cat_codes, minlength=len(categories)).tolist()
+    cat_zero_waste = np.bincount(cat_codes, weights=has_zero_waste, minlength=len(categories)).astype(int).tolist()
+
+    high_risk_products = _high_risk_products(products, product_codes, tx_codes, has_zero_waste, high_risk_limit)
+
+    return _build_response(categories.tolist(), cat_totals, cat_zero_waste,
+                           high_risk_products, total_products, len(tx_codes))
+
+def _build_response(categories: List[Any], cat_totals: List[int], cat_zero_waste: List[int],
+                    high_risk_products: List[Dict[str, Any]], total_products: int,
+                    total_transactions: int) -> Dict[str, Any]:
+    """Assemble the analysis response from per-category totals"""
+    category_breakdown = []
+    zero_waste_adoption = []
+    for cat, count, zero_waste in zip(categories, cat_totals, cat_zero_waste):
+        category_breakdown.append({
             'category': cat,
             'count': count,
             'percentage': round((count / total_products) * 100, 2)
-        }
-        for cat, count in category_counts.items()
-    ]
-    
-    # Zero-waste adoption by category
-    category_zero_waste = defaultdict(lambda: {'zero_waste': 0, 'total': 0})
-    for product in products:
-        cat = product['category']
-        category_zero_waste[cat]['total'] += 1
-        if product['hasZeroWaste']:
-            category_zero_waste[cat]['zero_waste'] += 1
-    
-    zero_waste_adoption = [
-        {
+        })
+        zero_waste_adoption.append({
             'category': cat,
-            'zeroWasteCount': data['zero_waste'],
-            'totalCount': data['total'],
-            'adoptionRate': round((data['zero_waste'] / data['total']) * 100, 2) if data['total'] > 0 else 0
-        }
-        for cat, data in category_zero_waste.items()
-    ]
-    
-    # Transaction counts per product
-    transaction_counts = Counter(t['productId'] for t in transactions)
-    
-    # High-risk products (popular but no zero-waste option)
-    product_map = {p['productId']: p for p in products}
-    high_risk_products = []
-    
-    for product_id, tx_count in transaction_counts.items():
-        if product_id in product_map:
-            product = product_map[product_id]
-            if not product['hasZeroWaste']:
-                high_risk_products.append({
-                    'productId': product_id,
-                    'description': product['description'],
-                    'category': product['category'],
-                    'transactionCount': tx_count,
-                    'hasZeroWaste': False
-                })
-    
-    # Sort by transaction count (descending)
-    high_risk_products.sort(key=lambda x: x['transactionCount'], reverse=True)
-    
+            'zeroWasteCount': zero_waste,
+            'totalCount': count,
+            'adoptionRate': round((zero_waste / count) * 100, 2) if count > 0 else 0
+        })
+
     # Overall adoption rate
-    total_zero_waste = sum(1 for p in products if p['hasZeroWaste'])
+    total_zero_waste = sum(cat_zero_waste)
     overall_adoption_rate = round((total_zero_waste / total_products) * 100, 2) if total_products > 0 else 0
-    
+
     return {
         'categoryBreakdown': category_breakdown,
         'zeroWasteAdoption': zero_waste_adoption,
-        'highRiskProducts': high_risk_products[:20],  # Top 20
+        'highRiskProducts': high_risk_products,
         'totalProducts': total_products,
-        'totalTransactions': len(transactions),
+        'totalTransactions': total_transactions,
         'overallAdoptionRate': overall_adoption_rate
     }
 
+def _top_high_risk(tx_counts: np.ndarray, first_tx: np.ndarray, eligible: np.ndarray,
+                   limit: Optional[int] = HIGH_RISK_LIMIT) -> np.ndarray:
+    """
+    Indices of the top `limit` eligible products (all of them for None)
+
+    Orders by transaction count (descending), then by first transaction.
+    Only products at or above the Nth largest count are sorted, instead of
+    sorting every product.
+    """
+    candidates = np.flatnonzero(eligible & (tx_counts > 0))
+    counts = tx_counts[candidates]
+    if limit is not None and len(candidates) > limit:
+        threshold = np.partition(counts, -limit)[-limit]
+        candidates = candidates[counts >= threshold]
+        counts = tx_counts[candidates]
+    order = np.lexsort((first_tx[candidates], -counts))[:limit]
+    return candidates[order]
+
+def _high_risk_entry(product_id: Any, description: Any, category: Any, tx_count: int) -> Dict[str, Any]:
+    """One highRiskProducts item"""
+    return {
+        'productId': product_id,
+        'description': description,
+        'category': category,
+        'transactionCount': tx_count,
+        'hasZeroWaste': False
+    }
+
+def _high_risk_products(products: pd.DataFrame, product_codes: np.ndarray,
+                        tx_codes: np.ndarray, has_zero_waste: np.ndarray,
+                        limit: Optional[int] = HIGH_RISK_LIMIT) -> List[Dict[str, Any]]:
+    """
+    Popular products with no zero-waste option, most transactions first
+
+    Ties keep the order in which products first appear in the transactions.
+    """
+    rows, tx_counts = _high_risk_rows(product_codes, tx_codes, has_zero_waste, limit)
+    rows = products.iloc[rows]
+    return [
+        _high_risk_entry(product_id, description, category, tx_count)
+        for product_id, description, category, tx_count in zip(
+            rows['productId'].tolist(), rows['description'].tolist(),
+            rows['category'].tolist(), tx_counts.tolist()
+        )
+    ]
+
+def _high_risk_rows(product_codes: np.ndarray, tx_codes: np.ndarray, has_zero_waste: np.ndarray,
+                    limit: Optional[int] = HIGH_RISK_LIMIT) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The line describing each high-risk product, and its transaction count
+
+    Products are in highRiskProducts order.
+    """
+    if len(tx_codes) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int64)
+
+    n_codes = int(max(product_codes.max(initial=-1), tx_codes.max())) + 1
+    tx_counts = np.bincount(tx_codes, minlength=n_codes)
+
+    # The last line seen for a product describes it (repeated index
+    # assignment keeps the last write). -1 marks IDs with no product line.
+    last_row = np.full(n_codes, -1)
+    last_row[product_codes] = np.arange(len(product_codes))
+
+    # Position of each product's first transaction, for tie-breaking
+    first_tx = np.zeros(n_codes, dtype=np.int64)
+    first_tx[tx_codes[::-1]] = np.arange(len(tx_codes) - 1, -1, -1)
+
+    eligible = last_row >= 0
+    eligible[eligible] = ~has_zero_waste[last_row[eligible]]
+    top = _top_high_risk(tx_counts, first_tx, eligible, limit)
+    return last_row[top], tx_counts[top]
+
+def merge_analyses(analyses: List[Dict[str, Any]], high_risk_limit: Optional[int] = HIGH_RISK_LIMIT) -> Dict[str, Any]:
+    """
+    Combine the analysis responses of separate datasets (e.g. one per store)
+
+    Category counts are summed, with categories in first-seen order. The
+    highRiskProducts lists are merged by product ID: transaction counts
+    are added and the last list naming a product describes it. The
+    ranking is exact when every list is complete (high_risk_limit=None);
+    with top-K lists a product only counts in the lists it made.
+    """
+    category_totals: Dict[Any, int] = {}
+    category_zero_waste: Dict[Any, int] = {}
+    tx_counts: Dict[Any, int] = {}
+    products: Dict[Any, Dict[str, Any]] = {}
+    for analysis in analyses:
+        for adoption in analysis['zeroWasteAdoption']:
+            cat = adoption['category']
+            category_totals[cat] = category_totals.get(cat, 0) + adoption['totalCount']
+            category_zero_waste[cat] = category_zero_waste.get(cat, 0) + adoption['zeroWasteCount']
+        for product in analysis['highRiskProducts']:
+            product_id = product['productId']
+            tx_counts[product_id] = tx_counts.get(product_id, 0) + product['transactionCount']
+            products[product_id] = product
+
+    product_ids = list(tx_counts)
+    counts = np.fromiter(tx_counts.values(), dtype=np.int64, count=len(product_ids))
+    top = _top_high_risk(counts, np.arange(len(product_ids)), np.ones(len(product_ids), dtype=bool), high_risk_limit)
+    high_risk_products = [
+        _high_risk_entry(product_ids[i], products[product_ids[i]]['description'],
+                         products[product_ids[i]]['category'], int(counts[i]))
+        for i in top.tolist()
+    ]
+
+    categories = list(category_totals)
+    return _build_response(
+        categories,
+        [category_totals[c] for c in categories],
+        [category_zero_waste[c] for c in categories],
+        high_risk_products,
+        sum(a['totalProducts'] for a in analyses),
+        sum(a['totalTransactions'] for a in analyses),
+    )
+
+class RunningAnalysis:
+    """
+    Analysis aggregates folded in one parsed chunk at a time
+
+    Keeps per-category totals, per-product transaction counts and the last
+    line seen for each product, so memory grows with the number of distinct
+    products rather than the number of lines. result() returns the same
+    response analyze_frame would give for all chunks concatenated.
+    """
+
+    def __init__(self):
+        self.category_totals: Dict[Any, int] = {}
+        self.category_zero_waste: Dict[Any, int] = {}
+        # Insertion order is the order of each product's first transaction
+        self.tx_counts: Dict[Any, int] = {}
+        # productId -> (description, category, hasZeroWaste) of its last line
+        self.products: Dict[Any, tuple] = {}
+        self.total_products = 0
+        self.total_transactions = 0
+
+    def add(self, lines: pd.DataFrame) -> None:
+        """Fold a chunk of parse_columns output into the aggregates"""
+        if lines.empty:
+            return
+        has_zero_waste = lines['hasZeroWaste'].to_numpy(dtype=bool)
+
+        cat_codes, categories = pd.factorize(lines['category'], use_na_sentinel=False)
+        cat_totals = np.bincount(cat_codes, minlength=len(categories)).tolist()
+        cat_zero_waste = np.bincount(cat_codes, weights=has_zero_waste, minlength=len(categories)).astype(int).tolist()
+        for cat, count, zero_waste in zip(categories.tolist(), cat_totals, cat_zero_waste):
+            self.category_totals[cat] = self.category_totals.get(cat, 0) + count
+            self.category_zero_waste[cat] = self.category_zero_waste.get(cat, 0) + zero_waste
+
+        if 'transactionId' in lines.columns:
+            tx_product_ids = lines['productId'][lines['transactionId'].notna()]
+            tx_codes, tx_uniques = pd.factorize(tx_product_ids)
+            for product_id, count in zip(tx_uniques.tolist(), np.bincount(tx_codes).tolist()):
+                self.tx_counts[product_id] = self.tx_counts.get(product_id, 0) + count
+            self.total_transactions += len(tx_codes)
+
+        last_lines = lines.drop_duplicates('productId', keep='last')
+        self.products.update(zip(
+            last_lines['productId'].tolist(),
+            zip(last_lines['description'].tolist(), last_lines['category'].tolist(),
+                last_lines['hasZeroWaste'].tolist())
+        ))
+        self.total_products += len(lines)
+
+    def result(self) -> Dict[str, Any]:
+        """The analysis response for everything added so far"""
+        product_ids = list(self.tx_counts)
+        tx_counts = np.fromiter(self.tx_counts.values(), dtype=np.int64, count=len(product_ids))
+        eligible = np.array(
+            [pid in self.products and not self.products[pid][2] for pid in product_ids], dtype=bool
+        )
+        top = _top_high_risk(tx_counts, np.arange(len(product_ids)), eligible)
+
+        high_risk_products = []
+        for i in top.tolist():
+            description, category, _ = self.products[product_ids[i]]
+            high_risk_products.append(_high_risk_entry(product_ids[i], description, category, int(tx_counts[i])))
+
+        categories = list(self.category_totals)
+        return _build_response(
+            categories,
+            [self.category_totals[c] for c in categories],
+            [self.category_zero_waste[c] for c in categories],
+            high_risk_products, self.total_products, self.total_transactions
+        )
+
+class SketchAnalysis:
+    """
+    Fixed-memory, approximate counterpart of RunningAnalysis
+
+    Category totals are still exact (there are only a handful). The
+    high-risk ranking comes from a FrequentItems summary of the products
+    on transaction lines without a zero-waste flag, and distinct
+    products, transactions and customers from HyperLogLog sketches, so
+    memory stays bounded however many distinct products or transactions
+    the data has. Sketches merge, so chunks, files and workers can each
+    be summarized separately and combined with merge().
+
+    Unlike the exact analysis, a product's lines count toward the
+    ranking when they lack the zero-waste flag themselves (rather than
+    going by the product's last line), and ties are not ordered by first
+    transaction. result() adds an 'approximate' section with the
+    estimates and their error bounds.
+    """
+
+    def __init__(self, top_k_error: float = SKETCH_TOP_K_ERROR, distinct_error: float = SKETCH_DISTINCT_ERROR):
+        self.category_totals: Dict[Any, int] = {}
+        self.category_zero_waste: Dict[Any, int] = {}
+        self.high_risk = FrequentItems.for_error(top_k_error)
+        # productId -> (description, category) of its last line, for kept products only
+        self.products: Dict[Any, tuple] = {}
+        self.distinct_products = HyperLogLog.for_error(distinct_error)
+        self.distinct_transactions = HyperLogLog.for_error(distinct_error)
+        self.distinct_customers = HyperLogLog.for_error(distinct_error)
+        self.total_products = 0
+        self.total_transactions = 0
+
+    def add(self, lines: pd.DataFrame) -> None:
+        """Fold a chunk of parse_columns output into the sketches"""
+        if lines.empty:
+            return
+        has_zero_waste = lines['hasZeroWaste'].to_numpy(dtype=bool)
+
+        cat_codes, categories = pd.factorize(lines['category'], use_na_sentinel=False)
+        cat_totals = np.bincount(cat_codes, minlength=len(categories)).tolist()
+        cat_zero_waste = np.bincount(cat_codes, weights=has_zero_waste, minlength=len(categories)).astype(int).tolist()
+        for cat, count, zero_waste in zip(categories.tolist(), cat_totals, cat_zero_waste):
+            self.category_totals[cat] = self.category_totals.get(cat, 0) + count
+            self.category_zero_waste[cat] = self.category_zero_waste.get(cat, 0) + zero_waste
+
+        self.distinct_products.add(lines['productId'])
+        if 'customer' in lines.columns:
+            self.distinct_customers.add(lines['customer'])
+        if 'transactionId' in lines.columns:
+            has_transaction = lines['transactionId'].notna().to_numpy()
+            self.distinct_transactions.add(lines['transactionId'])
+            self.high_risk.add(lines['productId'][has_transaction & ~has_zero_waste])
+            self.total_transactions += int(has_transaction.sum())
+
+        # Descriptions only for products the summary still holds
+        last_lines = lines.drop_duplicates('productId', keep='last')
+        kept = last_lines['productId'].isin(self.high_risk.counts.index).to_numpy()
+        last_lines = last_lines[kept]
+        self.products.update(zip(
+            last_lines['productId'].tolist(),
+            zip(last_lines['description'].tolist(), last_lines['category'].tolist())
+        ))
+        self._prune()
+        self.total_products += len(lines)
+
+    def merge(self, other: "SketchAnalysis") -> None:
+        """Fold in a sketch built from other data (e.g. another file or worker)"""
+        for cat, count in other.category_totals.items():
+            self.category_totals[cat] = self.category_totals.get(cat, 0) + count
+            self.category_zero_waste[cat] = self.category_zero_waste.get(cat, 0) + other.category_zero_waste[cat]
+        self.high_risk.merge(other.high_risk)
+        self.products.update(other.products)
+        self._prune()
+        self.distinct_products.merge(other.distinct_products)
+        self.distinct_transactions.merge(other.distinct_transactions)
+        self.distinct_customers.merge(other.distinct_customers)
+        self.total_products += other.total_products
+        self.total_transactions += other.total_transactions
+
+    def result(self, high_risk_limit: Optional[int] = HIGH_RISK_LIMIT) -> Dict[str, Any]:
+        """The analysis response from the sketches, plus their estimates and error bounds"""
+        top = self.high_risk.top(high_risk_limit)
+        high_risk_products = []
+        for product_id, count in zip(top.index.tolist(), top.tolist()):
+            description, category = self.products[product_id]
+            high_risk_products.append(_high_risk_entry(product_id, description, category, int(count)))
+
+        categories = list(self.category_totals)
+        response = _build_response(
+            categories,
+            [self.category_totals[c] for c in categories],
+            [self.category_zero_waste[c] for c in categories],
+            high_risk_products, self.total_products, self.total_transactions
+        )
+        response['approximate'] = {
+            'highRiskProducts': {
+                # Each transactionCount is at most this much below the true count
+                'maxCountError': int(self.high_risk.error),
+                'relativeError': self.high_risk.relative_error,
+                'counters': self.high_risk.capacity,
+            },
+            'distinctProducts': _distinct_estimate(self.distinct_products),
+            'distinctTransactions': _distinct_estimate(self.distinct_transactions),
+            'distinctCustomers': _distinct_estimate(self.distinct_customers),
+        }
+        return response
+
+    def _prune(self) -> None:
+        """Forget descriptions of products the summary has dropped"""
+        if len(self.products) > len(self.high_risk.counts):
+            kept = self.high_risk.counts.index
+            self.products = {pid: info for pid, info in self.products.items() if pid in kept}
+
+def _distinct_estimate(sketch: HyperLogLog) -> Dict[str, Any]:
+    return {'estimate': sketch.count(), 'relativeError': round(sketch.relative_error, 5)}
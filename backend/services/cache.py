@@ -0,0 +1,134 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, BinaryIO, Dict, Optional
+
+from services.metrics import span
+from services.responses import encode_json
+
+# Bytes read at a time when hashing an upload
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_upload(file_obj: BinaryIO) -> str:
+    """
+    Content key for an uploaded file
+
+    Hashes the bytes in blocks and rewinds the file afterwards. The parser
+    and analyzer versions are part of the key, so a change to either one
+    never serves stale results.
+    """
+    # Imported here: both modules load pandas, which the server process
+    # only needs once an upload arrives
+    from services.parser import PARSER_VERSION
+    from services.analyzer import ANALYZER_VERSION
+
+    digest = hashlib.sha256()
+    with span('hash') as current:
+        file_obj.seek(0)
+        for block in iter(lambda: file_obj.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+        current.bytes = file_obj.tell()
+        file_obj.seek(0)
+    return f"{digest.hexdigest()}:p{PARSER_VERSION}:a{ANALYZER_VERSION}"
+
+
+class ResultCache:
+    """
+    Two-tier cache for upload results
+
+    The memory tier is an LRU bounded by the total size of the serialized
+    results. When db_path is set, results are also written to a SQLite
+    file, which survives restarts and is checked on a memory miss.
+    """
+
+    def __init__(self, max_bytes: int, db_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_path:
+            self._execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached result for key, or None"""
+        value = self.get_json(key)
+        return json.loads(value) if value is not None else None
+
+    def get_json(self, key: str) -> Optional[bytes]:
+        """Cached result for key as the JSON it is stored as, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.db_path:
+            row = self._execute("SELECT value FROM results WHERE key = ?", (key,))
+            if row is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, row[0])
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a result in memory and, when configured, on disk"""
+        value = encode_json(result)
+        with self._lock:
+            self._store(key, value)
+        if self.db_path:
+            self._execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, value))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters plus current memory usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'maxBytes': self.max_bytes,
+                'diskEnabled': bool(self.db_path),
+            }
+
+    def _store(self, key: str, value: bytes) -> None:
+        """Insert into the memory tier and evict LRU entries (lock held)"""
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _execute(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        """Run one statement against the disk tier and return the first row"""
+        with closing(sqlite3.connect(self.db_path)) as conn, conn:
+            return conn.execute(sql, params).fetchone()
+
+
+# Shared cache for /api/upload, configured from the environment
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    db_path=os.getenv("RESULT_CACHE_DB") or None,
+)
@@ -0,0 +1,203 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Dictionary-encoded columns of CompactLines, by parse_columns name
+ENCODED_COLUMNS = {
+    'productId': 'product',
+    'description': 'description',
+    'category': 'category',
+    'subcategory': 'subcategory',
+    'transactionId': 'transaction',
+    'location': 'location',
+    'customer': 'customer',
+}
+
+
+@dataclass
+class EncodedColumn:
+    """
+    A dictionary-encoded text column
+
+    codes holds one integer per line indexing into values, the table of
+    distinct strings (each string is stored once). Missing values have
+    code -1.
+    """
+    codes: np.ndarray
+    values: np.ndarray
+
+    @classmethod
+    def encode(cls, column: Any) -> 'EncodedColumn':
+        """Encode a column of strings (None/NaN become -1)"""
+        codes, uniques = pd.factorize(column)
+        return cls(_narrow(codes, len(uniques)), np.asarray(uniques, dtype=object))
+
+    @classmethod
+    def encode_values(cls, column: pd.Series, convert: Callable[[pd.Series], pd.Series],
+                      keep_missing: bool = True) -> 'EncodedColumn':
+        """
+        Encode a raw column, converting each distinct value with convert
+
+        convert runs once per distinct value instead of once per line.
+        Values that convert to the same string share a code. With
+        keep_missing=False, missing values are converted like any other
+        value instead of getting code -1.
+        """
+        codes, uniques = pd.factorize(column)
+        converted = [convert(pd.Series(uniques, dtype=object))]
+        missing = codes == -1
+        if not keep_missing and missing.any():
+            # factorize treats None, NaN and NaT as one value, but they
+            # convert to different strings ('None', 'nan', 'NaT')
+            missing_codes, missing_text = pd.factorize(convert(column[missing].astype(object)),
+                                                       use_na_sentinel=False)
+            codes[missing] = len(uniques) + missing_codes
+            converted.append(pd.Series(missing_text, dtype=object))
+        text_codes, text = pd.factorize(pd.concat(converted, ignore_index=True), use_na_sentinel=False)
+        codes = np.append(text_codes, -1)[codes]
+        return cls(_narrow(codes, len(text)), np.asarray(text, dtype=object))
+
+    @classmethod
+    def constant(cls, value: str, length: int) -> 'EncodedColumn':
+        """A column with the same value on every line"""
+        return cls(np.zeros(length, dtype=np.int8), np.array([value], dtype=object))
+
+    @classmethod
+    def from_arrow(cls, column: Any) -> 'EncodedColumn':
+        """Encode an Arrow string column without going through Python strings per line"""
+        if isinstance(column, pa.ChunkedArray):
+            column = column.combine_chunks()
+        encoded = column.dictionary_encode()
+        codes = pc.fill_null(encoded.indices, -1).to_numpy(zero_copy_only=False)
+        values = encoded.dictionary.to_numpy(zero_copy_only=False).astype(object)
+        return cls(_narrow(codes, len(values)), values)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def decode(self) -> np.ndarray:
+        """The column as an object array of strings (None where missing)"""
+        return self.take(slice(None))
+
+    def take(self, rows: Any) -> np.ndarray:
+        """Decoded values of some lines"""
+        # The trailing None is picked by the -1 code of missing values
+        return np.append(self.values, None)[self.codes[rows]]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.values.nbytes + sum(len(v) for v in self.values if isinstance(v, str))
+
+
+@dataclass
+class CompactLines:
+    """
+    Memory-compact form of parse_columns output
+
+    Text columns are dictionary-encoded (see EncodedColumn), so a category
+    or description repeated on thousands of lines is one small integer per
+    line plus one string. Product and transaction IDs are interned the
+    same way, so each transaction costs an integer rather than a copy of
+    its product ID. hasZeroWaste is a bool array. The optional columns are
+    None when the file does not have them (or were not loaded).
+
+    analyze_data and analyze_compact read it directly; to_frame() expands
+    it back to the parse_columns DataFrame.
+    """
+    product: EncodedColumn
+    description: EncodedColumn
+    category: EncodedColumn
+    has_zero_waste: np.ndarray
+    subcategory: Optional[EncodedColumn] = None
+    transaction: Optional[EncodedColumn] = None
+    date: Optional[np.ndarray] = None
+    location: Optional[EncodedColumn] = None
+    amount: Optional[np.ndarray] = None
+    customer: Optional[EncodedColumn] = None
+
+    @classmethod
+    def from_frame(cls, lines: pd.DataFrame) -> 'CompactLines':
+        """Encode a parse_columns DataFrame"""
+        fields: Dict[str, Any] = {
+            field: EncodedColumn.encode(lines[column])
+            for column, field in ENCODED_COLUMNS.items() if column in lines.columns
+        }
+        fields['has_zero_waste'] = lines['hasZeroWaste'].to_numpy(dtype=bool)
+        if 'date' in lines.columns:
+            fields['date'] = lines['date'].to_numpy(dtype='datetime64[ns]')
+        if 'amount' in lines.columns:
+            fields['amount'] = lines['amount'].to_numpy(dtype=float)
+        return cls(**fields)
+
+    @classmethod
+    def from_arrow(cls, table: pa.Table) -> 'CompactLines':
+        """Encode an Arrow table in the dataset store's line layout"""
+        names = set(table.column_names)
+        fields: Dict[str, Any] = {
+            field: EncodedColumn.from_arrow(table.column(column))
+            for column, field in ENCODED_COLUMNS.items() if column in names
+        }
+        fields['has_zero_waste'] = table.column('hasZeroWaste').to_numpy().astype(bool)
+        if 'date' in names:
+            fields['date'] = table.column('date').to_numpy().astype('datetime64[ns]')
+        if 'amount' in names:
+            fields['amount'] = table.column('amount').to_numpy().astype(float)
+        return cls(**fields)
+
+    def __len__(self) -> int:
+        return len(self.has_zero_waste)
+
+    @property
+    def product_codes(self) -> np.ndarray:
+        return self.product.codes
+
+    @property
+    def has_transaction(self) -> np.ndarray:
+        """Which lines carry a transaction ID"""
+        if self.transaction is None:
+            return np.zeros(len(self), dtype=bool)
+        return self.transaction.codes >= 0
+
+    def to_frame(self) -> pd.DataFrame:
+        """The parse_columns DataFrame these lines were encoded from"""
+        columns = {
+            'productId': self.product.decode(),
+            'description': self.description.decode(),
+            'category': self.category.decode(),
+            'subcategory': self.subcategory,
+            'hasZeroWaste': self.has_zero_waste,
+            'transactionId': self.transaction,
+            'date': self.date,
+            'location': self.location,
+            'amount': self.amount,
+            'customer': self.customer,
+        }
+        return pd.DataFrame({
+            column: pd.Series(values.decode(), dtype=object) if isinstance(values, EncodedColumn) else values
+            for column, values in columns.items() if values is not None
+        })
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the arrays and lookup strings"""
+        total = self.has_zero_waste.nbytes
+        for field in ENCODED_COLUMNS.values():
+            encoded = getattr(self, field)
+            if encoded is not None:
+                total += encoded.nbytes
+        for array in (self.date, self.amount):
+            if array is not None:
+                total += array.nbytes
+        return total
+
+
+def _narrow(codes: np.ndarray, n_values: int) -> np.ndarray:
+    """Codes in the smallest signed integer type that fits the lookup table"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_values < np.iinfo(dtype).max:
+            return codes.astype(dtype, copy=False)
+    return codes.astype(np.int64, copy=False)
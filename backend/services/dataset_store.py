@@ -0,0 +1,401 @@
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import pickle
+import sqlite3
+from contextlib import closing, contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from services.analyzer import ANALYZER_VERSION, HIGH_RISK_LIMIT, analyze_compact, RunningAnalysis
+from services.compact import CompactLines
+from services.metrics import span
+
+# Where saved datasets live: one Arrow IPC file plus one JSON metadata file
+# each, and a pickled aggregate state once a dataset has been appended to.
+# Files are never changed after they are written: an append makes a new
+# dataset whose metadata lists its parent's files plus its own.
+DATASET_DIR = os.getenv("DATASET_DIR", "datasets")
+
+# SQLite index of the transaction IDs in each dataset file, used to drop
+# already stored transactions from an append
+TRANSACTION_INDEX = os.getenv("TRANSACTION_INDEX", os.path.join(DATASET_DIR, "transactions.sqlite"))
+
+# Seconds an index write waits for another process's write to finish
+TRANSACTION_INDEX_TIMEOUT = 30
+
+# Column layout of a stored dataset (parse_columns output)
+LINE_SCHEMA = pa.schema([
+    ('productId', pa.string()),
+    ('description', pa.string()),
+    ('category', pa.string()),
+    ('subcategory', pa.string()),
+    ('hasZeroWaste', pa.bool_()),
+    ('transactionId', pa.string()),
+    ('date', pa.timestamp('ns')),
+    ('location', pa.string()),
+    ('amount', pa.float64()),
+    ('customer', pa.string()),
+])
+
+# Optional columns that parse_columns only produces when the file has them
+OPTIONAL_COLUMNS = ['transactionId', 'date', 'location', 'amount', 'customer']
+
+# Columns analyze_compact needs (subcategory is never read)
+ANALYSIS_COLUMNS = ['productId', 'description', 'category', 'hasZeroWaste', 'transactionId']
+
+_DATASET_ID = re.compile(r'^[0-9a-f]{16,64}$')
+
+
+class DatasetNotFound(Exception):
+    """Raised when a dataset ID is malformed or has no stored data"""
+
+
+def dataset_id_for(cache_key: str) -> str:
+    """Dataset ID for an upload: the start of its content hash"""
+    return cache_key.split(':', 1)[0][:32]
+
+
+def appended_dataset_id(dataset_id: str, cache_key: str) -> str:
+    """ID of the dataset made by appending an upload (by its cache key) to dataset_id"""
+    return hashlib.blake2b(f"{dataset_id}:{cache_key}".encode(), digest_size=16).hexdigest()
+
+
+class DatasetWriter:
+    """
+    Writes parsed lines to a dataset one chunk at a time
+
+    Chunks go straight to an uncompressed Arrow IPC file, so a streamed
+    upload never has to be held in memory. The file is written under a
+    temporary name and only appears once close() succeeds.
+    """
+
+    def __init__(self, dataset_id: str, filename: str = ''):
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        self.dataset_id = dataset_id
+        self.filename = filename
+        self.rows = 0
+        self._path = _data_path(dataset_id)
+        self._tmp_path = f"{self._path}.{os.getpid()}.tmp"
+        self._writer = pa.ipc.new_file(self._tmp_path, LINE_SCHEMA)
+
+    def write(self, lines: pd.DataFrame) -> None:
+        """Append a chunk of parse_columns output"""
+        self._writer.write_table(_line_table(lines))
+        self.rows += len(lines)
+
+    def close(self) -> None:
+        """Finish the file and publish it with its metadata"""
+        self._writer.close()
+        os.replace(self._tmp_path, self._path)
+        # Aggregates saved for an earlier upload with this ID (e.g. parsed
+        # by an older parser version) no longer describe it
+        if os.path.exists(_state_path(self.dataset_id)):
+            os.unlink(_state_path(self.dataset_id))
+        _write_metadata(self.dataset_id, {
+            'datasetId': self.dataset_id,
+            'filename': self.filename,
+            'rows': self.rows,
+            'createdAt': time.time(),
+            'files': [os.path.basename(self._path)],
+        })
+
+    def abort(self) -> None:
+        """Discard a partially written dataset"""
+        self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+def save_dataset(dataset_id: str, lines: pd.DataFrame, filename: str = '') -> None:
+    """Store a whole parse_columns frame under dataset_id"""
+    writer = DatasetWriter(dataset_id, filename)
+    try:
+        writer.write(lines)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def load_lines(dataset_id: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read a stored dataset, optionally only some of its columns"""
+    return _read_table(dataset_id, columns).to_pandas()
+
+
+def load_compact(dataset_id: str, columns: Optional[List[str]] = None) -> CompactLines:
+    """
+    Read a stored dataset as CompactLines
+
+    Text columns are dictionary-encoded by Arrow, so no per-line Python
+    strings are created. columns must include the ones CompactLines
+    requires (ANALYSIS_COLUMNS at least).
+    """
+    return CompactLines.from_arrow(_read_table(dataset_id, columns))
+
+
+def append_lines(dataset_id: str, lines: pd.DataFrame, cache_key: str,
+                 filename: str = '') -> Tuple[str, Dict[str, Any]]:
+    """
+    Append parsed lines to a stored dataset
+
+    Returns the ID of the combined dataset and its analysis. Lines whose
+    transaction ID is already in the dataset are dropped. The combined
+    dataset gets a new ID (appended_dataset_id), made of the parent's
+    files plus one with the new lines, so the parent, which a re-upload
+    of its file still maps to, never changes. When nothing is new the
+    parent itself is returned. Appending the same upload (by cache_key)
+    to the same parent again returns the dataset made the first time.
+
+    Running aggregates are kept on disk per dataset and transaction IDs
+    in an indexed table (TRANSACTION_INDEX) that is queried for the new
+    IDs only, so the cost depends on the new lines (the first append to
+    an upload builds both from its stored data once). The result equals
+    analyze_dataset on the combined data.
+    """
+    if not dataset_exists(dataset_id):
+        raise DatasetNotFound(dataset_id)
+    new_id = appended_dataset_id(dataset_id, cache_key)
+    with _dataset_lock(new_id):
+        if dataset_exists(new_id):
+            analysis = _load_state(new_id).result()
+            analysis['appended'] = load_metadata(new_id)['appended']
+            return new_id, analysis
+
+        files = _dataset_files(dataset_id)
+        new_lines = _drop_seen_transactions(files, lines)
+        appended = {
+            'rows': len(new_lines),
+            'duplicateRows': len(lines) - len(new_lines),
+            'parentDatasetId': dataset_id,
+        }
+        state = _load_state(dataset_id)
+        if new_lines.empty:
+            analysis = state.result()
+            analysis['appended'] = appended
+            return dataset_id, analysis
+
+        path = _data_path(new_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.ipc.new_file(tmp_path, LINE_SCHEMA) as writer:
+            writer.write_table(_line_table(new_lines))
+        state.add(new_lines)
+        _save_state(new_id, state)
+        _write_metadata(new_id, {
+            'datasetId': new_id,
+            'filename': filename,
+            'rows': state.total_products,
+            'createdAt': time.time(),
+            'files': [os.path.basename(p) for p in files] + [os.path.basename(path)],
+            'appended': appended,
+        })
+        _index_transactions(path, new_lines)
+        # The data file goes last: the dataset exists once it does
+        os.replace(tmp_path, path)
+
+    analysis = state.result()
+    analysis['appended'] = appended
+    return new_id, analysis
+
+
+def analyze_dataset(dataset_id: str, high_risk_limit: Optional[int] = HIGH_RISK_LIMIT) -> Dict[str, Any]:
+    """Analysis response for a stored dataset"""
+    with span('load') as current:
+        lines = load_compact(dataset_id, ANALYSIS_COLUMNS)
+        current.rows = len(lines)
+    with span('analyze', rows=len(lines)):
+        return analyze_compact(lines, high_risk_limit)
+
+
+def load_metadata(dataset_id: str) -> Dict[str, Any]:
+    """Metadata saved with a dataset (filename, rows, insights, ...)"""
+    path = _metadata_path(dataset_id)
+    if not os.path.exists(path):
+        raise DatasetNotFound(dataset_id)
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_metadata(dataset_id: str, **fields: Any) -> None:
+    """Merge fields into a dataset's metadata"""
+    metadata = load_metadata(dataset_id)
+    metadata.update(fields)
+    _write_metadata(dataset_id, metadata)
+
+
+def dataset_signature(dataset_id: str) -> tuple:
+    """Files and modification times of a dataset, to detect changes"""
+    return tuple((p, os.path.getmtime(p)) for p in _dataset_files(dataset_id))
+
+
+def dataset_etag(dataset_id: str) -> str:
+    """
+    ETag for a dataset's analysis response
+
+    Changes with the dataset's files, its metadata (e.g. new insights)
+    and the analyzer version, so a client can revalidate without the
+    analysis being recomputed.
+    """
+    with open(_metadata_path(dataset_id), 'rb') as f:
+        metadata = f.read()
+    payload = json.dumps([dataset_signature(dataset_id), ANALYZER_VERSION], default=str).encode() + metadata
+    return f'"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+
+
+def dataset_exists(dataset_id: str) -> bool:
+    return _DATASET_ID.match(dataset_id) is not None and os.path.exists(_data_path(dataset_id))
+
+
+def sidecar_path(dataset_id: str, name: str) -> str:
+    """Path of a file derived from a dataset (e.g. an index), kept next to it"""
+    return os.path.join(DATASET_DIR, f"{dataset_id}.{name}")
+
+
+def _read_table(dataset_id: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """
+    A stored dataset as one Arrow table
+
+    Files are memory-mapped, so only the selected columns are touched.
+    Appended lines follow the original upload in append order.
+    """
+    tables = []
+    for segment in _dataset_files(dataset_id):
+        with pa.memory_map(segment) as source:
+            table = pa.ipc.open_file(source).read_all()
+        tables.append(table.select(columns) if columns is not None else table)
+    return pa.concat_tables(tables)
+
+
+def _line_table(lines: pd.DataFrame) -> pa.Table:
+    """parse_columns output as an Arrow table in LINE_SCHEMA layout"""
+    missing = [col for col in OPTIONAL_COLUMNS if col not in lines.columns]
+    if missing:
+        lines = lines.assign(**{col: None for col in missing})
+    return pa.Table.from_pandas(lines[LINE_SCHEMA.names], schema=LINE_SCHEMA, preserve_index=False)
+
+
+def _dataset_files(dataset_id: str) -> List[str]:
+    """Arrow files holding a dataset's lines, in append order"""
+    if not dataset_exists(dataset_id):
+        raise DatasetNotFound(dataset_id)
+    return [os.path.join(DATASET_DIR, name) for name in load_metadata(dataset_id)['files']]
+
+
+def _load_state(dataset_id: str) -> RunningAnalysis:
+    """Saved running aggregates, built from the stored lines (and saved) if missing"""
+    path = _state_path(dataset_id)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    state = RunningAnalysis()
+    state.add(load_lines(dataset_id, ANALYSIS_COLUMNS))
+    _save_state(dataset_id, state)
+    return state
+
+
+def _drop_seen_transactions(files: List[str], lines: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lines whose transaction ID is in none of files
+
+    Only the upload's distinct IDs are looked up, through the primary key
+    of the index, so the cost does not grow with the stored data. Files
+    not indexed yet are indexed first. Lines without a transaction ID are
+    always kept.
+    """
+    if 'transactionId' not in lines.columns:
+        return lines
+    ids = lines['transactionId'].dropna().unique().tolist()
+    if not ids:
+        return lines
+    names = [os.path.basename(path) for path in files]
+    with _index_connection() as conn:
+        indexed = {row[0] for row in conn.execute("SELECT file FROM indexed_files")}
+    for path, name in zip(files, names):
+        if name not in indexed:
+            _index_file(path)
+    with span('dedup', rows=len(ids)), _index_connection() as conn:
+        conn.execute("CREATE TEMP TABLE new_ids (transaction_id TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.executemany("INSERT OR IGNORE INTO new_ids VALUES (?)", ((i,) for i in ids))
+        seen = {row[0] for row in conn.execute(
+            f"SELECT DISTINCT t.transaction_id FROM new_ids n JOIN transactions t "
+            f"ON t.transaction_id = n.transaction_id WHERE t.file IN ({','.join('?' * len(names))})",
+            names,
+        )}
+    if not seen:
+        return lines
+    return lines[~lines['transactionId'].isin(seen).to_numpy()]
+
+
+def _index_file(path: str) -> None:
+    """Add a stored file's transaction IDs to the index"""
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all().select(['transactionId'])
+    _index_transactions(path, table.to_pandas())
+
+
+def _index_transactions(path: str, lines: pd.DataFrame) -> None:
+    """Record the transaction IDs of lines as stored in the file at path"""
+    name = os.path.basename(path)
+    ids = lines['transactionId'].dropna().unique().tolist() if 'transactionId' in lines.columns else []
+    with _index_connection() as conn:
+        conn.executemany("INSERT OR IGNORE INTO transactions VALUES (?, ?)", ((i, name) for i in ids))
+        conn.execute("INSERT OR IGNORE INTO indexed_files VALUES (?)", (name,))
+
+
+@contextmanager
+def _index_connection() -> Iterator[sqlite3.Connection]:
+    """Connection to the transaction index, committed on success"""
+    os.makedirs(os.path.dirname(TRANSACTION_INDEX) or '.', exist_ok=True)
+    with closing(sqlite3.connect(TRANSACTION_INDEX, timeout=TRANSACTION_INDEX_TIMEOUT)) as conn, conn:
+        # WAL lets appends in other processes read while one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS transactions "
+                     "(transaction_id TEXT, file TEXT, PRIMARY KEY (transaction_id, file)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS indexed_files (file TEXT PRIMARY KEY)")
+        yield conn
+
+
+def _save_state(dataset_id: str, state: RunningAnalysis) -> None:
+    tmp_path = f"{_state_path(dataset_id)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _state_path(dataset_id))
+
+
+@contextmanager
+def _dataset_lock(dataset_id: str) -> Iterator[None]:
+    """Exclusive lock across worker processes while a dataset is written"""
+    with open(_data_path(dataset_id)[:-len('.arrow')] + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_metadata(dataset_id: str, metadata: Dict[str, Any]) -> None:
+    tmp_path = f"{_metadata_path(dataset_id)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, _metadata_path(dataset_id))
+
+
+def _data_path(dataset_id: str) -> str:
+    # IDs are checked before they become part of a path
+    if not _DATASET_ID.match(dataset_id):
+        raise DatasetNotFound(dataset_id)
+    return os.path.join(DATASET_DIR, f"{dataset_id}.arrow")
+
+
+def _metadata_path(dataset_id: str) -> str:
+    return _data_path(dataset_id)[:-len('.arrow')] + '.json'
+
+
+def _state_path(dataset_id: str) -> str:
+    return _data_path(dataset_id)[:-len('.arrow')] + '.state.pkl'
@@ -0,0 +1,272 @@
+import os
+import queue
+import asyncio
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+from services import metrics
+from services.log import configure_logging
+
+# Seconds clients are told to wait when a pool is saturated
+RETRY_AFTER_SECONDS = int(os.getenv("EXECUTOR_RETRY_AFTER", 5))
+
+
+class ExecutorBusy(HTTPException):
+    """Raised when a pool already has its maximum number of pending tasks"""
+
+    def __init__(self, pool_name: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Server is busy ({pool_name} pool saturated). Please retry shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
+
+class WorkPool:
+    """
+    Bounded wrapper around a concurrent.futures executor
+
+    At most max_pending tasks may be running or queued at once; past that,
+    run() raises ExecutorBusy instead of queueing more work. The executor
+    is created on first use. Pending counts are only touched from the event
+    loop thread, so no lock is needed.
+
+    A task that has started can't be stopped: when the caller is cancelled
+    run() waits for it to end before raising CancelledError, so the caller
+    never cleans up (e.g. deletes) what the task is still using, and the
+    task keeps counting as pending while it runs.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Executor], max_pending: int):
+        self.name = name
+        self.max_pending = max_pending
+        self.pending = 0
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) in the pool and await its result"""
+        if self.pending >= self.max_pending:
+            raise ExecutorBusy(self.name)
+        if self._executor is None:
+            self._executor = self._factory()
+
+        self.pending += 1
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # Queued tasks are dropped; a started one is waited for
+                if not future.cancel():
+                    await asyncio.gather(asyncio.wrap_future(future), return_exceptions=True)
+                raise
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {'pending': self.pending, 'maxPending': self.max_pending}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class _RemoteHTTPException(Exception):
+    """
+    Picklable carrier for an HTTPException raised in a worker process
+
+    HTTPException keeps its fields as attributes rather than args, so it
+    cannot be unpickled in the parent; this passes them as args instead.
+    """
+
+    def __init__(self, status_code: int, detail: Any, headers: Optional[dict]):
+        super().__init__(status_code, detail, headers)
+
+
+def _call_in_worker(profile: bool, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run fn in a worker, converting HTTPException to a picklable form
+
+    Returns fn's result with the stage spans (and profile, if asked for)
+    recorded while it ran; see metrics.collect.
+    """
+    try:
+        return metrics.collect(profile, fn, *args, **kwargs)
+    except HTTPException as e:
+        raise _RemoteHTTPException(e.status_code, e.detail, e.headers)
+
+
+async def _run_instrumented(pool: WorkPool, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn in a pool and record its spans in this process"""
+    try:
+        result, spans, profile = await pool.run(_call_in_worker, metrics.profiling_requested(), fn, *args, **kwargs)
+    except _RemoteHTTPException as e:
+        raise HTTPException(status_code=e.args[0], detail=e.args[1], headers=e.args[2])
+    metrics.finish_worker_call(spans, profile)
+    return result
+
+
+class TaskCancelled(Exception):
+    """Raised by TaskControl.check in a task whose caller was cancelled"""
+
+
+class TaskControl:
+    """
+    Channel a CPU pool task reports progress through, and is cancelled by
+
+    run_cpu_reporting passes one to the task as its control argument; each
+    report(event, data) the task makes reaches the caller's on_report on
+    the event loop. If the caller is cancelled, check() raises
+    TaskCancelled in the task, which should call it between steps. When
+    the CPU pool runs processes it is backed by a multiprocessing manager
+    queue and event, so it can be pickled to a worker.
+    """
+
+    def __init__(self, reports, cancelled):
+        self._reports = reports
+        self._cancelled = cancelled
+
+    def report(self, event: str, data: dict) -> None:
+        self._reports.put((event, data))
+
+    def check(self) -> None:
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+
+def _forward_reports(reports, loop: asyncio.AbstractEventLoop, on_report: Callable[[str, dict], None],
+                     done: asyncio.Future) -> None:
+    """Pass reports to on_report on the loop until the None sentinel, then resolve done"""
+    while True:
+        message = reports.get()
+        if message is None:
+            break
+        loop.call_soon_threadsafe(on_report, *message)
+    loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+
+def _cpu_factory() -> Executor:
+    """Process pool by default; CPU_EXECUTOR=thread keeps work in-process"""
+    if CPU_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+    # Each worker process logs through its own queue and writer thread
+    return ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=_process_context(), initializer=configure_logging)
+
+
+def _process_context():
+    """
+    Context that starts worker (and report manager) processes
+
+    They are forked from a single-threaded fork server, never from the
+    server process: forked while one of its threads holds a lock (e.g.
+    mid-import during warm-up), a process would wait on it forever.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(CPU_PRELOAD)
+    return context
+
+
+# Executor configuration, read from the environment
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "process")
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", os.cpu_count() or 1))
+IO_WORKERS = int(os.getenv("IO_WORKERS", 16))
+
+# Modules the fork server imports once, so each worker starts with them:
+# the services whose functions the routers hand to the pool (and what
+# they import: pandas, numpy, pyarrow), Excel reading and PDF reports
+CPU_PRELOAD = ['services.ingest', 'services.dataset_store', 'services.timeseries',
+               'openpyxl', 'services.report']
+
+# CPU-bound work: file reads, parsing, analysis and PDF rendering
+cpu_pool = WorkPool(
+    "cpu",
+    _cpu_factory,
+    max_pending=int(os.getenv("CPU_MAX_PENDING", CPU_WORKERS * 4)),
+)
+
+# Blocking I/O: upload hashing, spooling and metadata writes
+io_pool = WorkPool(
+    "io",
+    lambda: ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io"),
+    max_pending=int(os.getenv("IO_MAX_PENDING", IO_WORKERS * 4)),
+)
+
+# Serves the queues and events of TaskControl when the CPU pool runs processes
+_manager = None
+
+
+# Tasks running or queued in each pool, reported by /metrics
+metrics.registry.gauge(
+    "executor_pending_tasks", "Tasks running or queued in each worker pool",
+    lambda: {(pool.name,): pool.pending for pool in (cpu_pool, io_pool)}, ["pool"],
+)
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run CPU-bound work off the event loop (fn and args must be picklable)"""
+    return await _run_instrumented(cpu_pool, fn, *args, **kwargs)
+
+
+def report_manager():
+    """The multiprocessing manager behind TaskControl, started on first use"""
+    global _manager
+    if _manager is None:
+        _manager = _process_context().Manager()
+    return _manager
+
+
+async def run_cpu_reporting(fn: Callable[..., Any], on_report: Callable[[str, dict], None],
+                            *args: Any, **kwargs: Any) -> Any:
+    """
+    run_cpu with a TaskControl passed to fn as control=
+
+    on_report(event, data) is called on the event loop for each report,
+    in order, and all of them are delivered before this returns. When
+    cancelled, fn is told to stop (its next control.check() raises) and
+    waited for.
+    """
+    if CPU_EXECUTOR == "thread":
+        reports, cancelled = queue.Queue(), threading.Event()
+    else:
+        manager = report_manager()
+        reports, cancelled = manager.Queue(), manager.Event()
+    control = TaskControl(reports, cancelled)
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    threading.Thread(target=_forward_reports, args=(reports, loop, on_report, done),
+                     name="reports", daemon=True).start()
+    task = asyncio.ensure_future(run_cpu(fn, *args, control=control, **kwargs))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        control.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    finally:
+        reports.put(None)
+        await done
+
+
+async def run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run blocking I/O off the event loop"""
+    return await _run_instrumented(io_pool, fn, *args, **kwargs)
+
+
+def shutdown_pools() -> None:
+    """Stop both pools and the report manager (called on application shutdown)"""
+    global _manager
+    cpu_pool.shutdown()
+    io_pool.shutdown()
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
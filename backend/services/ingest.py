@@ -0,0 +1,211 @@
+import io
+import logging
+import functools
+from typing import List, Optional
+
+import pandas as pd
+from fastapi import HTTPException
+
+from services.analyzer import analyze_frame, RunningAnalysis, SketchAnalysis
+from services.cache import hash_upload
+from services.dataset_store import DatasetWriter, save_dataset, append_lines, dataset_id_for
+from services.executor import TaskCancelled, TaskControl
+from services.log import RowIssues
+from services.metrics import span
+from services.parser import parse_columns, resolve_schema
+from services.readers import UnsupportedFormat, csv_dtypes, read_upload
+
+logger = logging.getLogger(__name__)
+
+# Rows per chunk when streaming a CSV upload
+CSV_CHUNK_ROWS = 100_000
+
+# Rows in the first chunk of a progress upload, so the schema event is quick
+FIRST_CHUNK_ROWS = 10_000
+
+
+def analyze_store(contents: bytes, filename: str, approximate: bool = False) -> tuple:
+    """
+    Parse, store and analyze one file of a batch
+
+    Returns the dataset ID, the analysis and (when approximate) the
+    SketchAnalysis for the rollup. Exact analyses list every high-risk
+    product for the rollup instead.
+    """
+    dataset_id = dataset_id_for(hash_upload(io.BytesIO(contents)))
+    lines = read_lines(contents, filename)
+    save_dataset(dataset_id, lines, filename)
+    if approximate:
+        sketch = SketchAnalysis()
+        sketch.add(lines)
+        return dataset_id, sketch.result(), sketch
+    return dataset_id, analyze_frame(lines, high_risk_limit=None), None
+
+
+def analyze_batch(contents: bytes, filename: str, dataset_id: str, approximate: bool = False,
+                  control: Optional[TaskControl] = None) -> dict:
+    """
+    Read the whole upload into a DataFrame, then parse, store and analyze it
+
+    With control, the detected columns are reported as a schema event.
+    """
+    lines = read_lines(contents, filename, control)
+
+    with span('store', rows=len(lines)):
+        save_dataset(dataset_id, lines, filename)
+
+    # Perform analysis
+    try:
+        with span('analyze', rows=len(lines)):
+            if approximate:
+                sketch = SketchAnalysis()
+                sketch.add(lines)
+                analysis = sketch.result()
+            else:
+                analysis = analyze_frame(lines)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analyzing data: {str(e)}")
+
+    return analysis
+
+
+def append_batch(contents: bytes, filename: str, dataset_id: str) -> tuple:
+    """Parse an upload and append it to a stored dataset; returns (combined dataset ID, analysis)"""
+    cache_key = hash_upload(io.BytesIO(contents))
+    return append_lines(dataset_id, read_lines(contents, filename), cache_key, filename)
+
+
+def read_lines(contents: bytes, filename: str, control: Optional[TaskControl] = None):
+    """Read and parse an uploaded file into parse_columns lines"""
+    # Read file into pandas; the format comes from the file's first bytes,
+    # with the extension as a fallback
+    on_header = functools.partial(_report_schema, control) if control is not None else None
+    try:
+        with span('read', bytes=len(contents)) as current:
+            df = read_upload(contents, filename, on_header)
+            current.rows = len(df)
+    except UnsupportedFormat as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Error reading file: {str(e)}. Please check file format."
+        )
+
+    # Check if dataframe is empty
+    if df.empty:
+        raise HTTPException(status_code=400, detail="File is empty or contains no data")
+
+    # Parse and validate data (skipped rows are logged as one summary)
+    issues = RowIssues()
+    try:
+        with span('parse', rows=len(df)):
+            lines = parse_columns(df, issues=issues)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Data validation error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error parsing data: {str(e)}")
+    issues.log(logger, filename)
+
+    return lines
+
+
+def _report_schema(control: TaskControl, columns: List[str]) -> None:
+    """Report the columns detected in a header (nothing if none match; parsing reports that)"""
+    try:
+        schema = resolve_schema(tuple(columns))
+    except ValueError:
+        return
+    control.report('schema', {'columns': schema.as_dict()})
+
+
+def analyze_csv_path(path: str, dataset_id: str, filename: str, approximate: bool = False,
+                     control: Optional[TaskControl] = None) -> dict:
+    """Streaming analysis of a CSV file on disk"""
+    writer = DatasetWriter(dataset_id, filename)
+    try:
+        with open(path, 'rb') as file_obj:
+            analysis = analyze_csv_stream(file_obj, writer, control, filename, approximate)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    return analysis
+
+
+def analyze_csv_stream(file_obj, writer: DatasetWriter = None, control: Optional[TaskControl] = None,
+                       filename: str = None, approximate: bool = False) -> dict:
+    """
+    Parse and analyze a CSV upload one chunk at a time
+
+    Each chunk is parsed and folded into running aggregates (and appended
+    to writer, if given), so the full file is never held in memory. The
+    result matches the batch path.
+
+    With control, the detected columns are reported as a schema event
+    after the first chunk and the rows and bytes read so far, with the
+    analysis so far, as a progress event after each; the first chunk is
+    then kept small so the first events come quickly. control is checked
+    before each chunk, so a cancelled upload stops there.
+
+    Rows skipped in any chunk are logged once, as a summary for the whole
+    file. With approximate=True the chunks are folded into a
+    SketchAnalysis, so memory stays fixed even as distinct products grow.
+    """
+    running = SketchAnalysis() if approximate else RunningAnalysis()
+    issues = RowIssues()
+    rows_read = 0
+    schema = None
+    try:
+        # ID columns are read as text, as in the batch path (see csv_dtypes)
+        dtypes = csv_dtypes(pd.read_csv(file_obj, nrows=0).columns)
+        file_obj.seek(0)
+        reader = pd.read_csv(file_obj, chunksize=CSV_CHUNK_ROWS, dtype=dtypes)
+        size = FIRST_CHUNK_ROWS if control is not None else CSV_CHUNK_ROWS
+        while True:
+            if control is not None:
+                control.check()
+            position = file_obj.tell()
+            try:
+                with span('read') as current:
+                    chunk = reader.get_chunk(size)
+                    current.rows = len(chunk)
+                    current.bytes = file_obj.tell() - position
+            except StopIteration:
+                break
+            size = CSV_CHUNK_ROWS
+            rows_read += len(chunk)
+            try:
+                # Detect the columns on the first chunk and pin them for the rest
+                if schema is None:
+                    schema = resolve_schema(tuple(chunk.columns))
+                with span('parse', rows=len(chunk)):
+                    lines = parse_columns(chunk, schema, issues)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Data validation error: {str(e)}")
+            with span('analyze', rows=len(lines)):
+                running.add(lines)
+            if writer is not None:
+                with span('store', rows=len(lines)):
+                    writer.write(lines)
+            if control is not None:
+                if rows_read == len(chunk):
+                    control.report('schema', {'columns': schema.as_dict()})
+                control.report('progress', {
+                    'rows': rows_read,
+                    'bytesRead': file_obj.tell(),
+                    'analysis': running.result(),
+                })
+    except (HTTPException, TaskCancelled):
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Error reading file: {str(e)}. Please check file format."
+        )
+
+    if rows_read == 0:
+        raise HTTPException(status_code=400, detail="File is empty or contains no data")
+    issues.log(logger, filename)
+
+    return running.result()
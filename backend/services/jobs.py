@@ -0,0 +1,170 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from services.executor import CPU_WORKERS, RETRY_AFTER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Jobs allowed to run at once; the rest wait in the queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", CPU_WORKERS))
+
+# Jobs allowed to wait; past this, new jobs are refused with a 503
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", 100))
+
+# Seconds a finished job (and its result) is kept
+JOB_TTL = float(os.getenv("JOB_TTL", 3600))
+
+# Job states; the last three are final
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobQueueFull(HTTPException):
+    """Raised when JOB_MAX_QUEUED jobs are already waiting"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Server is busy (job queue full). Please retry shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
+
+class Job:
+    """
+    One background job and what clients can see of it
+
+    The work function may update stage, progress (0-1) and result while it
+    runs.
+    """
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.progress: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'jobId': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    In-process job queue
+
+    Each job is an asyncio task, and at most `workers` of them run at
+    once. The heavy steps inside a job still go through the CPU and I/O
+    pools, so the job limit keeps bursts queued here instead of being
+    refused by a saturated pool. Finished jobs are dropped `ttl` seconds
+    after they end.
+    """
+
+    def __init__(self, workers: int, max_queued: int, ttl: float):
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._slots = asyncio.Semaphore(workers)
+        self._jobs: Dict[str, Job] = {}
+        self.workers = workers
+
+    def submit(self, kind: str, work: Callable[[Job], Awaitable[Dict[str, Any]]],
+               cleanup: Optional[Callable[[], None]] = None) -> Job:
+        """
+        Queue work(job) and return the job right away
+
+        cleanup() is called once the job ends, whether it ran, failed or
+        was cancelled, and only after its work has stopped.
+        """
+        self._expire()
+        if sum(job.status == QUEUED for job in self._jobs.values()) >= self.max_queued:
+            if cleanup is not None:
+                cleanup()
+            raise JobQueueFull()
+
+        job = Job(kind)
+        self._jobs[job.id] = job
+        job._task = asyncio.ensure_future(self._run(job, work, cleanup))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a queued or running job (finished jobs are left as they are)
+
+        A queued job never starts. A running one stops at its next check:
+        a CSV upload between chunks, other steps once the current one is
+        done. Its cleanup runs after that, not right away.
+        """
+        job = self.get(job_id)
+        if job is not None and job.status not in FINISHED:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            job._task.cancel()
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {**counts, 'workers': self.workers, 'maxQueued': self.max_queued}
+
+    async def _run(self, job: Job, work: Callable[[Job], Awaitable[Dict[str, Any]]],
+                   cleanup: Optional[Callable[[], None]]) -> None:
+        try:
+            async with self._slots:
+                job.status = RUNNING
+                job.started_at = time.time()
+                result = await work(job)
+                job.result = result
+                job.status = DONE
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except HTTPException as e:
+            job.status = FAILED
+            job.error = {'status': e.status_code, 'detail': e.detail}
+        except Exception as e:
+            logger.exception("job failed", extra={'jobId': job.id})
+            job.status = FAILED
+            job.error = {'status': 500, 'detail': str(e)}
+        finally:
+            job.finished_at = job.finished_at or time.time()
+            if cleanup is not None:
+                cleanup()
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in FINISHED and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# Shared job queue used by the API routes
+job_manager = JobManager(JOB_WORKERS, JOB_MAX_QUEUED, JOB_TTL)
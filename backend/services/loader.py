@@ -0,0 +1,135 @@
+import logging
+import pandas as pd
+from typing import BinaryIO, Callable, List, Optional
+
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Transaction-sheet fields joined onto the lines when requested
+TRANSACTION_FIELDS = ['date', 'customer', 'location', 'amount']
+
+
+def load_excel(file_obj: BinaryIO, join_transactions: bool = False,
+               on_header: Optional[Callable[[List[str]], None]] = None) -> pd.DataFrame:
+    """
+    Load the product sheet of an Excel workbook
+
+    The workbook is opened once in openpyxl read-only mode. Only the
+    header row of each sheet is read to pick the product sheet, and then
+    just that sheet is parsed, so the cost scales with the chosen sheet
+    rather than the whole workbook.
+
+    With join_transactions=True, the transactions sheet (if there is one)
+    is read in the same session and its date, customer, location and
+    amount columns are left-joined onto the lines by transaction ID.
+
+    on_header(columns), when given, is called with the columns the result
+    will have once the header rows are read, before the sheet is parsed.
+    """
+    # Imported here so only processes that read Excel files pay for it
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_obj, read_only=True, data_only=True, keep_links=False)
+    with pd.ExcelFile(workbook, engine='openpyxl') as excel_file:
+        with span('excel_scan'):
+            headers = {ws.title: _header_row(ws) for ws in workbook.worksheets}
+        logger.debug("excel sheets found", extra={'sheets': list(headers)})
+
+        # Look for sheet with product data (has Product ID or Product Description)
+        product_sheet = next((name for name, cols in headers.items() if _is_product_sheet(cols)), None)
+        if product_sheet is None:
+            # If no product sheet found, use first sheet
+            product_sheet = workbook.sheetnames[0]
+            logger.warning("no product sheet found, using the first sheet",
+                           extra={'sheet': product_sheet, 'columns': headers[product_sheet]})
+        else:
+            logger.debug("using product sheet", extra={'sheet': product_sheet})
+
+        txn_sheet = None
+        if join_transactions:
+            txn_sheet = next(
+                (name for name, cols in headers.items()
+                 if name != product_sheet and _transaction_columns(cols) is not None),
+                None
+            )
+        if on_header is not None:
+            columns = headers[product_sheet]
+            if txn_sheet is not None and _line_transaction_column(columns) is not None:
+                columns = columns + [f.title() for f in _joined_fields(columns, _transaction_columns(headers[txn_sheet]))]
+            on_header(columns)
+
+        with span('excel_sheet') as current:
+            df = excel_file.parse(product_sheet)
+            current.rows = len(df)
+
+        if txn_sheet is not None:
+            with span('excel_join', rows=len(df)):
+                df = _join_transactions(df, excel_file.parse(txn_sheet))
+
+    return df
+
+
+def _header_row(worksheet) -> List[str]:
+    """Column names of a read-only worksheet, from its first row only"""
+    first = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+    return [f"Unnamed: {i}" if value is None else str(value) for i, value in enumerate(first)]
+
+
+def _is_product_sheet(columns: List[str]) -> bool:
+    """Check if a sheet has product-related columns"""
+    columns_lower = [col.lower() for col in columns]
+    has_product_id = any('product' in col and 'id' in col for col in columns_lower)
+    has_category = any('category' in col and 'transaction' not in col for col in columns_lower)
+    has_product_desc = any('product' in col and 'description' in col for col in columns_lower)
+    return has_product_id or (has_category and has_product_desc)
+
+
+def _transaction_columns(columns: List[str]) -> Optional[dict]:
+    """
+    Map transaction ID and TRANSACTION_FIELDS to column names, or None
+
+    A sheet counts as the transactions sheet when it has a transaction ID
+    column and at least one of the other fields.
+    """
+    mapping = {}
+    for col in columns:
+        norm = col.strip().lower().replace(' ', '_').replace('-', '_')
+        if norm in ('transaction_id', 'transactionid', 'txn_id', 'id'):
+            mapping.setdefault('transactionId', col)
+        elif norm in TRANSACTION_FIELDS:
+            mapping.setdefault(norm, col)
+    if 'transactionId' not in mapping or len(mapping) < 2:
+        return None
+    return mapping
+
+
+def _join_transactions(lines: pd.DataFrame, transactions: pd.DataFrame) -> pd.DataFrame:
+    """Left-join transaction fields onto the lines by transaction ID"""
+    txn_columns = _transaction_columns([str(c) for c in transactions.columns])
+    line_txn_col = _line_transaction_column(lines.columns)
+    if txn_columns is None or line_txn_col is None:
+        return lines
+
+    # Joined columns get Title-case names and go last, after the line columns
+    fields = _joined_fields(lines.columns, txn_columns)
+    right = transactions[[txn_columns['transactionId']] + [txn_columns[f] for f in fields]]
+    right.columns = ['__txn_key'] + [f.title() for f in fields]
+    right = right.drop_duplicates('__txn_key')
+
+    joined = lines.merge(right, how='left', left_on=line_txn_col, right_on='__txn_key', sort=False)
+    joined.index = lines.index
+    return joined.drop(columns='__txn_key')
+
+
+def _line_transaction_column(columns) -> Optional[str]:
+    """The lines' transaction ID column, the key of the join"""
+    return next(
+        (col for col in columns if str(col).strip().lower().replace(' ', '_') in ('transaction_id', 'transactionid', 'transaction')),
+        None
+    )
+
+
+def _joined_fields(line_columns, txn_columns: dict) -> List[str]:
+    """TRANSACTION_FIELDS the join adds (those the lines don't already have)"""
+    return [f for f in TRANSACTION_FIELDS if f in txn_columns and f.title() not in line_columns]
@@ -0,0 +1,205 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Any, Dict, List, Optional
+
+from services import metrics
+
+# Logging configuration, read from the environment
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")               # text | json
+# Records waiting for the writer thread; past this, new records are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+# Example rows listed per reason in a row issue summary
+LOG_ROW_EXAMPLES = int(os.getenv("LOG_ROW_EXAMPLES", 5))
+
+# Attributes every LogRecord has; anything else came from extra= and is a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Process the current configuration belongs to (a forked worker must redo it)
+_configured_pid: Optional[int] = None
+_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One line per record, as text or JSON
+
+    Fields passed with extra= are kept as structured data:
+
+        logger.warning("rows skipped", extra={'file': name, 'skipped': 12})
+
+    gives 'rows skipped file=data.csv skipped=12' as text, or a JSON
+    object with file and skipped keys.
+    """
+
+    def __init__(self, json_output: bool = False):
+        super().__init__()
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if self.json_output:
+            entry = {
+                'time': _timestamp(record.created),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': message,
+                'process': record.process,
+                **fields,
+            }
+            if record.exc_text:
+                entry['exception'] = record.exc_text
+            return json.dumps(entry, default=str)
+        line = f"{_timestamp(record.created)} {record.levelname:<7} {record.name}: {message}"
+        if fields:
+            line += " " + " ".join(f"{key}={_text_value(value)}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the args in and render the traceback now (they may not
+        # survive until the writer thread), but keep the fields separate
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level: str = None, format: str = None) -> None:
+    """
+    Send all logging through a queue to a writer thread on stderr
+
+    Callers only pay for formatting the record and a put on the queue;
+    the stream write happens on the listener thread, so slow consoles or
+    log collectors never stall a request. When the queue is full, records
+    are dropped (and counted) rather than waiting. Level and format
+    default to LOG_LEVEL and LOG_FORMAT.
+
+    Safe to call more than once; each process (e.g. a pool worker)
+    configures its own queue and writer thread.
+    """
+    global _configured_pid, _handler, _listener
+    if _configured_pid == os.getpid():
+        return
+    root = logging.getLogger()
+    if _handler is not None:
+        # Inherited from the parent by fork; its writer thread does not exist here
+        root.removeHandler(_handler)
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(json_output=(format or LOG_FORMAT).lower() == "json"))
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = _DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    root.addHandler(_handler)
+    root.setLevel(level or LOG_LEVEL)
+    _configured_pid = os.getpid()
+    atexit.register(_stop_listener, _listener)
+
+
+def dropped_records() -> int:
+    """Records dropped in this process because the log queue was full"""
+    return _handler.dropped if _handler is not None else 0
+
+
+# Reported by /metrics (server process only; workers log through their own queues)
+metrics.registry.gauge(
+    "log_records_dropped", "Log records dropped because the log queue was full",
+    lambda: {(): dropped_records()},
+)
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    """Write out what is still queued (runs at interpreter exit)"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+class RowIssues:
+    """
+    Per-row problems found while reading a file, logged as one summary
+
+    Rows are added in bulk by reason; only a count and the first few row
+    numbers are kept per reason, so memory and log volume stay fixed no
+    matter how dirty the file is.
+
+        issues = RowIssues()
+        issues.add('missing category', rows)
+        issues.log(logger, 'data.csv')
+    """
+
+    def __init__(self, max_examples: int = LOG_ROW_EXAMPLES):
+        self.max_examples = max_examples
+        self.counts: Dict[str, int] = {}
+        self.examples: Dict[str, List[Any]] = {}
+
+    def add(self, reason: str, rows: Any) -> None:
+        """Record the row numbers (any sequence, e.g. a pandas index) that hit reason"""
+        count = len(rows)
+        if not count:
+            return
+        self.counts[reason] = self.counts.get(reason, 0) + count
+        examples = self.examples.setdefault(reason, [])
+        if len(examples) < self.max_examples:
+            examples.extend(_plain(row) for row in list(rows[:self.max_examples - len(examples)]))
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def log(self, logger: logging.Logger, source: Optional[str] = None, level: int = logging.WARNING) -> None:
+        """Log one summary record, if there were any issues"""
+        if not self.counts:
+            return
+        fields = {'skippedRows': dict(self.counts), 'exampleRows': dict(self.examples)}
+        if source is not None:
+            fields = {'source': source, **fields}
+        logger.log(level, "skipped %d rows", self.total, extra=fields)
+
+
+def _plain(value: Any) -> Any:
+    """numpy scalars as Python values, so they format and serialize cleanly"""
+    # A numpy scalar can only exist once numpy is loaded, so this doesn't import it
+    numpy = sys.modules.get('numpy')
+    return value.item() if numpy is not None and isinstance(value, numpy.generic) else value
+
+
+def _timestamp(created: float) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(created)) + f".{int(created % 1 * 1000):03d}"
+
+
+def _text_value(value: Any) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    text = str(value)
+    return json.dumps(text) if not text or ' ' in text else text
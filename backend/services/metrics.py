@@ -0,0 +1,319 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse, Response
+from starlette.routing import Match
+
+# Bucket upper bounds (seconds) for the duration histograms
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Opt-in: with PROFILING_ENABLED=1, a request sent with "X-Profile: 1"
+# gets a cProfile report instead of its normal response body
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_HEADER = "x-profile"
+
+# Functions listed per profile in a profiling report
+PROFILE_TOP_FUNCTIONS = 40
+
+
+class Counter:
+    """Prometheus-style counter with labels"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Prometheus-style histogram with labels and fixed buckets"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                    labels = _format_labels(self.labels + ('le',), key + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+                lines.append(f"{self.name}_count{labels} {counts[-2]}")
+        return lines
+
+
+class Registry:
+    """The metrics shown by /metrics, plus gauges computed when scraped"""
+
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.gauges: List[Tuple[str, str, Callable[[], Dict[Tuple, float]], Tuple[str, ...]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, read: Callable[[], Dict[Tuple, float]], labels: Sequence[str] = ()) -> None:
+        """A gauge whose values read() returns (label values -> value) on each scrape"""
+        self.gauges.append((name, help, read, tuple(labels)))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, help, read, labels in self.gauges:
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge"])
+            for key, value in sorted(read().items()):
+                lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Metrics for this process (each server worker process has its own)
+registry = Registry()
+stage_seconds = registry.histogram(
+    "pipeline_stage_seconds", "Time spent in each upload pipeline stage", ["stage"])
+stage_rows = registry.counter(
+    "pipeline_stage_rows_total", "Rows handled by each upload pipeline stage", ["stage"])
+stage_bytes = registry.counter(
+    "pipeline_stage_bytes_total", "Bytes handled by each upload pipeline stage", ["stage"])
+request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time until response headers were sent", ["method", "route"])
+requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+
+
+@dataclass
+class Span:
+    """One timed pipeline stage; rows and bytes may be filled in while it runs"""
+    stage: str
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+
+
+# Spans of the current worker call, sent back to the server process
+_collector: ContextVar[Optional[List[Span]]] = ContextVar("metrics_collector", default=None)
+# Spans and profiles of the current HTTP request
+_request_spans: ContextVar[Optional[List[Span]]] = ContextVar("metrics_request_spans", default=None)
+_request_profiles: ContextVar[Optional[List[str]]] = ContextVar("metrics_request_profiles", default=None)
+
+
+@contextmanager
+def span(stage: str, rows: Optional[int] = None, bytes: Optional[int] = None) -> Iterator[Span]:
+    """
+    Time a block as one pipeline stage
+
+        with span('parse', bytes=len(contents)) as s:
+            lines = parse_columns(df)
+            s.rows = len(lines)
+
+    Spans are recorded even when the block raises.
+    """
+    current = Span(stage, rows=rows, bytes=bytes)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        record(current)
+
+
+def record(current: Span) -> None:
+    """Record a finished span (or queue it, inside a worker call)"""
+    collector = _collector.get()
+    if collector is not None:
+        collector.append(current)
+        return
+    stage_seconds.observe(current.seconds, stage=current.stage)
+    if current.rows is not None:
+        stage_rows.inc(current.rows, stage=current.stage)
+    if current.bytes is not None:
+        stage_bytes.inc(current.bytes, stage=current.stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append(current)
+
+
+def collect(profile: bool, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, List[Span], Optional[str]]:
+    """
+    Run fn in a pool worker, capturing its spans (and a profile if asked)
+
+    Returns (result, spans, profile report). The caller passes the spans
+    and profile to finish_worker_call in the server process, since a
+    worker process has its own registry and no request context.
+    """
+    spans: List[Span] = []
+    token = _collector.set(spans)
+    profiler = cProfile.Profile() if profile else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        _collector.reset(token)
+    report = _format_profile(profiler, f"worker: {getattr(fn, '__name__', fn)}") if profiler is not None else None
+    return result, spans, report
+
+
+def finish_worker_call(spans: List[Span], profile: Optional[str]) -> None:
+    """Record the spans and profile a worker call sent back"""
+    for current in spans:
+        record(current)
+    profiles = _request_profiles.get()
+    if profile is not None and profiles is not None:
+        profiles.append(profile)
+
+
+def profiling_requested() -> bool:
+    """Whether the current request asked for a profile"""
+    return _request_profiles.get() is not None
+
+
+async def instrument_request(request: Request, call_next: Callable) -> Response:
+    """
+    HTTP middleware: request metrics, a Server-Timing header and profiling
+
+    Every response gets a Server-Timing header with the total time of each
+    pipeline stage the request went through. With PROFILING_ENABLED and an
+    "X-Profile: 1" header, the response body is replaced by cProfile
+    reports of the event loop thread (which includes concurrent requests)
+    and of each worker call; the original status is in X-Profile-Status.
+    """
+    spans_token = _request_spans.set([])
+    profiles: Optional[List[str]] = None
+    if PROFILING_ENABLED and request.headers.get(PROFILE_HEADER, "") not in ("", "0"):
+        profiles = []
+    profiles_token = _request_profiles.set(profiles)
+    profiler = cProfile.Profile() if profiles is not None else None
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            response = await call_next(request)
+            if profiler is not None:
+                # Streamed bodies are produced here, so read them while profiling
+                body = b"".join([chunk async for chunk in response.body_iterator])
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        elapsed = time.perf_counter() - start
+        spans = _request_spans.get()
+    finally:
+        _request_spans.reset(spans_token)
+        _request_profiles.reset(profiles_token)
+
+    route = _route_path(request)
+    request_seconds.observe(elapsed, method=request.method, route=route)
+    requests_total.inc(method=request.method, route=route, status=response.status_code)
+
+    if profiler is not None:
+        report = "\n\n".join([
+            f"{request.method} {request.url.path} -> {response.status_code} in {elapsed * 1000:.1f}ms "
+            f"({len(body)} bytes)",
+            _format_profile(profiler, "event loop"),
+        ] + profiles)
+        response = PlainTextResponse(report, headers={"X-Profile-Status": str(response.status_code)})
+    if spans:
+        response.headers["Server-Timing"] = server_timing(spans)
+    return response
+
+
+def server_timing(spans: List[Span]) -> str:
+    """Server-Timing header value: total milliseconds per stage, in first-seen order"""
+    totals: Dict[str, float] = {}
+    for current in spans:
+        totals[current.stage] = totals.get(current.stage, 0.0) + current.seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def _route_path(request: Request) -> str:
+    """Route template of a request (e.g. /api/jobs/{job_id}), to keep label values few"""
+    route = next((r for r in request.app.router.routes if r.matches(request.scope)[0] == Match.FULL), None)
+    if route is None:
+        # Newer FastAPI versions nest included routers, but leave the
+        # matched route (with its path relative to the router) in the scope
+        route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _format_profile(profiler: cProfile.Profile, title: str) -> str:
+    out = io.StringIO()
+    out.write(f"== {title} ==\n")
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+def _label_key(names: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple:
+    return tuple(str(labels.get(name, "")) for name in names)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
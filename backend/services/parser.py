@@ -1,122 +1,333 @@
+import re
+import logging
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Any
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+
+from services.compact import CompactLines, EncodedColumn
+from services.log import RowIssues
+
+logger = logging.getLogger(__name__)
+
+# Bump when parsing output changes, so cached results are not reused
+PARSER_VERSION = 3
+
+# Columns produced by parse_columns, in the same order as the product dicts
+PRODUCT_FIELDS = ['productId', 'description', 'category', 'subcategory', 'hasZeroWaste']
+
+# Map common column name variations (using normalized names).
+# A column matches a field when it contains any variation or the field name.
+COLUMN_MAPPING = {
+    'productid': ['product_id', 'productid', 'id', 'product'],
+    'product_description': ['product_description', 'description', 'product_desc', 'name'],
+    'category': ['category', 'cat', 'product_category'],
+    'subcategory': ['subcategory', 'sub_category', 'sub_cat'],
+    'zero_waste': ['zero_waste', 'zerowaste', 'zero_waste_flag', 'package_free', 'waste_free'],
+    'transaction_id': ['transaction_id', 'transactionid', 'transaction', 'txn_id', 'txn'],
+    # Transaction-level fields (e.g. joined from a Transactions sheet)
+    'date': ['date', 'timestamp'],
+    'location': ['location', 'channel', 'store'],
+    'amount': ['amount', 'revenue', 'sales'],
+    'customer': ['customer', 'client'],
+}
+
+# One precompiled pattern per field, built from COLUMN_MAPPING
+_COLUMN_PATTERNS = {
+    field: re.compile('|'.join(re.escape(v) for v in variations + [field]))
+    for field, variations in COLUMN_MAPPING.items()
+}
+
+# Characters dropped when normalizing a column name
+_NORMALIZE_TABLE = str.maketrans({' ': '_', '-': '_', '?': None, '!': None, '.': None})
+
+
+@dataclass(frozen=True)
+class ColumnSchema:
+    """
+    Which file column holds each field
+
+    Produced by resolve_schema, or built by hand and passed to
+    parse_columns to skip column detection entirely.
+    """
+    productid: str
+    category: str
+    product_description: Optional[str] = None
+    subcategory: Optional[str] = None
+    zero_waste: Optional[str] = None
+    transaction_id: Optional[str] = None
+    date: Optional[str] = None
+    location: Optional[str] = None
+    amount: Optional[str] = None
+    customer: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, str]:
+        """Mapping of the fields that were found to their column names"""
+        return {field: col for field, col in asdict(self).items() if col is not None}
+
 
 def parse_excel_file(df: pd.DataFrame) -> Dict[str, Any]:
     """
     Parse Excel/CSV data into structured format
     Handles various column name variations
+
+    Returns the legacy list-of-dicts shape. New code should prefer
+    parse_columns, which keeps the data columnar.
     """
-    # Keep original column names - we'll match using normalized versions
-    original_columns = list(df.columns)
+    lines = parse_columns(df)
+    
+    parsed = {
+        'products': lines[PRODUCT_FIELDS].to_dict('records'),
+        'transactions': []
+    }
+    
+    # Transactions are only emitted for rows that carry a transaction ID
+    if 'transactionId' in lines.columns:
+        txns = lines.loc[lines['transactionId'].notna(), ['transactionId', 'productId']]
+        parsed['transactions'] = txns.to_dict('records')
+    
+    return parsed
+
+def parse_columns(df: pd.DataFrame, schema: Optional[ColumnSchema] = None,
+                  issues: Optional[RowIssues] = None) -> pd.DataFrame:
+    """
+    Columnar version of parse_excel_file
+
+    Resolves the columns once and then works on whole columns instead of
+    building one dict per row. Returns a DataFrame with one row per parsed
+    line and the columns productId, description, category, subcategory,
+    hasZeroWaste and (when the file has one) transactionId. Values match
+    what parse_excel_file has always produced, except that whole-number
+    float IDs are written as integers ('130', not '130.0').
+
+    Pass a pinned schema to skip column detection (e.g. for every chunk
+    after the first of a streamed file). Skipped rows are added to issues
+    when given, so a chunked caller can log one summary for the file;
+    otherwise they are logged here.
+    """
+    actual_columns = _actual_columns(df, schema)
+    logger.debug("parsing lines", extra={'columns': list(df.columns), 'mapping': actual_columns, 'rows': len(df)})
+    
+    df = _complete_rows(df, actual_columns, issues)
+    
+    lines = pd.DataFrame(index=df.index)
+    lines['productId'] = _to_id_str(df[actual_columns['productid']])
+    lines['description'] = _optional_str_column(df, actual_columns.get('product_description'))
+    lines['category'] = _to_str(df[actual_columns['category']]).str.strip()
+    lines['subcategory'] = _optional_str_column(df, actual_columns.get('subcategory'))
+    
+    zero_waste_col = actual_columns.get('zero_waste')
+    if zero_waste_col:
+        lines['hasZeroWaste'] = _parse_zero_waste_column(df[zero_waste_col])
+    else:
+        lines['hasZeroWaste'] = False
+    
+    # Handle transactions if available (missing IDs stay None)
+    if 'transaction_id' in actual_columns:
+        txn_ids = df[actual_columns['transaction_id']]
+        lines['transactionId'] = _to_id_str(txn_ids).where(txn_ids.notna(), None)
+    
+    # Transaction-level fields, when the file has them (used by /api/analytics)
+    if 'date' in actual_columns:
+        lines['date'] = pd.to_datetime(df[actual_columns['date']], errors='coerce')
+    if 'location' in actual_columns:
+        lines['location'] = _optional_text(df[actual_columns['location']])
+    if 'amount' in actual_columns:
+        lines['amount'] = pd.to_numeric(df[actual_columns['amount']], errors='coerce')
+    if 'customer' in actual_columns:
+        lines['customer'] = _optional_text(df[actual_columns['customer']])
+    
+    lines.reset_index(drop=True, inplace=True)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("parsed lines", extra={'lines': len(lines), 'categories': list(lines['category'].unique()[:10])})
+    
+    return lines
+
+def parse_compact(df: pd.DataFrame, schema: Optional[ColumnSchema] = None,
+                  issues: Optional[RowIssues] = None) -> CompactLines:
+    """
+    parse_columns straight into CompactLines
+
+    Each column is factorized before its values are converted, so str()
+    and strip() run once per distinct value and no per-line string column
+    is built. Decodes to the same values as parse_columns, except that
+    numerically equal values of different types in one column (1, 1.0,
+    True) share the string of the first one seen.
+    """
+    actual_columns = _actual_columns(df, schema)
+    df = _complete_rows(df, actual_columns, issues)
+    
+    def encoded(field: str, convert, keep_missing: bool = True) -> Optional[EncodedColumn]:
+        if field not in actual_columns:
+            return None
+        return EncodedColumn.encode_values(df[actual_columns[field]], convert, keep_missing)
+    
+    def optional_str(field: str) -> EncodedColumn:
+        # Same as _optional_str_column: 'N/A' when the column is missing
+        return encoded(field, _to_str, keep_missing=False) or EncodedColumn.constant('N/A', len(df))
     
+    zero_waste_col = actual_columns.get('zero_waste')
+    if zero_waste_col:
+        has_zero_waste = _parse_zero_waste_column(df[zero_waste_col]).to_numpy(dtype=bool)
+    else:
+        has_zero_waste = np.zeros(len(df), dtype=bool)
+    
+    lines = CompactLines(
+        product=encoded('productid', _to_id_str, keep_missing=False),
+        description=optional_str('product_description'),
+        category=encoded('category', _strip_str, keep_missing=False),
+        subcategory=optional_str('subcategory'),
+        has_zero_waste=has_zero_waste,
+        transaction=encoded('transaction_id', _to_id_str),
+        location=encoded('location', _strip_str),
+        customer=encoded('customer', _strip_str),
+    )
+    if 'date' in actual_columns:
+        lines.date = pd.to_datetime(df[actual_columns['date']], errors='coerce').to_numpy(dtype='datetime64[ns]')
+    if 'amount' in actual_columns:
+        lines.amount = pd.to_numeric(df[actual_columns['amount']], errors='coerce').to_numpy(dtype=float)
+    return lines
+
+def _actual_columns(df: pd.DataFrame, schema: Optional[ColumnSchema]) -> Dict[str, str]:
+    """Field -> column mapping, detected or checked against a pinned schema"""
+    if schema is None:
+        schema = resolve_schema(tuple(df.columns))
+    else:
+        missing = [col for col in schema.as_dict().values() if col not in df.columns]
+        if missing:
+            raise ValueError(f"Pinned schema columns not found: {missing}. Found columns: {list(df.columns)}")
+    return schema.as_dict()
+
+def _complete_rows(df: pd.DataFrame, actual_columns: Dict[str, str],
+                   issues: Optional[RowIssues] = None) -> pd.DataFrame:
+    """
+    Skip rows with missing product ID or category
+
+    Skipped rows go into issues by file row number (header is row 1), or
+    are logged as one summary when no issues collector is given.
+    """
+    has_id = df[actual_columns['productid']].notna()
+    keep = has_id & df[actual_columns['category']].notna()
+    if keep.all():
+        return df
+    report = issues if issues is not None else RowIssues()
+    # Rows missing both are counted once, as missing a product ID
+    report.add('missing product ID', _row_numbers(df, ~has_id))
+    report.add('missing category', _row_numbers(df, has_id & ~keep))
+    if issues is None:
+        report.log(logger)
+    return df.loc[keep]
+
+def _row_numbers(df: pd.DataFrame, mask: pd.Series) -> np.ndarray:
+    """File row numbers of the masked rows (chunks of a CSV keep counting up)"""
+    index = df.index[mask.to_numpy()]
+    if pd.api.types.is_integer_dtype(index):
+        return index.to_numpy() + 2
+    return np.flatnonzero(mask.to_numpy()) + 2
+
+def resolve_schema(columns: Tuple[str, ...]) -> ColumnSchema:
+    """
+    Detect the ColumnSchema for a header
+
+    Results are cached per header signature, so repeated uploads and
+    chunks with the same columns skip detection. Raises ValueError when
+    the required product ID or category column is missing.
+    """
+    return _resolve_schema_cached(tuple(columns))
+
+@lru_cache(maxsize=256)
+def _resolve_schema_cached(columns: Tuple[str, ...]) -> ColumnSchema:
     # Create normalized mapping: normalized_name -> original_name
     normalized_columns = {}
-    for col in original_columns:
-        # Normalize: lowercase, strip, replace spaces/hyphens with underscores, remove special chars
-        normalized = col.strip().lower().replace(' ', '_').replace('-', '_').replace('?', '').replace('!', '').replace('.', '')
+    for col in columns:
+        normalized = col.strip().lower().translate(_NORMALIZE_TABLE)
         normalized_columns[normalized] = col
     
-    # Map common column name variations (using normalized names)
-    column_mapping = {
-        'productid': ['product_id', 'productid', 'id', 'product'],
-        'product_description': ['product_description', 'description', 'product_desc', 'name'],
-        'category': ['category', 'cat', 'product_category'],
-        'subcategory': ['subcategory', 'sub_category', 'sub_cat'],
-        'zero_waste': ['zero_waste', 'zerowaste', 'zero_waste_flag', 'package_free', 'waste_free'],
-        'transaction_id': ['transaction_id', 'transactionid', 'transaction', 'txn_id', 'txn'],
-    }
-    
     # Find actual column names by matching normalized names
     actual_columns = {}
-    for standard_name, variations in column_mapping.items():
+    for standard_name, pattern in _COLUMN_PATTERNS.items():
         for norm_col, orig_col in normalized_columns.items():
-            # Check if normalized column matches any variation
-            if norm_col in variations or any(var in norm_col for var in variations) or standard_name in norm_col:
+            if pattern.search(norm_col):
                 actual_columns[standard_name] = orig_col
                 break
     
-    # Debug: Print what columns were found
-    print(f"DEBUG: Original columns in file: {original_columns}")
-    print(f"DEBUG: Column mapping found: {actual_columns}")
-    
     # Validate required columns
     required = ['productid', 'category']
     missing = [r for r in required if r not in actual_columns]
     if missing:
         # Show what columns were found and what's missing
-        found_columns = list(df.columns)
         raise ValueError(
             f"Missing required columns: {missing}. "
-            f"Found columns: {found_columns}. "
+            f"Found columns: {list(columns)}. "
             f"Looking for: ProductID (or Product ID, ID) and Category (or Cat)"
         )
     
-    # Debug: Check what values are in the Category column
-    if 'category' in actual_columns:
-        category_col = actual_columns['category']
-        unique_categories = df[category_col].dropna().unique()[:10]  # First 10 unique values
-        print(f"DEBUG: Sample category values found: {list(unique_categories)}")
-        print(f"DEBUG: Total rows: {len(df)}")
-    
-    # Extract data
-    parsed = {
-        'products': [],
-        'transactions': []
-    }
-    
-    # Debug: Track first few categories we see
-    sample_categories_seen = []
-    
-    for idx, row in df.iterrows():
-        try:
-            # Get product ID (required)
-            product_id = row[actual_columns['productid']]
-            if pd.isna(product_id):
-                continue  # Skip rows with missing product ID
-            
-            # Get category (required)
-            category = row[actual_columns['category']]
-            if pd.isna(category):
-                continue  # Skip rows with missing category
-            
-            # Debug: Track first 5 categories
-            category_str = str(category).strip()
-            if len(sample_categories_seen) < 5 and category_str not in sample_categories_seen:
-                sample_categories_seen.append(category_str)
-            
-            product = {
-                'productId': str(product_id),
-                'description': str(row.get(actual_columns.get('product_description', ''), 'N/A')) if actual_columns.get('product_description') else 'N/A',
-                'category': str(category).strip(),  # Strip whitespace from category
-                'subcategory': str(row.get(actual_columns.get('subcategory', ''), 'N/A')) if actual_columns.get('subcategory') else 'N/A',
-                'hasZeroWaste': _parse_zero_waste_flag(
-                    row.get(actual_columns.get('zero_waste', ''), False) if actual_columns.get('zero_waste') else False
-                ),
-            }
-            parsed['products'].append(product)
-        except Exception as e:
-            # Skip problematic rows and continue
-            print(f"Warning: Skipping row due to error: {e}")
-            continue
-        
-        # Handle transactions if available
-        if 'transaction_id' in actual_columns:
-            txn_id = row[actual_columns['transaction_id']]
-            if pd.notna(txn_id):
-                parsed['transactions'].append({
-                    'transactionId': str(txn_id),
-                    'productId': product['productId']
-                })
-    
-    # Debug: Print summary
-    print(f"DEBUG: Parsed {len(parsed['products'])} products")
-    print(f"DEBUG: Sample categories seen during parsing: {sample_categories_seen}")
-    if parsed['products']:
-        all_categories = [p['category'] for p in parsed['products']]
-        unique_parsed = list(set(all_categories))[:10]
-        print(f"DEBUG: Unique categories in parsed data: {unique_parsed}")
-    
-    return parsed
+    return ColumnSchema(**actual_columns)
+
+def _to_str(column: pd.Series) -> pd.Series:
+    """Vectorized str() of every value (NaN becomes 'nan', like str(nan))"""
+    return column.astype(str).astype(object)
+
+def _to_id_str(column: pd.Series) -> pd.Series:
+    """
+    _to_str for ID columns, with whole-number floats written as integers
+
+    A numeric column with a blank cell is read as float, so without this
+    ID 130 would be '130.0' in that file (or CSV chunk) and '130' in one
+    without blanks. Each distinct value is converted once.
+    """
+    codes, uniques = pd.factorize(column)
+    text = np.array([_id_text(value) for value in uniques.tolist()] + ['nan'], dtype=object)
+    return pd.Series(text[codes], index=column.index, dtype=object)
+
+def _id_text(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _strip_str(column: pd.Series) -> pd.Series:
+    return _to_str(column).str.strip()
+
+def _optional_text(column: pd.Series) -> pd.Series:
+    """Stripped strings, with missing values kept as None"""
+    return _to_str(column).str.strip().where(column.notna(), None)
+
+def _optional_str_column(df: pd.DataFrame, column: Any) -> Any:
+    """String values of an optional column, or 'N/A' when it is missing"""
+    if not column:
+        return 'N/A'
+    return _to_str(df[column])
+
+def _parse_zero_waste_column(column: pd.Series) -> pd.Series:
+    """
+    Vectorized _parse_zero_waste_flag
+
+    Each distinct value is classified once and the result is broadcast
+    back to the rows through a lookup table indexed by factorize codes.
+    """
+    codes, uniques = pd.factorize(column)
+    lookup = np.array([classify_zero_waste(v) for v in uniques.tolist()] + [False], dtype=bool)
+    # factorize marks missing values with -1, which picks the trailing False
+    return pd.Series(lookup[codes], index=column.index)
+
+# typed=True keeps 1, 1.0 and True as separate entries
+@lru_cache(maxsize=4096, typed=True)
+def _classify_cached(value: Any) -> bool:
+    return _parse_zero_waste_flag(value)
+
+def classify_zero_waste(value: Any) -> bool:
+    """
+    Memoized _parse_zero_waste_flag
+
+    Files only use a handful of distinct flag strings, so each one is
+    classified once per process. Unhashable values skip the cache.
+    """
+    try:
+        return _classify_cached(value)
+    except TypeError:
+        return _parse_zero_waste_flag(value)
 
 def _parse_zero_waste_flag(value: Any) -> bool:
     """Parse zero-waste flag from various formats"""
@@ -0,0 +1,405 @@
+import io
+import json
+import codecs
+import itertools
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from services.loader import _is_product_sheet, _join_transactions, _transaction_columns, load_excel
+from services.parser import resolve_schema
+
+# Bytes looked at to detect a file's format
+SNIFF_BYTES = 4096
+
+# Magic numbers of the binary formats
+PARQUET_MAGIC = b'PAR1'
+ARROW_FILE_MAGIC = b'ARROW1'
+ARROW_STREAM_MAGIC = b'\xff\xff\xff\xff'       # continuation marker of the first message
+ZIP_MAGIC = b'PK\x03\x04'                       # .xlsx is a zip archive
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # legacy .xls
+
+# Characters of JSON text decoded per step when streaming a JSON upload
+JSON_BLOCK_CHARS = 1 << 20
+
+
+class UnsupportedFormat(ValueError):
+    """Raised when an upload matches none of the registered readers"""
+
+
+@dataclass(frozen=True)
+class Reader:
+    """
+    One upload format
+
+    sniff(head) says whether the first SNIFF_BYTES of a file are in this
+    format; read(contents) returns the file as a DataFrame with the same
+    kind of columns parse_columns takes from a CSV. Extensions are only
+    used when no reader recognizes the content.
+    """
+    name: str
+    extensions: Tuple[str, ...]
+    sniff: Callable[[bytes], bool]
+    read: Callable[[bytes], pd.DataFrame]
+
+
+# Registered readers, tried in order when detecting a format
+READERS: Dict[str, Reader] = {}
+
+
+def register_reader(name: str, extensions: Tuple[str, ...], sniff: Callable[[bytes], bool]):
+    """Decorator that registers read(contents) as the reader for a format"""
+    def register(read: Callable[[bytes], pd.DataFrame]) -> Callable[[bytes], pd.DataFrame]:
+        READERS[name] = Reader(name, extensions, sniff, read)
+        return read
+    return register
+
+
+def supported_extensions() -> List[str]:
+    return [ext for reader in READERS.values() for ext in reader.extensions]
+
+
+def detect_format(head: bytes, filename: Optional[str] = None) -> Optional[str]:
+    """
+    Name of the reader for a file, from its first bytes
+
+    The content decides; the filename extension is only a fallback for
+    files no reader recognizes. None when neither matches.
+    """
+    for reader in READERS.values():
+        if reader.sniff(head):
+            return reader.name
+    if filename:
+        lower = filename.lower()
+        for reader in READERS.values():
+            if lower.endswith(reader.extensions):
+                return reader.name
+    return None
+
+
+def sniff_upload(file_obj, filename: Optional[str] = None) -> Optional[str]:
+    """detect_format for an open file, leaving its position unchanged"""
+    position = file_obj.tell()
+    file_obj.seek(0)
+    head = file_obj.read(SNIFF_BYTES)
+    file_obj.seek(position)
+    return detect_format(head, filename)
+
+
+def read_upload(contents: bytes, filename: Optional[str] = None,
+                on_header: Optional[Callable[[List[str]], None]] = None) -> pd.DataFrame:
+    """
+    Read an uploaded file with the reader its content calls for
+
+    on_header(columns), when given, is called with the frame's columns as
+    soon as they are known: before the rows are read for Excel workbooks,
+    once the file is read for the other formats.
+    """
+    name = detect_format(contents[:SNIFF_BYTES], filename)
+    if name is None:
+        raise UnsupportedFormat(
+            f"Unsupported file type: {filename}. Supported: {', '.join(supported_extensions())}"
+        )
+    if name == 'xlsx' and on_header is not None:
+        return read_excel(contents, on_header)
+    df = READERS[name].read(contents)
+    if on_header is not None:
+        on_header([str(col) for col in df.columns])
+    return df
+
+
+def _is_text(head: bytes) -> bool:
+    """Whether head looks like text (UTF-8, possibly cut mid-character)"""
+    if b'\x00' in head:
+        return False
+    try:
+        codecs.getincrementaldecoder('utf-8-sig')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _first_char(head: bytes) -> str:
+    return head.lstrip(codecs.BOM_UTF8).lstrip()[:1].decode('ascii', errors='replace')
+
+
+@register_reader('parquet', ('.parquet', '.pq'), lambda head: head.startswith(PARQUET_MAGIC))
+def read_parquet(contents: bytes) -> pd.DataFrame:
+    """
+    Parquet file, reading only the columns parse_columns will use
+
+    Column chunks of other columns are never decoded.
+    """
+    source = pa.BufferReader(contents)
+    columns = _projection(pq.read_schema(source).names)
+    return _to_frame(pq.read_table(source, columns=columns))
+
+
+@register_reader('arrow', ('.arrow', '.feather', '.arrows'),
+                 lambda head: head.startswith(ARROW_FILE_MAGIC) or head.startswith(ARROW_STREAM_MAGIC))
+def read_arrow(contents: bytes) -> pd.DataFrame:
+    """
+    Arrow IPC file (Feather v2) or stream
+
+    Record batches point into the upload's bytes rather than copying them,
+    so dropping the unused columns costs nothing.
+    """
+    buffer = pa.py_buffer(contents)
+    if contents.startswith(ARROW_FILE_MAGIC):
+        table = pa.ipc.open_file(buffer).read_all()
+    else:
+        table = pa.ipc.open_stream(buffer).read_all()
+    columns = _projection(table.column_names)
+    return _to_frame(table if columns is None else table.select(columns))
+
+
+@register_reader('xlsx', ('.xlsx', '.xls'), lambda head: head.startswith((ZIP_MAGIC, OLE_MAGIC)))
+def read_excel(contents: bytes, on_header: Optional[Callable[[List[str]], None]] = None) -> pd.DataFrame:
+    """Product sheet of a workbook, with the transactions sheet joined on"""
+    # Headers are sniffed once and only the product sheet is parsed;
+    # date/location/amount come along from the transactions sheet
+    return load_excel(io.BytesIO(contents), join_transactions=True, on_header=on_header)
+
+
+@register_reader('json', ('.json', '.ndjson', '.jsonl'),
+                 lambda head: _is_text(head) and _first_char(head) in ('{', '['))
+def read_json(contents: bytes) -> pd.DataFrame:
+    """
+    JSON export: a {"transactions": [...], "lines": [...]} document, an
+    array of records, or NDJSON (one record per line)
+
+    Values are decoded one record at a time straight into columns, so the
+    whole document is never held as one nested object. Records are sorted
+    into lines and transactions the way load_excel picks sheets, and the
+    transactions are joined onto the lines by transaction ID. Empty
+    strings count as missing, like empty spreadsheet cells.
+    """
+    groups: Dict[str, _Columns] = {}
+    for key, record in _json_records(contents):
+        groups.setdefault(key, _Columns()).add(record)
+    frames = {key: columns.frame() for key, columns in groups.items()}
+
+    lines_key = next((key for key, df in frames.items() if _is_product_sheet([str(c) for c in df.columns])), None)
+    if lines_key is None:
+        # Like an Excel file without a product sheet: use the first group
+        lines_key = next(iter(frames), None)
+    if lines_key is None:
+        return pd.DataFrame()
+    lines = frames.pop(lines_key)
+    txn_key = next((key for key, df in frames.items() if _transaction_columns([str(c) for c in df.columns])), None)
+    if txn_key is not None:
+        lines = _join_transactions(lines, frames[txn_key])
+    return lines
+
+
+@register_reader('csv', ('.csv', '.txt'), lambda head: _is_text(head) and b',' in head.split(b'\n', 1)[0])
+def read_csv(contents: bytes) -> pd.DataFrame:
+    """CSV file, with the ID columns kept as text (see csv_dtypes)"""
+    header = pd.read_csv(io.BytesIO(contents), nrows=0)
+    return pd.read_csv(io.BytesIO(contents), dtype=csv_dtypes(header.columns))
+
+
+def csv_dtypes(columns) -> Dict[str, type]:
+    """
+    read_csv dtypes for a CSV header: its product and transaction ID columns as str
+
+    Otherwise pandas guesses a type per read (or per chunk), and an ID
+    column of numbers turns into floats wherever a cell is blank, so the
+    batch and the chunked reads of one file would disagree.
+    """
+    try:
+        schema = resolve_schema(tuple(str(c) for c in columns))
+    except ValueError:
+        return {}
+    return {column: str for column in (schema.productid, schema.transaction_id) if column is not None}
+
+
+def _projection(names: List[str]) -> Optional[List[str]]:
+    """
+    The columns parse_columns maps to a field, or None for all of them
+
+    When the required columns can't be found, everything is read so that
+    parsing reports the usual missing-column error.
+    """
+    try:
+        wanted = set(resolve_schema(tuple(names)).as_dict().values())
+    except ValueError:
+        return None
+    return [name for name in names if name in wanted]
+
+
+def _to_frame(table: pa.Table) -> pd.DataFrame:
+    """Arrow table as a DataFrame of plain (not categorical) columns"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, pc.cast(table.column(i), field.type.value_type))
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+class _Columns:
+    """Records gathered column by column (keys may differ between records)"""
+
+    def __init__(self):
+        self.rows = 0
+        self.values: Dict[str, list] = {}
+
+    def add(self, record: dict) -> None:
+        for key, value in record.items():
+            column = self.values.get(key)
+            if column is None:
+                column = self.values[key] = [None] * self.rows
+            column.append(None if value == '' else value)
+        self.rows += 1
+        for column in self.values.values():
+            if len(column) < self.rows:
+                column.append(None)
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values)
+
+
+def _json_records(contents: bytes) -> Iterator[Tuple[str, dict]]:
+    """
+    (group, record) for each record of a JSON upload
+
+    In a document, records are grouped by the key of the array they are
+    in. A first object without array members is taken as the first line
+    of NDJSON; there and in a top-level array, each record is grouped by
+    its keys (line, transaction or other), so lines and transactions may
+    be interleaved.
+    """
+    scanner = _JsonScanner(contents)
+    first = scanner.peek()
+    if first == '[':
+        yield from _grouped(scanner.array())
+        return
+    if first != '{':
+        raise ValueError("JSON upload must be an object, an array or one object per line")
+    # {"transactions": [...], "lines": [...]}; other members are kept in case
+    # this turns out to be the first NDJSON record
+    scanner.expect('{')
+    members = {}
+    is_document = False
+    while scanner.peek() != '}':
+        if members or is_document:
+            scanner.expect(',')
+        key = scanner.value()
+        scanner.expect(':')
+        if scanner.peek() == '[':
+            is_document = True
+            for record in scanner.array():
+                if isinstance(record, dict):
+                    yield key, record
+        else:
+            members[key] = scanner.value()
+    scanner.expect('}')
+    if not is_document:
+        yield from _grouped(itertools.chain([members], scanner.values()))
+
+
+def _grouped(records: Iterator) -> Iterator[Tuple[str, dict]]:
+    """Records grouped by whether their keys look like a line or a transaction"""
+    groups: Dict[Tuple, str] = {}
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        keys = tuple(record)
+        group = groups.get(keys)
+        if group is None:
+            names = [str(k) for k in keys]
+            if _is_product_sheet(names):
+                group = 'lines'
+            elif _transaction_columns(names) is not None:
+                group = 'transactions'
+            else:
+                group = 'records'
+            groups[keys] = group
+        yield group, record
+
+
+class _JsonScanner:
+    """
+    Incremental JSON reader over an upload's bytes
+
+    Text is decoded JSON_BLOCK_CHARS at a time and values are parsed with
+    JSONDecoder.raw_decode, so arrays can be walked element by element.
+    """
+
+    def __init__(self, contents: bytes):
+        self.contents = contents
+        self.restart()
+
+    def restart(self) -> None:
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+        self.offset = 0
+        self.text = ''
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        """Decode the next block; False at the end of the input"""
+        if self.offset >= len(self.contents):
+            return False
+        block = self.contents[self.offset:self.offset + JSON_BLOCK_CHARS]
+        self.offset += len(block)
+        self.text = self.text[self.pos:] + self.utf8.decode(block, final=self.offset >= len(self.contents))
+        self.pos = 0
+        return True
+
+    def peek(self) -> Optional[str]:
+        """Next non-whitespace character, or None at the end"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' at offset {self._position()}")
+        self.pos += 1
+
+    def value(self):
+        """The next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Possibly cut off at the end of the block: read more and retry
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self.text) and self.offset < len(self.contents):
+                # A number may continue in the next block
+                if self._fill():
+                    continue
+            self.pos = end
+            return value
+
+    def values(self) -> Iterator:
+        """Each remaining top-level value (NDJSON records)"""
+        while self.peek() is not None:
+            yield self.value()
+
+    def array(self) -> Iterator:
+        """Elements of the array starting at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def _position(self) -> int:
+        return self.offset - len(self.text) + self.pos
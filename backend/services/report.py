@@ -0,0 +1,249 @@
+import os
+import glob
+import json
+import hashlib
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from services.dataset_store import DATASET_DIR, analyze_dataset, load_metadata, dataset_signature
+from services.metrics import span
+
+# Bump when the report layout changes, so cached reports are not reused
+REPORT_VERSION = 1
+
+# Rendered reports, named by cache key
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(DATASET_DIR, "reports"))
+
+# Number of rendered reports kept on disk (least recently used are removed first)
+REPORT_CACHE_FILES = int(os.getenv("REPORT_CACHE_FILES", 100))
+
+# Bytes read per step when sending a report
+REPORT_CHUNK_BYTES = 64 * 1024
+
+# Rows per Table flowable, about one page. Long tables are cut into
+# pieces this size so a page split only re-measures one piece, not the
+# rest of the table.
+TABLE_CHUNK_ROWS = 50
+
+# Styles are built once per process instead of on every export
+_STYLES = getSampleStyleSheet()
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=24,
+    textColor=colors.HexColor('#16a34a'),
+    spaceAfter=30,
+)
+_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#16a34a')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0fdf4')]),
+    ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.HexColor('#d1d5db')),
+    ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+    ('TOPPADDING', (0, 0), (-1, -1), 2),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+])
+# Product ID, description and category are text, so left aligned
+_HIGH_RISK_TABLE_STYLE = TableStyle([('ALIGN', (1, 1), (3, -1), 'LEFT')], parent=_TABLE_STYLE)
+
+# Body cell font and the default Table cell padding, for fitting text
+_CELL_FONT, _CELL_FONT_SIZE, _CELL_PADDING = 'Helvetica', 8, 6
+
+# Column widths (fixed, so Table never has to measure the cells)
+_CATEGORY_COLUMNS = [3.5 * inch, 1.5 * inch, 1.5 * inch]
+_ADOPTION_COLUMNS = [2.9 * inch, 1.2 * inch, 1.2 * inch, 1.2 * inch]
+_HIGH_RISK_COLUMNS = [0.5 * inch, 1.1 * inch, 2.6 * inch, 1.4 * inch, 0.9 * inch]
+
+
+def report_key(data: Dict[str, Any]) -> str:
+    """Cache key for a report rendered from posted analysis data"""
+    payload = json.dumps(data, sort_keys=True, default=str).encode()
+    return f"{hashlib.sha256(payload).hexdigest()}-r{REPORT_VERSION}"
+
+
+def dataset_report_key(dataset_id: str) -> str:
+    """
+    Cache key for a stored dataset's report
+
+    Made from the dataset's files and insights, so it changes after an
+    append or when new insights are saved; the dataset is not read.
+    """
+    insights = load_metadata(dataset_id).get('insights')
+    payload = json.dumps([dataset_signature(dataset_id), insights], sort_keys=True, default=str).encode()
+    return f"{dataset_id}-{hashlib.sha256(payload).hexdigest()[:16]}-r{REPORT_VERSION}"
+
+
+def open_report(key: str) -> Optional[BinaryIO]:
+    """
+    An already rendered report, opened for reading, or None
+
+    Opening it marks the report as recently used, so pruning keeps it.
+    The response is sent from the open file, so it still reads in full
+    if another request prunes the file meanwhile.
+    """
+    path = _report_path(key)
+    try:
+        report = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return report
+
+
+def iter_report(report: BinaryIO) -> Iterator[bytes]:
+    """An open report's bytes in REPORT_CHUNK_BYTES pieces, closing it at the end"""
+    with report:
+        while True:
+            chunk = report.read(REPORT_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def render_report(data: Dict[str, Any], key: str) -> str:
+    """Render the report for an analysis into the cache and return its path"""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = _report_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with span('render_pdf', rows=len(data.get('highRiskProducts', []))) as current:
+            build_pdf(data, tmp_path)
+            current.bytes = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    _prune_cache()
+    return path
+
+
+def render_dataset_report(dataset_id: str, key: str) -> str:
+    """Render a stored dataset's report, with every high-risk product listed"""
+    analysis = analyze_dataset(dataset_id, high_risk_limit=None)
+    insights = load_metadata(dataset_id).get('insights') or {}
+    return render_report({**analysis, 'insights': insights}, key)
+
+
+def build_pdf(data: Dict[str, Any], target: Any) -> None:
+    """Write the PDF report for an analysis to a path or file object"""
+    doc = SimpleDocTemplate(target, pagesize=letter)
+    story = []
+    styles = _STYLES
+
+    # Title
+    story.append(Paragraph("Zero-Waste Intelligence Report", _TITLE_STYLE))
+    story.append(Spacer(1, 0.2*inch))
+
+    # Summary
+    story.append(Paragraph("Executive Summary", styles['Heading2']))
+    summary_text = f"""
+    Total Products Analyzed: {data.get('totalProducts', 0)}<br/>
+    Overall Zero-Waste Adoption: {data.get('overallAdoptionRate', 0)}%<br/>
+    Total Transactions: {data.get('totalTransactions', 0)}
+    """
+    story.append(Paragraph(summary_text, styles['Normal']))
+    story.append(Spacer(1, 0.3*inch))
+
+    # AI Insights
+    insights = data.get('insights') or {}
+    story.append(Paragraph("Key Insights", styles['Heading2']))
+    story.append(Paragraph(insights.get('summary', 'No insights available'), styles['Normal']))
+    story.append(Spacer(1, 0.2*inch))
+
+    story.append(Paragraph("Recommendations", styles['Heading2']))
+    story.append(Paragraph("<b>For Consumers:</b>", styles['Normal']))
+    story.append(Paragraph(insights.get('consumer', ''), styles['Normal']))
+    story.append(Spacer(1, 0.1*inch))
+
+    story.append(Paragraph("<b>For Businesses:</b>", styles['Normal']))
+    story.append(Paragraph(insights.get('business', ''), styles['Normal']))
+    story.append(Spacer(1, 0.1*inch))
+
+    story.append(Paragraph("<b>For Policymakers:</b>", styles['Normal']))
+    story.append(Paragraph(insights.get('policy', ''), styles['Normal']))
+
+    # Full tables
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph("Category Breakdown", styles['Heading2']))
+    story.extend(_paged_table(
+        ['Category', 'Products', 'Share (%)'],
+        [[_fit(c['category'], _CATEGORY_COLUMNS[0]), c['count'], c['percentage']] for c in data.get('categoryBreakdown', [])],
+        _CATEGORY_COLUMNS, _TABLE_STYLE,
+    ))
+
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph("Zero-Waste Adoption by Category", styles['Heading2']))
+    story.extend(_paged_table(
+        ['Category', 'Zero-Waste', 'Total', 'Adoption (%)'],
+        [[_fit(a['category'], _ADOPTION_COLUMNS[0]), a['zeroWasteCount'], a['totalCount'], a['adoptionRate']]
+         for a in data.get('zeroWasteAdoption', [])],
+        _ADOPTION_COLUMNS, _TABLE_STYLE,
+    ))
+
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph("High-Risk Products", styles['Heading2']))
+    story.extend(_paged_table(
+        ['#', 'Product ID', 'Description', 'Category', 'Transactions'],
+        [[i, _fit(p['productId'], _HIGH_RISK_COLUMNS[1]), _fit(p['description'], _HIGH_RISK_COLUMNS[2]),
+          _fit(p['category'], _HIGH_RISK_COLUMNS[3]), p['transactionCount']]
+         for i, p in enumerate(data.get('highRiskProducts', []), start=1)],
+        _HIGH_RISK_COLUMNS, _HIGH_RISK_TABLE_STYLE,
+    ))
+
+    # Build PDF
+    doc.build(story)
+
+
+def _paged_table(header: List[str], rows: List[list], col_widths: List[float], style: TableStyle) -> List[Any]:
+    """
+    A long table as TABLE_CHUNK_ROWS-row Table flowables
+
+    Each piece repeats the header row when it breaks across pages.
+    """
+    if not rows:
+        return [Paragraph("No data", _STYLES['Normal'])]
+    return [
+        Table([header] + rows[start:start + TABLE_CHUNK_ROWS], colWidths=col_widths, repeatRows=1, style=style)
+        for start in range(0, len(rows), TABLE_CHUNK_ROWS)
+    ]
+
+
+def _fit(value: Any, width: float) -> str:
+    """Cell text cut to fit a column width (in points, less padding)"""
+    text = '' if value is None else str(value)
+    room = width - 2 * _CELL_PADDING
+    if stringWidth(text, _CELL_FONT, _CELL_FONT_SIZE) <= room:
+        return text
+    while text and stringWidth(text + '…', _CELL_FONT, _CELL_FONT_SIZE) > room:
+        text = text[:-1]
+    return text + '…'
+
+
+def _report_path(key: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, f"{key}.pdf")
+
+
+def _prune_cache() -> None:
+    """
+    Remove the least recently used reports beyond REPORT_CACHE_FILES
+
+    open_report touches a report's mtime, so mtime order is use order.
+    """
+    paths = sorted(glob.glob(os.path.join(REPORT_CACHE_DIR, '*.pdf')), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - REPORT_CACHE_FILES, 0)]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,302 @@
+import os
+import zlib
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import brotli
+import orjson
+from fastapi.responses import Response
+
+from services.metrics import span
+
+# Bodies smaller than this are sent uncompressed (not worth the CPU)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+# Compression effort: brotli 4 and gzip 6 keep large analyses in the low
+# milliseconds while still shrinking them several times
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 4))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+# Largest request body accepted once decompressed
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", 256 * 1024 * 1024))
+
+# Content types worth compressing (PDFs and images already are)
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Response encodings, in order of preference when the client accepts several
+ENCODINGS = ("br", "gzip")
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def encode_json(content: Any) -> bytes:
+    """
+    JSON bytes of a response payload
+
+    orjson writes dicts, lists, numpy values and dates directly, so the
+    jsonable_encoder copy of the payload is not needed. NaN and infinity
+    become null (plain json would write invalid JSON); anything else
+    unknown is written as its str().
+    """
+    return orjson.dumps(content, default=_default, option=_JSON_OPTIONS)
+
+
+def _default(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response serialized with encode_json, timed as the 'serialize' stage
+
+    Returning one from an endpoint skips FastAPI's jsonable_encoder walk
+    over the payload; as the default response class it still replaces the
+    stdlib json.dumps.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with span("serialize") as current:
+            body = encode_json(content)
+            current.bytes = len(body)
+        return body
+
+
+class RawJSONResponse(Response):
+    """Already serialized JSON (e.g. a cached result), sent as is"""
+    media_type = "application/json"
+
+
+def make_etag(body: bytes) -> str:
+    """Weak ETag of a body, the same for its gzip and brotli encodings"""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag (weak comparison)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or _opaque(etag) in {_opaque(tag) for tag in tags}
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Best of ENCODINGS the client accepts (q=0 means refused), or None"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates = [(accepted.get(name, accepted.get("*", 0.0)), -i, name) for i, name in enumerate(ENCODINGS)]
+    quality, _, name = max(candidates)
+    return name if quality > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # wbits 31: gzip container
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class BodyTooLarge(ValueError):
+    """Raised when a request body decompresses to more than MAX_REQUEST_BYTES"""
+
+
+def decompress(body: bytes, encoding: str, limit: int = MAX_REQUEST_BYTES) -> bytes:
+    """
+    Decode a gzip, deflate or brotli request body
+
+    Output is capped at limit bytes while decoding, so a small compressed
+    body can't expand into gigabytes. Raises BodyTooLarge past the limit
+    and ValueError for corrupt or truncated data.
+    """
+    if encoding == "br":
+        decompressor = brotli.Decompressor()
+        try:
+            data = decompressor.process(body, output_buffer_limit=limit + 1)
+        except brotli.error as e:
+            raise ValueError(f"Invalid brotli body: {e}")
+        if len(data) > limit:
+            raise BodyTooLarge(limit)
+        if not decompressor.is_finished():
+            raise ValueError("Invalid brotli body: truncated")
+        return data
+    # wbits 47: gzip or zlib header, detected; deflate is the zlib format
+    decompressor = zlib.decompressobj(47)
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid {encoding} body: {e}")
+    if len(data) > limit or decompressor.unconsumed_tail:
+        raise BodyTooLarge(limit)
+    if not decompressor.eof:
+        raise ValueError(f"Invalid {encoding} body: truncated")
+    return data
+
+
+class CompressionMiddleware:
+    """
+    Compression and conditional GETs, around the whole app
+
+    Requests: bodies sent with Content-Encoding gzip, deflate or br are
+    decoded before the endpoint reads them, so the frontend can compress
+    the analysis it posts back to /api/insights and /api/export.
+
+    Responses: complete (not streamed) 200 responses get
+      - a weak content-hash ETag on GET, unless the endpoint set one;
+        If-None-Match with that tag gets an empty 304 instead
+      - brotli or gzip encoding, per Accept-Encoding, when the body is a
+        compressible type of at least COMPRESS_MIN_BYTES
+    Streamed responses (progress events, file downloads sent in parts)
+    pass through untouched so their events are not held back.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = _headers(scope["headers"])
+        content_encoding = headers.get("content-encoding", "identity").lower()
+        if content_encoding != "identity":
+            decoded = await self._decoded_request(scope, receive, send, content_encoding)
+            if decoded is None:
+                return
+            scope, receive = decoded
+
+        responder = _Responder(
+            send,
+            method=scope["method"],
+            if_none_match=headers.get("if-none-match"),
+            encoding=negotiate_encoding(headers.get("accept-encoding", "")),
+        )
+        await self.app(scope, receive, responder.send)
+
+    async def _decoded_request(self, scope: Dict, receive: Callable, send: Callable,
+                               encoding: str) -> Optional[Tuple[Dict, Callable]]:
+        """(scope, receive) with the body decoded, or None after sending an error"""
+        if encoding not in ("gzip", "deflate", "br"):
+            await _send_error(send, 415, f"Unsupported Content-Encoding: {encoding}")
+            return None
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away; let the app see the disconnect
+                return scope, receive
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        try:
+            with span("decompress") as current:
+                body = decompress(b"".join(chunks), encoding, MAX_REQUEST_BYTES)
+                current.bytes = len(body)
+        except BodyTooLarge:
+            await _send_error(send, 413, f"Request body is larger than {MAX_REQUEST_BYTES} bytes once decompressed")
+            return None
+        except ValueError as e:
+            await _send_error(send, 400, str(e))
+            return None
+
+        raw_headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+        sent = False
+
+        async def decoded_receive() -> Dict:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return {**scope, "headers": raw_headers}, decoded_receive
+
+
+class _Responder:
+    """send() wrapper that holds back the start message until the body is known"""
+
+    def __init__(self, send: Callable, method: str, if_none_match: Optional[str], encoding: Optional[str]):
+        self._send = send
+        self.method = method
+        self.if_none_match = if_none_match
+        self.encoding = encoding
+        self.start: Optional[Dict] = None
+        self.streaming = False
+
+    async def send(self, message: Dict) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.streaming or self.start is None:
+            await self._send(message)
+            return
+        start, self.start = self.start, None
+        if message.get("more_body", False):
+            # Streamed: send as it comes
+            self.streaming = True
+            await self._send(start)
+            await self._send(message)
+            return
+        await self._finish(start, message.get("body", b""))
+
+    async def _finish(self, start: Dict, body: bytes) -> None:
+        headers = _headers(start.get("headers", []))
+        raw_headers = list(start.get("headers", []))
+        if start["status"] != 200 or "content-encoding" in headers:
+            await self._send(start)
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        if self.method == "GET":
+            etag = headers.get("etag")
+            if etag is None:
+                etag = make_etag(body)
+                raw_headers.append((b"etag", etag.encode()))
+            if etag_matches(self.if_none_match, etag):
+                kept = [(k, v) for k, v in raw_headers if k not in (b"content-length", b"content-type")]
+                await self._send({"type": "http.response.start", "status": 304, "headers": kept})
+                await self._send({"type": "http.response.body", "body": b""})
+                return
+
+        content_type = headers.get("content-type", "")
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            raw_headers.append((b"vary", b"Accept-Encoding"))
+            if self.encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+                with span("compress", bytes=len(body)):
+                    body = compress(body, self.encoding)
+                raw_headers = [(k, v) for k, v in raw_headers if k != b"content-length"]
+                raw_headers += [(b"content-encoding", self.encoding.encode()),
+                                (b"content-length", str(len(body)).encode())]
+        await self._send({**start, "headers": raw_headers})
+        await self._send({"type": "http.response.body", "body": body})
+
+
+def _headers(raw: List[Tuple[bytes, bytes]]) -> Dict[str, str]:
+    return {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in raw}
+
+
+async def _send_error(send: Callable, status: int, detail: str) -> None:
+    """An error in FastAPI's {"detail": ...} shape, sent before the app runs"""
+    body = encode_json({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
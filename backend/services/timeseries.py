@@ -0,0 +1,311 @@
+import os
+import glob
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from services.analyzer import HIGH_RISK_LIMIT, _top_high_risk, _high_risk_entry
+from services.dataset_store import load_lines, dataset_signature, sidecar_path
+from services.metrics import span
+
+# Columns the time index reads from a stored dataset
+TIME_COLUMNS = ['productId', 'description', 'category', 'hasZeroWaste', 'transactionId', 'date', 'location', 'amount']
+
+# Supported period sizes -> pandas period frequency
+GRANULARITIES = {'day': 'D', 'week': 'W', 'month': 'M'}
+
+# High-risk products listed for each period and location
+HIGH_RISK_PER_BUCKET = 5
+
+# Label for lines without a location
+UNKNOWN_LOCATION = 'unknown'
+
+# Number of dataset indexes kept in memory per process
+INDEX_CACHE_SIZE = 8
+
+# Bump when TimeIndex's arrays change, so saved indexes are rebuilt
+TIME_INDEX_VERSION = 1
+
+
+class TimeIndex:
+    """
+    Date- and location-indexed view of a dataset
+
+    Dated lines are sorted by day once, so a date range is a searchsorted
+    slice. Lines, zero-waste lines, transactions and revenue are also
+    pre-aggregated per (day, location) bucket, so period and location
+    totals are sums over at most days x locations cells instead of a scan
+    over every line. Lines without a date can't be placed in a period, so
+    they are left out of every figure and only counted (undated_lines).
+
+    An index is saved as a sidecar file next to its dataset (save/load),
+    so every process can memory-map it instead of building its own.
+    """
+
+    # Per-product, per-line, per-day and per-location arrays, saved as the
+    # columns of the sidecar file (bucket arrays flattened)
+    ARRAYS = ['product_ids', 'descriptions', 'categories', 'eligible',
+              'line_days', 'product_codes', 'loc_codes', 'has_transaction', 'days', 'locations',
+              'bucket_lines', 'bucket_zero_waste', 'bucket_transactions', 'bucket_revenue']
+
+    def __init__(self, lines: pd.DataFrame):
+        # Product details come from the whole dataset, like analyze_frame:
+        # the last line seen for a product describes it
+        product_codes, product_ids = pd.factorize(lines['productId'])
+        last_row = np.full(len(product_ids), -1)
+        last_row[product_codes] = np.arange(len(lines))
+        self.product_ids = product_ids.tolist()
+        self.descriptions = lines['description'].to_numpy()[last_row].tolist()
+        self.categories = lines['category'].to_numpy()[last_row].tolist()
+        self.eligible = ~lines['hasZeroWaste'].to_numpy(dtype=bool)[last_row]
+
+        dated = lines['date'].notna().to_numpy()
+        self.undated_lines = int(len(lines) - dated.sum())
+        line_days = lines['date'].to_numpy(dtype='datetime64[D]')[dated]
+        order = np.argsort(line_days, kind='stable')
+        self.line_days = line_days[order]
+        self.days, day_idx = np.unique(self.line_days, return_inverse=True)
+
+        def sorted_column(values: np.ndarray) -> np.ndarray:
+            return values[dated][order]
+
+        self.product_codes = sorted_column(product_codes).astype(np.int32)
+        locations = lines['location'].fillna(UNKNOWN_LOCATION)
+        loc_codes, self.locations = pd.factorize(sorted_column(locations.to_numpy(dtype=object)))
+        self.loc_codes = loc_codes.astype(np.int32)
+        self.locations = self.locations.tolist()
+        has_zero_waste = sorted_column(lines['hasZeroWaste'].to_numpy(dtype=bool))
+        self.has_transaction = sorted_column(lines['transactionId'].notna().to_numpy())
+
+        # A transaction is counted (and its amount added) once, on its first
+        # line; the amount column repeats on every line of the transaction
+        txn_keys = pd.DataFrame({
+            'txn': sorted_column(lines['transactionId'].to_numpy(dtype=object)),
+            'day': self.line_days,
+            'loc': loc_codes,
+        })
+        first_line = self.has_transaction & ~txn_keys.duplicated().to_numpy()
+        amounts = np.nan_to_num(sorted_column(lines['amount'].to_numpy(dtype=float)))
+
+        n_loc = max(len(self.locations), 1)
+        bucket = day_idx * n_loc + loc_codes
+        size = len(self.days) * n_loc
+
+        def bucketed(weights: Optional[np.ndarray]) -> np.ndarray:
+            return np.bincount(bucket, weights=weights, minlength=size).reshape(len(self.days), n_loc)
+
+        self.bucket_lines = bucketed(None)
+        self.bucket_zero_waste = bucketed(has_zero_waste.astype(float))
+        self.bucket_transactions = bucketed(first_line.astype(float))
+        self.bucket_revenue = bucketed(np.where(first_line, amounts, 0.0))
+
+    def save(self, path: str) -> None:
+        """
+        Write the index to an Arrow IPC file
+
+        Arrays of different lengths are the one-row list columns of a
+        single table, so a load is one memory-mapped read.
+        """
+        columns = {}
+        for name in self.ARRAYS:
+            values = getattr(self, name)
+            if name == 'line_days' or name == 'days':
+                values = values.view(np.int64)
+            elif name.startswith('bucket_'):
+                values = values.ravel()
+            columns[name] = pa.array([pa.array(values)], type=pa.large_list(pa.array(values).type))
+        table = pa.table(columns).replace_schema_metadata({'undated_lines': str(self.undated_lines)})
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.ipc.new_file(tmp_path, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TimeIndex":
+        """An index written by save; numeric arrays point into the mapped file"""
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        index = cls.__new__(cls)
+        index.undated_lines = int(table.schema.metadata[b'undated_lines'])
+        for name in cls.ARRAYS:
+            values = table.column(name).chunk(0).values
+            if name in ('product_ids', 'descriptions', 'categories', 'locations'):
+                setattr(index, name, values.to_pylist())
+            elif name in ('line_days', 'days'):
+                setattr(index, name, values.to_numpy().view('datetime64[D]'))
+            else:
+                setattr(index, name, values.to_numpy(zero_copy_only=False))
+        shape = (len(index.days), max(len(index.locations), 1))
+        for name in ('bucket_lines', 'bucket_zero_waste', 'bucket_transactions', 'bucket_revenue'):
+            setattr(index, name, getattr(index, name).reshape(shape))
+        return index
+
+    def query(self, granularity: str = 'day', start: Optional[date] = None,
+              end: Optional[date] = None, location: Optional[str] = None) -> Dict[str, Any]:
+        """Metrics per period and per location for a date range"""
+        day_lo, day_hi = self._day_range(start, end)
+        line_lo, line_hi = self._line_range(start, end)
+
+        loc_code = None
+        if location is not None:
+            loc_code = self.locations.index(location) if location in self.locations else -1
+
+        def cells(rows: slice, loc: Optional[int]) -> Tuple[np.ndarray, ...]:
+            arrays = (self.bucket_lines, self.bucket_zero_waste, self.bucket_transactions, self.bucket_revenue)
+            if loc is None:
+                return tuple(a[rows].sum(axis=1) for a in arrays)
+            if loc < 0:
+                return tuple(np.zeros(rows.stop - rows.start) for _ in arrays)
+            return tuple(a[rows, loc] for a in arrays)
+
+        def line_mask(lo: int, hi: int, loc: Optional[int]) -> np.ndarray:
+            if loc is None:
+                return np.ones(hi - lo, dtype=bool)
+            return self.loc_codes[lo:hi] == loc
+
+        # Periods: consecutive days that share a period label
+        periods = []
+        days = self.days[day_lo:day_hi]
+        if len(days):
+            labels = pd.PeriodIndex(days, freq=GRANULARITIES[granularity])
+            starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+            lines, zero_waste, transactions, revenue = cells(slice(day_lo, day_hi), loc_code)
+            bounds = np.searchsorted(self.line_days, days[starts])
+            ends = np.r_[bounds[1:], line_hi]
+            for i, first in enumerate(starts.tolist()):
+                last = starts[i + 1] if i + 1 < len(starts) else len(days)
+                lo, hi = int(bounds[i]), int(ends[i])
+                periods.append({
+                    'period': str(labels[first]),
+                    **_metrics(lines[first:last].sum(), zero_waste[first:last].sum(),
+                               transactions[first:last].sum(), revenue[first:last].sum()),
+                    'highRiskProducts': self._high_risk(lo, hi, line_mask(lo, hi, loc_code), HIGH_RISK_PER_BUCKET),
+                })
+
+        # Locations over the whole range
+        location_rows = []
+        for code, name in enumerate(self.locations):
+            if loc_code is not None and code != loc_code:
+                continue
+            lines, zero_waste, transactions, revenue = cells(slice(day_lo, day_hi), code)
+            location_rows.append({
+                'location': name,
+                **_metrics(lines.sum(), zero_waste.sum(), transactions.sum(), revenue.sum()),
+                'highRiskProducts': self._high_risk(line_lo, line_hi, line_mask(line_lo, line_hi, code), HIGH_RISK_PER_BUCKET),
+            })
+
+        lines, zero_waste, transactions, revenue = cells(slice(day_lo, day_hi), loc_code)
+        totals = {
+            **_metrics(lines.sum(), zero_waste.sum(), transactions.sum(), revenue.sum()),
+            'highRiskProducts': self._high_risk(line_lo, line_hi, line_mask(line_lo, line_hi, loc_code), HIGH_RISK_LIMIT),
+        }
+
+        return {
+            'granularity': granularity,
+            'start': str(self.days[day_lo]) if day_lo < day_hi else None,
+            'end': str(self.days[day_hi - 1]) if day_lo < day_hi else None,
+            'location': location,
+            'locations': self.locations,
+            'undatedLines': self.undated_lines,
+            'totals': totals,
+            'periods': periods,
+            'byLocation': location_rows,
+        }
+
+    def _day_range(self, start: Optional[date], end: Optional[date]) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self.days, np.datetime64(start, 'D'), 'left'))
+        hi = len(self.days) if end is None else int(np.searchsorted(self.days, np.datetime64(end, 'D'), 'right'))
+        return lo, max(lo, hi)
+
+    def _line_range(self, start: Optional[date], end: Optional[date]) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self.line_days, np.datetime64(start, 'D'), 'left'))
+        hi = len(self.line_days) if end is None else int(np.searchsorted(self.line_days, np.datetime64(end, 'D'), 'right'))
+        return lo, max(lo, hi)
+
+    def _high_risk(self, lo: int, hi: int, mask: np.ndarray, limit: int) -> List[Dict[str, Any]]:
+        """Top non-zero-waste products by transaction lines within [lo, hi)"""
+        mask = mask & self.has_transaction[lo:hi]
+        codes = self.product_codes[lo:hi][mask]
+        if len(codes) == 0:
+            return []
+        n_products = len(self.product_ids)
+        tx_counts = np.bincount(codes, minlength=n_products)
+        first_tx = np.zeros(n_products, dtype=np.int64)
+        first_tx[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+        top = _top_high_risk(tx_counts, first_tx, self.eligible, limit)
+        return [
+            _high_risk_entry(self.product_ids[i], self.descriptions[i], self.categories[i], int(tx_counts[i]))
+            for i in top.tolist()
+        ]
+
+
+def _metrics(lines: float, zero_waste: float, transactions: float, revenue: float) -> Dict[str, Any]:
+    lines, zero_waste = int(lines), int(zero_waste)
+    return {
+        'lines': lines,
+        'zeroWasteLines': zero_waste,
+        'adoptionRate': round((zero_waste / lines) * 100, 2) if lines > 0 else 0,
+        'transactions': int(transactions),
+        'revenue': round(float(revenue), 2),
+    }
+
+
+_index_cache: "OrderedDict[str, Tuple[Any, TimeIndex]]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_time_index(dataset_id: str) -> TimeIndex:
+    """
+    TimeIndex for a stored dataset, built on first use
+
+    A built index is saved next to the dataset under a name made from
+    dataset_signature, so any worker process loads it rather than
+    building it again, and it is rebuilt when the dataset's files change.
+    The last INDEX_CACHE_SIZE indexes used are also kept in memory.
+    """
+    signature = dataset_signature(dataset_id)
+    with _index_lock:
+        cached = _index_cache.get(dataset_id)
+        if cached is not None and cached[0] == signature:
+            _index_cache.move_to_end(dataset_id)
+            return cached[1]
+
+    key = hashlib.blake2b(json.dumps([signature, TIME_INDEX_VERSION]).encode(), digest_size=8).hexdigest()
+    path = sidecar_path(dataset_id, f"time-{key}.arrow")
+    try:
+        with span('load_time_index'):
+            index = TimeIndex.load(path)
+    except FileNotFoundError:
+        with span('build_time_index') as current:
+            lines = load_lines(dataset_id, TIME_COLUMNS)
+            current.rows = len(lines)
+            index = TimeIndex(lines)
+        # Indexes of earlier versions of the dataset's files are stale
+        # (another worker building this index may remove them first)
+        for stale in glob.glob(sidecar_path(dataset_id, "time-*.arrow")):
+            if stale != path:
+                with suppress(FileNotFoundError):
+                    os.unlink(stale)
+        index.save(path)
+    with _index_lock:
+        _index_cache[dataset_id] = (signature, index)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def query_dataset(dataset_id: str, granularity: str = 'day', start: Optional[date] = None,
+                  end: Optional[date] = None, location: Optional[str] = None) -> Dict[str, Any]:
+    """Time/location analytics for a stored dataset"""
+    return {
+        'datasetId': dataset_id,
+        **get_time_index(dataset_id).query(granularity, start, end, location),
+    }
@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import logging
+import importlib
+from typing import Optional
+
+from services.ai_service import AnthropicBackend, insight_service
+from services.executor import CPU_EXECUTOR, CPU_WORKERS, report_manager, run_cpu, run_io
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Pre-load lazily imported modules in the background after startup
+# (WARM_START=0 leaves everything to the first request that needs it)
+WARM_START = os.getenv("WARM_START", "1").lower() in ("1", "true", "yes")
+
+# Modules kept out of the app's import (they load on first use) that the
+# warm-up loads ahead of time: the upload pipeline and stored datasets
+# (pandas, numpy and pyarrow), time analytics, Excel reading, PDF reports
+# (building the report styles) and the AI client
+WARM_MODULES = ['services.ingest', 'services.timeseries', 'openpyxl', 'services.report', 'anthropic']
+
+# A few lines in the real export's layout, run through the pipeline once so
+# the CSV reader, the header's schema and pandas' lazily loaded internals
+# are ready before the first upload
+WARM_SAMPLE = (
+    b"Product ID,Product Description,Category,Subcategory,Zero-waste?,Transaction ID,"
+    b"Date,Customer,Location,Amount\n"
+    b"10001,Rolled Oats,Bulk,Oats,zero-waste,3e320,2025-09-01,,in-store,6.49\n"
+    b"10002,Oat Milk,Cooler,Vegan Milk,,3e320,2025-09-01,,in-store,6.49\n"
+    b"10001,Rolled Oats,Bulk,Oats,zero-waste,9d8a5,2025-09-02,P9jaM,delivery,105.41\n"
+)
+
+# Seconds a warmed worker waits for the others to pick up their task
+WORKER_BARRIER_TIMEOUT = 60
+
+# pending -> running -> done (or off when WARM_START is disabled)
+_status = "pending" if WARM_START else "off"
+_task: Optional[asyncio.Task] = None
+
+
+def warm_up() -> float:
+    """
+    Import the lazily loaded modules and run the sample through the pipeline
+
+    Runs in the server process (in a thread) and in each CPU pool worker.
+    Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    from services.analyzer import analyze_frame
+    from services.parser import parse_columns
+    from services.readers import read_upload
+    analyze_frame(parse_columns(read_upload(WARM_SAMPLE, 'warm-up.csv')))
+    return time.perf_counter() - start
+
+
+def _warm_worker(barrier) -> float:
+    """
+    warm_up in a CPU pool worker, then wait until every worker has its task
+
+    A worker that finished early would otherwise take another task and
+    leave a worker cold; with all of them waiting on the barrier each
+    runs exactly one.
+    """
+    seconds = warm_up()
+    barrier.wait(WORKER_BARRIER_TIMEOUT)
+    return seconds
+
+
+def _build_ai_client() -> None:
+    """Create the Claude client now rather than on the first insights call"""
+    if isinstance(insight_service.backend, AnthropicBackend):
+        insight_service.backend.client  # built on first access
+
+
+async def _warm_up() -> None:
+    global _status
+    _status = "running"
+    try:
+        with span('warm_up'):
+            # Server process first; workers start with CPU_PRELOAD loaded
+            # and load the rest here
+            seconds = await run_io(warm_up)
+            await run_io(_build_ai_client)
+            if CPU_EXECUTOR != "thread":
+                # The manager carries progress reports from the workers (and
+                # the barrier); one task per worker starts and warms the pool
+                manager = await run_io(report_manager)
+                barrier = manager.Barrier(CPU_WORKERS)
+                await asyncio.gather(*(run_cpu(_warm_worker, barrier) for _ in range(CPU_WORKERS)))
+        logger.info("warm-up finished", extra={'seconds': round(seconds, 3), 'workers': CPU_WORKERS})
+        _status = "done"
+    except Exception:
+        logger.exception("warm-up failed; modules will load on first use")
+        _status = "failed"
+
+
+def start_warm_up() -> None:
+    """
+    Start the warm-up in the background (FastAPI startup hook)
+
+    The server answers requests, including /health, while it runs; a
+    request that needs a module before it is loaded just loads it itself.
+    """
+    global _task
+    if WARM_START and _task is None:
+        _task = asyncio.ensure_future(_warm_up())
+
+
+def warm_status() -> str:
+    """pending, running, done, failed or off"""
+    return _status
@@ -0,0 +1,187 @@
+"""
+Every analysis path against analyze_data
+
+parse_columns/analyze_frame, parse_compact/analyze_compact, stored
+datasets and streamed CSV uploads must all give the analysis that
+analyze_data gives for parse_excel_file output, which in turn must match
+the original dict-based implementation (reference_analysis).
+"""
+
+import io
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate, joined
+from services import dataset_store, ingest
+from services.analyzer import analyze_compact, analyze_data, analyze_frame
+from services.dataset_store import analyze_dataset, save_dataset
+from services.parser import parse_columns, parse_compact, parse_excel_file
+from services.readers import read_upload
+
+# A CSV export with dirty values. IDs are numeric in some rows and text in
+# others, with leading zeros, blanks and float-looking cells, so a reader
+# that guesses types per chunk reads them differently from a whole-file
+# read. Rows missing a product ID or category are skipped.
+DIRTY_CSV = """Product ID,Product Description,Category,Zero-waste?,Transaction ID
+130,Rolled Oats,Bulk,zero-waste,1001
+131,Oat Milk,Cooler,,1001
+130,Rolled Oats,Bulk,zero-waste,1002
+132,Soap Bar, Household ,,1002
+133,Lentils,Bulk,Waste Free,1003
+131,Oat Milk,Cooler,,1004
+132,Soap Bar,Household,,1004
+,Unknown,Bulk,,1005
+134,Tempeh,,TRUE,1005
+130.0,Rolled Oats,Bulk,zero-waste,
+0042,Honey,Pantry,,1006
+42,Honey,Pantry,,1006
+A12,Kombucha,Cooler,1,1007
+A12,Kombucha,Cooler,1,1.007e3
+131,Oat Milk,Cooler,,
+0042,Honey,Pantry,no,1008
+135,Granola,Pantry,0,1009
+135,Granola,Pantry,0,1009
+131,Oat Milk,Cooler,,1010
+132,Soap Bar,Household,package-free,1010
+"""
+
+
+def reference_analysis(parsed: dict) -> dict:
+    """The original Counter-based analyze_data, kept as the reference"""
+    products = parsed['products']
+    transactions = parsed['transactions']
+    total_products = len(products)
+    category_breakdown = [
+        {'category': cat, 'count': count, 'percentage': round((count / total_products) * 100, 2)}
+        for cat, count in Counter(p['category'] for p in products).items()
+    ]
+    category_zero_waste = defaultdict(lambda: {'zero_waste': 0, 'total': 0})
+    for product in products:
+        category_zero_waste[product['category']]['total'] += 1
+        if product['hasZeroWaste']:
+            category_zero_waste[product['category']]['zero_waste'] += 1
+    zero_waste_adoption = [
+        {
+            'category': cat,
+            'zeroWasteCount': data['zero_waste'],
+            'totalCount': data['total'],
+            'adoptionRate': round((data['zero_waste'] / data['total']) * 100, 2) if data['total'] > 0 else 0,
+        }
+        for cat, data in category_zero_waste.items()
+    ]
+    product_map = {p['productId']: p for p in products}
+    high_risk_products = []
+    for product_id, tx_count in Counter(t['productId'] for t in transactions).items():
+        product = product_map.get(product_id)
+        if product is not None and not product['hasZeroWaste']:
+            high_risk_products.append({
+                'productId': product_id,
+                'description': product['description'],
+                'category': product['category'],
+                'transactionCount': tx_count,
+                'hasZeroWaste': False,
+            })
+    high_risk_products.sort(key=lambda x: x['transactionCount'], reverse=True)
+    total_zero_waste = sum(1 for p in products if p['hasZeroWaste'])
+    return {
+        'categoryBreakdown': category_breakdown,
+        'zeroWasteAdoption': zero_waste_adoption,
+        'highRiskProducts': high_risk_products[:20],
+        'totalProducts': total_products,
+        'totalTransactions': len(transactions),
+        'overallAdoptionRate': round((total_zero_waste / total_products) * 100, 2) if total_products > 0 else 0,
+    }
+
+
+def dirty_frame() -> pd.DataFrame:
+    return read_upload(DIRTY_CSV.encode(), 'dirty.csv')
+
+
+def mixed_type_frame() -> pd.DataFrame:
+    """IDs as Python ints, floats and strings in one column, as Excel reads them"""
+    return pd.DataFrame({
+        'Product ID': [130, 130.0, '130', 7, np.nan, 7.5, 'P-1', 'P-1', 131],
+        'Product Description': ['Oats', 'Oats', 'Oats', 'Tea', 'Tea', 'Jam', 'Soap', 'Soap', None],
+        'Category': ['Bulk', 'Bulk', 'Bulk ', 'Grocery', 'Grocery', 'Grocery', None, 'Household', 'Bulk'],
+        'Zero-waste?': [None, None, None, 'yes', None, False, True, 1, 0.0],
+        'Transaction ID': [1, 2.0, '3', np.nan, 4, 4, 5, 6.0, 6],
+    })
+
+
+FRAMES = {
+    'synthetic': lambda: joined(*generate(5000, products=300, seed=1)),
+    'dirty_csv': dirty_frame,
+    'mixed_types': mixed_type_frame,
+}
+
+
+@pytest.fixture(params=sorted(FRAMES))
+def frame(request) -> pd.DataFrame:
+    return FRAMES[request.param]()
+
+
+@pytest.fixture(autouse=True)
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    monkeypatch.setattr(dataset_store, 'TRANSACTION_INDEX', str(tmp_path / 'transactions.sqlite'))
+
+
+def test_analyze_data_matches_reference(frame):
+    parsed = parse_excel_file(frame)
+    assert analyze_data(parsed) == reference_analysis(parsed)
+
+
+def test_columnar_paths_match_analyze_data(frame):
+    expected = analyze_data(parse_excel_file(frame))
+    assert analyze_frame(parse_columns(frame)) == expected
+    assert analyze_compact(parse_compact(frame)) == expected
+    assert analyze_data(parse_compact(frame)) == expected
+    assert analyze_frame(parse_compact(frame).to_frame()) == expected
+
+
+def test_stored_dataset_matches_analyze_data(frame):
+    save_dataset('a' * 32, parse_columns(frame))
+    assert analyze_dataset('a' * 32) == analyze_data(parse_excel_file(frame))
+
+
+def test_dirty_ids_are_normalized():
+    ids = parse_columns(dirty_frame())[['productId', 'transactionId']]
+    # Read as text: leading zeros and float-looking cells are kept as written
+    assert {'0042', '42', '130', '130.0', 'A12'} <= set(ids['productId'])
+    assert '1.007e3' in set(ids['transactionId'])
+    assert ids['transactionId'].isna().sum() == 2
+
+    mixed = parse_columns(mixed_type_frame())
+    # Whole-number floats are written as integers; 7.5 is not one
+    assert mixed['productId'].tolist() == ['130', '130', '130', '7', '7.5', 'P-1', '131']
+    assert mixed['transactionId'].tolist() == ['1', '2', '3', None, '4', '6', '6']
+
+
+# Chunk sizes that split the dirty file at every row, and in the middle of
+# transactions, plus the default (one chunk)
+@pytest.mark.parametrize('source, chunk_rows', [
+    ('dirty_csv', 1), ('dirty_csv', 3), ('dirty_csv', 7), ('dirty_csv', ingest.CSV_CHUNK_ROWS),
+    ('synthetic', 997), ('synthetic', ingest.CSV_CHUNK_ROWS),
+])
+def test_streamed_csv_matches_batch(source, chunk_rows, monkeypatch):
+    monkeypatch.setattr(ingest, 'CSV_CHUNK_ROWS', chunk_rows)
+    if source == 'dirty_csv':
+        contents = DIRTY_CSV.encode()
+    else:
+        contents = FRAMES['synthetic']().to_csv(index=False).encode()
+    batch = read_upload(contents, 'upload.csv')
+    expected = analyze_data(parse_excel_file(batch))
+    assert analyze_frame(parse_columns(batch)) == expected
+
+    streamed = ingest.analyze_csv_stream(io.BytesIO(contents))
+    assert streamed == expected
+
+    # What the stream stores is what the batch path would have stored
+    writer = dataset_store.DatasetWriter('b' * 32, 'upload.csv')
+    ingest.analyze_csv_stream(io.BytesIO(contents), writer)
+    writer.close()
+    pd.testing.assert_frame_equal(dataset_store.load_lines('b' * 32, ['productId', 'transactionId', 'category']),
+                                  parse_columns(batch)[['productId', 'transactionId', 'category']])
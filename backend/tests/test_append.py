@@ -0,0 +1,128 @@
+"""
+Appending to a stored dataset
+
+Every append must give the same analysis as analyzing the combined
+lines from scratch, with transactions already stored dropped.
+"""
+
+import pandas as pd
+import pytest
+
+from services import dataset_store
+from services.analyzer import analyze_frame
+from services.dataset_store import analyze_dataset, append_lines, load_lines, save_dataset
+from services.parser import parse_columns
+from services.readers import read_upload
+
+HEADER = "Product ID,Product Description,Category,Zero-waste?,Transaction ID\n"
+
+
+@pytest.fixture(autouse=True)
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    monkeypatch.setattr(dataset_store, 'TRANSACTION_INDEX', str(tmp_path / 'transactions.sqlite'))
+
+
+def csv_lines(*rows: str) -> pd.DataFrame:
+    return parse_columns(read_upload((HEADER + "\n".join(rows) + "\n").encode(), 'lines.csv'))
+
+
+def expected(*batches: pd.DataFrame) -> dict:
+    """Analysis of the batches combined, each transaction kept from its first batch"""
+    lines = pd.concat(batches, ignore_index=True)
+    seen = set()
+    keep = []
+    for batch in batches:
+        keep.append(~batch['transactionId'].isin(seen))
+        seen |= set(batch['transactionId'].dropna())
+    return analyze_frame(lines[pd.concat(keep, ignore_index=True)].reset_index(drop=True))
+
+
+def test_append_matches_full_recompute():
+    day0 = csv_lines(
+        "1,Oats,Bulk,,t1", "2,Soap,Beauty,zero-waste,t1", "1,Oats,Bulk,,t2", "3,Milk,Cooler,,t3",
+    )
+    day1 = csv_lines("1,Oats,Bulk,,t4", "3,Milk,Cooler,,t4", "4,Tea,Grocery,,t5")
+    day2 = csv_lines("4,Tea,Grocery,,t6", "1,Oats,Bulk,,t7")
+    save_dataset('a' * 32, day0)
+
+    dataset_id = 'a' * 32
+    for day, batch in enumerate([day1, day2], start=1):
+        dataset_id, analysis = append_lines(dataset_id, batch, f"day{day}")
+        appended = analysis.pop('appended')
+        assert appended == {'rows': len(batch), 'duplicateRows': 0, 'parentDatasetId': appended['parentDatasetId']}
+        assert analysis == analyze_dataset(dataset_id)
+    assert analysis == analyze_frame(pd.concat([day0, day1, day2], ignore_index=True))
+
+
+def test_append_drops_stored_transactions():
+    day0 = csv_lines("1,Oats,Bulk,,t1", "2,Soap,Beauty,,t1", "1,Oats,Bulk,,t2")
+    # t2 is already stored (its lines here are dropped, even the new
+    # product); t3 is new
+    day1 = csv_lines("1,Oats,Bulk,,t2", "5,Jam,Grocery,,t2", "2,Soap,Beauty,,t3", "1,Oats,Bulk,,t3")
+    save_dataset('a' * 32, day0)
+
+    combined_id, analysis = append_lines('a' * 32, day1, 'day1')
+    assert analysis.pop('appended') == {'rows': 2, 'duplicateRows': 2, 'parentDatasetId': 'a' * 32}
+    assert analysis == analyze_dataset(combined_id)
+    assert analysis == expected(day0, day1)
+    assert len(load_lines(combined_id)) == 5
+
+    # Appending on top of the combined dataset sees both days' transactions
+    day2 = csv_lines("1,Oats,Bulk,,t1", "2,Soap,Beauty,,t3", "3,Milk,Cooler,,t4")
+    final_id, analysis = append_lines(combined_id, day2, 'day2')
+    assert analysis.pop('appended')['duplicateRows'] == 2
+    assert analysis == analyze_dataset(final_id)
+    assert analysis == expected(day0, day1, day2)
+
+
+def test_append_leaves_parent_unchanged():
+    day0 = csv_lines("1,Oats,Bulk,,t1", "2,Soap,Beauty,,t2")
+    save_dataset('a' * 32, day0)
+    before = analyze_dataset('a' * 32)
+
+    combined_id, first = append_lines('a' * 32, csv_lines("3,Milk,Cooler,,t3"), 'day1')
+    assert combined_id != 'a' * 32
+    assert analyze_dataset('a' * 32) == before
+
+    # The same upload appended again gives the same dataset
+    again_id, again = append_lines('a' * 32, csv_lines("3,Milk,Cooler,,t3"), 'day1')
+    assert (again_id, again) == (combined_id, first)
+
+    # Nothing new: the parent is returned as is
+    same_id, analysis = append_lines('a' * 32, csv_lines("1,Oats,Bulk,,t1"), 'day0-again')
+    assert same_id == 'a' * 32
+    assert analysis.pop('appended')['duplicateRows'] == 1
+    assert analysis == before
+
+
+def test_ids_read_as_different_dtypes_match():
+    # Whole-number IDs: read as int here, and as float in the appended
+    # file, where a blank transaction ID makes the column float
+    day0 = csv_lines("130,Oats,Bulk,,1001", "131,Soap,Beauty,,1001", "130,Oats,Bulk,,1002")
+    day1 = csv_lines("130,Oats,Bulk,,1002", "131,Soap,Beauty,,", "130,Oats,Bulk,,1003")
+    assert day1['transactionId'].tolist() == ['1002', None, '1003']
+    save_dataset('a' * 32, day0)
+
+    combined_id, analysis = append_lines('a' * 32, day1, 'day1')
+    assert analysis.pop('appended') == {'rows': 2, 'duplicateRows': 1, 'parentDatasetId': 'a' * 32}
+    assert analysis == analyze_dataset(combined_id)
+    assert set(load_lines(combined_id)['productId']) == {'130', '131'}
+    oats = [p for p in analysis['highRiskProducts'] if p['productId'] == '130']
+    assert oats and oats[0]['transactionCount'] == 3
+
+
+def test_ids_from_float_and_str_frames_match():
+    # The same IDs parsed from an Excel-style float column and a text column
+    floats = parse_columns(pd.DataFrame({
+        'Product ID': [10.0, 11.0, None], 'Category': ['Bulk', 'Bulk', 'Bulk'], 'Transaction ID': [7.0, 7.0, 8.0],
+    }))
+    text = parse_columns(pd.DataFrame({
+        'Product ID': ['10', '12'], 'Category': ['Bulk', 'Bulk'], 'Transaction ID': ['7', '9'],
+    }))
+    save_dataset('a' * 32, floats)
+
+    combined_id, analysis = append_lines('a' * 32, text, 'text')
+    assert analysis.pop('appended')['duplicateRows'] == 1
+    assert analysis == analyze_dataset(combined_id)
+    assert load_lines(combined_id)['transactionId'].tolist() == ['7', '7', '9']
@@ -0,0 +1,165 @@
+"""
+CompressionMiddleware
+
+Request bodies are decoded (or refused with 413, 400 or 415), GET
+responses get an ETag and a 304 on If-None-Match, and responses are
+encoded per Accept-Encoding.
+"""
+
+import gzip
+import zlib
+
+import brotli
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from services import responses
+from services.responses import CompressionMiddleware, FastJSONResponse, negotiate_encoding
+
+PAYLOAD = {'rows': [{'productId': f'P{i:05d}', 'category': 'Bulk', 'count': i} for i in range(200)]}
+
+
+@pytest.fixture
+def client():
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(CompressionMiddleware)
+
+    @app.post('/echo')
+    async def echo(request: Request):
+        body = await request.body()
+        return {'length': len(body), 'contentLength': request.headers.get('content-length'),
+                'contentEncoding': request.headers.get('content-encoding'), 'text': body.decode()}
+
+    @app.get('/data')
+    async def data():
+        return PAYLOAD
+
+    @app.get('/small')
+    async def small():
+        return {'ok': True}
+
+    @app.get('/tagged')
+    async def tagged():
+        return FastJSONResponse(PAYLOAD, headers={'ETag': '"v1"'})
+
+    @app.get('/stream')
+    async def stream():
+        return StreamingResponse(iter([b'{"a": 1}\n', b'{"b": 2}\n']), media_type='application/x-ndjson')
+
+    return TestClient(app)
+
+
+# Request bodies
+
+@pytest.mark.parametrize('encoding, encode', [
+    ('gzip', gzip.compress),
+    ('deflate', zlib.compress),
+    ('br', brotli.compress),
+])
+def test_request_body_decoded(client, encoding, encode):
+    text = 'x' * 5000
+    response = client.post('/echo', content=encode(text.encode()), headers={'Content-Encoding': encoding})
+    assert response.status_code == 200
+    assert response.json() == {'length': 5000, 'contentLength': '5000', 'contentEncoding': None, 'text': text}
+
+
+@pytest.mark.parametrize('encoding, encode', [('gzip', gzip.compress), ('br', brotli.compress)])
+def test_request_body_too_large(client, monkeypatch, encoding, encode):
+    monkeypatch.setattr(responses, 'MAX_REQUEST_BYTES', 1000)
+    assert client.post('/echo', content=encode(b'x' * 1000),
+                       headers={'Content-Encoding': encoding}).status_code == 200
+
+    response = client.post('/echo', content=encode(b'x' * 1001), headers={'Content-Encoding': encoding})
+    assert response.status_code == 413
+    assert 'larger than 1000 bytes' in response.json()['detail']
+
+
+@pytest.mark.parametrize('encoding, body', [
+    ('gzip', b'not gzip at all'),
+    ('gzip', gzip.compress(b'x' * 5000)[:-10]),
+    ('br', b'not brotli at all'),
+    ('br', brotli.compress(b'x' * 5000)[:-2]),
+])
+def test_request_body_corrupt(client, encoding, body):
+    response = client.post('/echo', content=body, headers={'Content-Encoding': encoding})
+    assert response.status_code == 400
+    assert response.json()['detail'].startswith('Invalid')
+
+
+def test_request_encoding_unsupported(client):
+    response = client.post('/echo', content=b'abc', headers={'Content-Encoding': 'zstd'})
+    assert response.status_code == 415
+    assert response.json() == {'detail': 'Unsupported Content-Encoding: zstd'}
+
+
+# Conditional GETs
+
+def test_etag_and_not_modified(client):
+    first = client.get('/data', headers={'Accept-Encoding': 'identity'})
+    etag = first.headers['etag']
+    assert etag.startswith('W/"')
+
+    # The tag names the content, not its encoding
+    assert client.get('/data', headers={'Accept-Encoding': 'gzip'}).headers['etag'] == etag
+
+    response = client.get('/data', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+    assert 'content-type' not in response.headers
+
+    # Strong form, lists and * match as well
+    for header in (etag[2:], f'"other", {etag}', '*'):
+        assert client.get('/data', headers={'If-None-Match': header}).status_code == 304
+    assert client.get('/data', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_endpoint_etag_kept(client):
+    response = client.get('/tagged')
+    assert response.headers['etag'] == '"v1"'
+    assert client.get('/tagged', headers={'If-None-Match': 'W/"v1"'}).status_code == 304
+
+
+def test_no_etag_on_post(client):
+    response = client.post('/echo', content=b'abc', headers={'If-None-Match': '*'})
+    assert response.status_code == 200
+    assert 'etag' not in response.headers
+
+
+# Response encoding
+
+@pytest.mark.parametrize('accept, expected', [
+    ('gzip', 'gzip'),
+    ('br', 'br'),
+    ('gzip, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br;q=0, gzip;q=0', None),
+    ('*', 'br'),
+    ('*;q=0.1, gzip;q=0.5', 'gzip'),
+    ('identity', None),
+    ('', None),
+])
+def test_accept_encoding(client, accept, expected):
+    assert negotiate_encoding(accept) == expected
+
+    response = client.get('/data', headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.headers.get('content-encoding') == expected
+    assert response.headers['vary'] == 'Accept-Encoding'
+    # The client decodes the body, so it is the same whatever the encoding
+    assert response.json() == PAYLOAD
+
+
+def test_small_body_sent_plain(client):
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+    assert response.json() == {'ok': True}
+
+
+def test_stream_untouched(client):
+    response = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+    assert 'etag' not in response.headers
+    assert response.content == b'{"a": 1}\n{"b": 2}\n'
@@ -0,0 +1,170 @@
+"""
+HyperLogLog, FrequentItems and SketchAnalysis
+
+Kept counts must stay within the Misra-Gries bound, merging must not
+depend on the order summaries come in, and on skewed data the sketch must
+rank the same top 20 high-risk products as the exact analysis.
+"""
+
+import itertools
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate, joined
+from services.analyzer import SketchAnalysis, analyze_frame
+from services.parser import parse_columns
+from services.sketches import FrequentItems, HyperLogLog
+
+
+def skewed_keys(n: int, seed: int) -> np.ndarray:
+    """Zipf-distributed integer keys, a few heavy and a long tail"""
+    return np.random.default_rng(seed).zipf(1.3, n) % 2000
+
+
+def summaries(parts, capacity: int = 50):
+    out = []
+    for keys in parts:
+        summary = FrequentItems(capacity)
+        summary.add(keys)
+        out.append(summary)
+    return out
+
+
+def merged(parts, order):
+    total = FrequentItems(parts[0].capacity)
+    for i in order:
+        total.merge(parts[i])
+    return total
+
+
+def test_frequent_items_count_bound():
+    keys = skewed_keys(20_000, seed=0)
+    summary = FrequentItems(50)
+    # In chunks, so the summary is cut many times
+    for offset in range(0, len(keys), 700):
+        summary.add(keys[offset:offset + 700])
+
+    true = Counter(keys.tolist())
+    assert summary.total == len(keys)
+    assert len(summary.counts) <= summary.capacity
+    assert 0 < summary.error <= summary.total / (summary.capacity + 1)
+    for key, count in summary.counts.items():
+        assert true[key] - summary.error <= count <= true[key]
+    # Any key above the bound must have been kept
+    for key, count in true.items():
+        if count > summary.error:
+            assert key in summary.counts.index
+
+
+def test_frequent_items_merge_bound():
+    parts = [skewed_keys(5000, seed) for seed in range(4)]
+    total = merged(summaries(parts), range(4))
+    total.top()
+
+    true = Counter(np.concatenate(parts).tolist())
+    assert total.total == sum(true.values())
+    assert total.error <= total.total / (total.capacity + 1)
+    for key, count in total.counts.items():
+        assert true[key] - total.error <= count <= true[key]
+
+
+def test_frequent_items_merge_order():
+    parts = summaries([skewed_keys(5000, seed) for seed in range(4)])
+    results = set()
+    for order in itertools.permutations(range(4)):
+        total = merged(parts, order)
+        results.add((tuple(total.top().items()), total.error, total.total))
+    assert len(results) == 1
+
+
+def test_frequent_items_exact_under_capacity():
+    parts = [skewed_keys(500, seed) % 40 for seed in range(3)]
+    for order in itertools.permutations(range(3)):
+        total = merged(summaries(parts), order)
+        assert total.error == 0
+        assert total.counts.to_dict() == Counter(np.concatenate(parts).tolist())
+
+
+def test_hyperloglog_merge_order():
+    parts = [np.arange(i * 3000, i * 3000 + 5000) for i in range(4)]
+    sketches = []
+    for values in parts:
+        sketch = HyperLogLog(12)
+        sketch.add(values)
+        sketches.append(sketch)
+
+    whole = HyperLogLog(12)
+    whole.add(np.concatenate(parts))
+    for order in itertools.permutations(range(4)):
+        total = HyperLogLog(12)
+        for i in order:
+            total.merge(sketches[i])
+        np.testing.assert_array_equal(total.registers, whole.registers)
+
+    true = len(np.unique(np.concatenate(parts)))
+    assert abs(whole.count() / true - 1) < 4 * whole.relative_error
+
+
+def test_hyperloglog_skips_missing():
+    sketch = HyperLogLog(10)
+    sketch.add(['a', None, 'b', np.nan, 'a'])
+    assert sketch.count() == 2
+
+
+def test_hyperloglog_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+
+@pytest.fixture(scope='module')
+def skewed_lines():
+    # Many distinct products with Zipf-like popularity, far more than the
+    # sketch has counters
+    return parse_columns(joined(*generate(60_000, products=20_000, seed=3)))
+
+
+def sketch_of(lines, chunk_rows: int) -> SketchAnalysis:
+    sketch = SketchAnalysis(top_k_error=0.005)
+    for offset in range(0, len(lines), chunk_rows):
+        sketch.add(lines.iloc[offset:offset + chunk_rows])
+    return sketch
+
+
+def test_sketch_keeps_exact_top_20(skewed_lines):
+    exact = analyze_frame(skewed_lines)
+    sketch = sketch_of(skewed_lines, 5000)
+    assert sketch.high_risk.error > 0
+    approx = sketch.result()
+
+    true_counts = {p['productId']: p['transactionCount'] for p in exact['highRiskProducts']}
+    assert [p['productId'] for p in approx['highRiskProducts']] == list(true_counts)
+    error = approx['approximate']['highRiskProducts']['maxCountError']
+    for product in approx['highRiskProducts']:
+        assert true_counts[product['productId']] - error <= product['transactionCount'] \
+            <= true_counts[product['productId']]
+    for key in ('categoryBreakdown', 'zeroWasteAdoption', 'totalProducts', 'totalTransactions',
+                'overallAdoptionRate'):
+        assert approx[key] == exact[key]
+
+
+def test_sketch_analysis_merge_order(skewed_lines):
+    parts = [sketch_of(skewed_lines.iloc[offset:offset + 15_000], 5000)
+             for offset in range(0, len(skewed_lines), 15_000)]
+    results = []
+    for order in itertools.permutations(range(len(parts))):
+        total = SketchAnalysis(top_k_error=0.005)
+        for i in order:
+            total.merge(parts[i])
+        result = total.result()
+        # Categories are listed in the order they were first seen
+        for key in ('categoryBreakdown', 'zeroWasteAdoption'):
+            result[key].sort(key=lambda entry: entry['category'])
+        results.append(result)
+    assert all(result == results[0] for result in results)
+
+    exact = analyze_frame(skewed_lines)
+    assert [p['productId'] for p in results[0]['highRiskProducts']] == \
+        [p['productId'] for p in exact['highRiskProducts']]
+    assert results[0]['totalProducts'] == len(skewed_lines)
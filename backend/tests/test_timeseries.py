@@ -0,0 +1,76 @@
+"""
+Time index of a stored dataset
+
+A saved index loaded in another process must answer queries exactly
+like the index built from the lines.
+"""
+
+import glob
+
+import pytest
+
+from benchmarks.synthetic import generate, joined
+from services import dataset_store, timeseries
+from services.dataset_store import save_dataset
+from services.parser import parse_columns
+from services.timeseries import TimeIndex, get_time_index
+
+DATASET_ID = 'b' * 32
+
+
+@pytest.fixture(autouse=True)
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_store, 'DATASET_DIR', str(tmp_path))
+    monkeypatch.setattr(dataset_store, 'TRANSACTION_INDEX', str(tmp_path / 'transactions.sqlite'))
+    timeseries._index_cache.clear()
+    yield
+    timeseries._index_cache.clear()
+
+
+@pytest.fixture
+def lines():
+    lines = parse_columns(joined(*generate(2000, locations=3)))
+    lines.loc[lines.index[:25], 'date'] = None
+    return lines
+
+
+def test_saved_index_matches_built(lines, tmp_path):
+    built = TimeIndex(lines)
+    built.save(str(tmp_path / 'index.arrow'))
+    loaded = TimeIndex.load(str(tmp_path / 'index.arrow'))
+    for granularity in ('day', 'week', 'month'):
+        assert loaded.query(granularity=granularity) == built.query(granularity=granularity)
+    location = built.locations[1]
+    assert loaded.query(location=location) == built.query(location=location)
+
+
+def test_undated_lines_reported(lines):
+    result = TimeIndex(lines).query()
+    assert result['undatedLines'] == 25
+    assert result['totals']['lines'] == len(lines) - 25
+
+
+def test_index_saved_next_to_dataset(lines, tmp_path):
+    save_dataset(DATASET_ID, lines)
+    index = get_time_index(DATASET_ID)
+    sidecars = glob.glob(str(tmp_path / f'{DATASET_ID}.time-*.arrow'))
+    assert len(sidecars) == 1
+
+    # Another process starts with an empty cache and loads the sidecar
+    timeseries._index_cache.clear()
+    assert get_time_index(DATASET_ID).query() == index.query()
+    assert glob.glob(str(tmp_path / f'{DATASET_ID}.time-*.arrow')) == sidecars
+
+
+def test_stale_index_removed_by_another_worker(lines, tmp_path, monkeypatch):
+    save_dataset(DATASET_ID, lines)
+    stale = tmp_path / f'{DATASET_ID}.time-0000000000000000.arrow'
+    stale.write_bytes(b'')
+    gone = str(tmp_path / f'{DATASET_ID}.time-1111111111111111.arrow')
+    # The other worker's build removed this one between glob and unlink
+    found = glob.glob
+    monkeypatch.setattr(timeseries.glob, 'glob', lambda pattern: found(pattern) + [gone])
+
+    get_time_index(DATASET_ID)
+    assert not stale.exists()
+    assert len(found(str(tmp_path / f'{DATASET_ID}.time-*.arrow'))) == 1